@@ -1,6 +1,21 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import stashapi.log as log
 
+# Settings
+MAX_CONCURRENT_SCRAPES = 4   # Scrapes Stash runs at once; each one hits the movie's site
+CACHE_TTL_DAYS = 7           # Reuse a scrape of the same URL for this long
+UPDATE_BATCH_SIZE = 10       # movieUpdate mutations per request; images make them large
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scrape_cache.db")
+
+IMAGE_FIELDS = ("front_image", "back_image")
+
 # GraphQL queries
 all_movies_query = """
 query AllMovies {
@@ -8,6 +23,10 @@ query AllMovies {
         id
         name
         url
+        date
+        synopsis
+        front_image_path
+        back_image_path
     }
 }
 """
@@ -24,21 +43,6 @@ query ScrapeMovieURL($url: String!) {
 }
 """
 
-movie_update_mutation = """
-mutation MovieUpdate($id: ID!, $name: String!, $date: String!, $synopsis: String!, $front_image: String!, $back_image: String!) {
-    movieUpdate(input: {
-        id: $id
-        name: $name
-        date: $date
-        synopsis: $synopsis
-        front_image: $front_image
-        back_image: $back_image
-    }) {
-        id
-    }
-}
-"""
-
 # GraphQL endpoint
 graphql_endpoint = "http://localhost:9999/graphql"
 
@@ -50,55 +54,233 @@ def send_query(query, variables=None):
     response = requests.post(graphql_endpoint, json=payload)
     return response.json()
 
-if __name__ == "__main__":
-    # Step 1: Fetch all movies and their URLs
+def digest(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest() if value else None
+
+def image_digest(scraped, field):
+    # Cached scrapes keep only the digest of each image, fresh ones carry the image itself
+    if scraped.get(field):
+        return digest(scraped[field])
+    return scraped.get(f"{field}_digest")
+
+def compact(scraped):
+    """A scrape without its base64 images, which are replaced by their digests."""
+    result = {field: value for field, value in scraped.items() if field not in IMAGE_FIELDS}
+    for field in IMAGE_FIELDS:
+        result[f"{field}_digest"] = image_digest(scraped, field)
+    return result
+
+
+class ScrapeCache:
+    """Scrape results by URL, what was last written to each movie, and progress of the current run.
+
+    Scrapes are stored without their images, only with the images' digests.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS scrapes (
+                url TEXT PRIMARY KEY,
+                fetched REAL NOT NULL,
+                result TEXT
+            );
+            CREATE TABLE IF NOT EXISTS movies (
+                movie_id TEXT PRIMARY KEY,
+                url TEXT,
+                front_image TEXT,
+                back_image TEXT,
+                checked REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+    def scrape(self, url, ttl):
+        row = self.db.execute("SELECT fetched, result FROM scrapes WHERE url = ?", (url,)).fetchone()
+        if row and time.time() - row["fetched"] < ttl:
+            return json.loads(row["result"]) if row["result"] else None, True
+        return None, False
+
+    def store_scrape(self, url, result):
+        # Committed right away so an interrupted run keeps what it already scraped
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO scrapes (url, fetched, result) VALUES (?, ?, ?)",
+                            (url, time.time(), json.dumps(compact(result)) if result else None))
+
+    def applied(self, movie_id):
+        row = self.db.execute("SELECT * FROM movies WHERE movie_id = ?", (movie_id,)).fetchone()
+        return dict(row) if row else {}
+
+    def mark_checked(self, movie_id, url, scraped):
+        current = self.applied(movie_id)
+        hashes = {field: (image_digest(scraped, field) if scraped else None) or current.get(field)
+                  for field in IMAGE_FIELDS}
+        self.db.execute(
+            "INSERT OR REPLACE INTO movies (movie_id, url, front_image, back_image, checked) VALUES (?, ?, ?, ?, ?)",
+            (movie_id, url, hashes["front_image"], hashes["back_image"], time.time())
+        )
+
+    def start_run(self):
+        """Start time of the unfinished run to resume, or of a new one."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'run_started'").fetchone()
+        if row:
+            return float(row["value"]), True
+        started = time.time()
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('run_started', ?)", (str(started),))
+        return started, False
+
+    def finish_run(self):
+        with self.db:
+            self.db.execute("DELETE FROM meta WHERE key = 'run_started'")
+            self.db.execute("DELETE FROM scrapes WHERE fetched < ?", (time.time() - CACHE_TTL_DAYS * 86400,))
+
+
+def scrape(movie):
+    try:
+        response = send_query(scrape_movie_query, variables={"url": movie["url"]})
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.error(f"Failed to scrape movie '{movie['name']}': {e}")
+        return movie, None, False
+    scraped = (response.get("data") or {}).get("scrapeMovieURL")
+    if response.get("errors"):
+        log.error(f"Failed to scrape movie '{movie['name']}': {response['errors']}")
+        # Not cached, so the next run tries again
+        return movie, scraped, scraped is not None
+    return movie, scraped, True
+
+def has_image(image_path):
+    # Stash serves a placeholder, flagged with default=true, for movies without an image
+    return bool(image_path) and "default=true" not in image_path
+
+def changed_fields(movie, scraped, applied):
+    """Scraped values that differ from the movie; empty scraped values never clear a field.
+
+    An image that differs from a cached scrape maps to None, as the cache has only its digest.
+    """
+    changes = {}
+    for field in ("name", "date", "synopsis"):
+        value = scraped.get(field)
+        if value and value != (movie.get(field) or ""):
+            changes[field] = value
+    for field in IMAGE_FIELDS:
+        value_digest = image_digest(scraped, field)
+        if not value_digest:
+            continue
+        # Stash does not expose image hashes, so compare with what this script last uploaded
+        if not has_image(movie.get(f"{field}_path")) or applied.get(field) != value_digest:
+            changes[field] = scraped.get(field)
+    return changes
+
+def needs_images(changes):
+    return any(field in changes and changes[field] is None for field in IMAGE_FIELDS)
+
+def update_movies(updates):
+    """Send one request with an aliased movieUpdate per movie; returns the IDs that were updated."""
+    parameters = ", ".join(f"$m{i}: MovieUpdateInput!" for i in range(len(updates)))
+    fields = "\n".join(f"u{i}: movieUpdate(input: $m{i}) {{ id }}" for i in range(len(updates)))
+    variables = {f"m{i}": dict(changes, id=movie["id"]) for i, (movie, changes) in enumerate(updates)}
+    try:
+        response = send_query(f"mutation MovieUpdates({parameters}) {{\n{fields}\n}}", variables)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.error(f"Failed to update {len(updates)} movies: {e}")
+        return set()
+    if response.get("errors"):
+        log.error(f"Errors while updating movies: {response['errors']}")
+    data = response.get("data") or {}
+    return {movie["id"] for i, (movie, _) in enumerate(updates) if data.get(f"u{i}")}
+
+def main(force=False):
+    cache = ScrapeCache(CACHE_PATH)
+    ttl = 0 if force else CACHE_TTL_DAYS * 86400
+
+    # Step 1: Fetch all movies and their current metadata
     response = send_query(all_movies_query)
     movies = response["data"]["allMovies"]
     total_movies = len(movies)
-    processed_movies = 0
 
-    log.info("Scraping and updating movies...")
+    run_started, resuming = cache.start_run()
+    if resuming:
+        log.info("Resuming the previous run; movies it already checked are skipped.")
 
-    # Iterating through movies
+    todo = []
+    blank_urls = resumed = 0
     for movie in movies:
-        movie_id = movie["id"]
-        movie_name = movie["name"]
-        movie_url = movie["url"]
-        
-        if not movie_url:
-            log.warning(f"Skipping movie '{movie_name}' due to blank URL.")
+        if not movie["url"]:
+            log.warning(f"Skipping movie '{movie['name']}' due to blank URL.")
+            blank_urls += 1
+            continue
+        if resuming and cache.applied(movie["id"]).get("checked", 0) >= run_started:
+            resumed += 1
             continue
+        todo.append(movie)
 
-        # Step 3: Send GraphQL query to scrape metadata
-        scrape_variables = {"url": movie_url}
-        scrape_response = send_query(scrape_movie_query, variables=scrape_variables)
-        scraped_data = scrape_response["data"]["scrapeMovieURL"]
-        
-        # Step 4: Extract scraped metadata
-        name = scraped_data.get("name", "")
-        date = scraped_data.get("date", "")
-        synopsis = scraped_data.get("synopsis", "")
-        front_image = scraped_data.get("front_image", "")
-        back_image = scraped_data.get("back_image", "")
-
-        # Step 5: Send GraphQL mutation to update movie record
-        update_variables = {
-            "id": movie_id,
-            "name": name,
-            "date": date,
-            "synopsis": synopsis,
-            "front_image": front_image,
-            "back_image": back_image
-        }
-        update_response = send_query(movie_update_mutation, variables=update_variables)
-        if "errors" in update_response:
-            log.error(f"Failed to update movie {movie_name}: {update_response['errors']}")
+    # Step 2: Split into movies with a fresh cached scrape and movies to scrape now.
+    # A cached scrape whose image changed is scraped again, the cache only has the image's digest.
+    cached = []
+    to_scrape = []
+    for movie in todo:
+        scraped, hit = cache.scrape(movie["url"], ttl)
+        if hit and not (scraped and needs_images(changed_fields(movie, scraped, cache.applied(movie["id"])))):
+            cached.append((movie, scraped))
         else:
-            log.info(f"Movie {movie_name} (ID: {movie_id}) updated successfully.")  # Log the name and ID of the updated movie
+            to_scrape.append(movie)
+    log.info(f"Checking {len(todo)} of {total_movies} movies ({blank_urls} without URL, {resumed} already checked): "
+             f"{len(cached)} cached, {len(to_scrape)} to scrape.")
+
+    # Movies skipped above count as processed, so progress reaches 1.0 with the last one checked
+    processed_movies = blank_urls + resumed
+    log.progress(processed_movies / total_movies if total_movies else 0.0)
+    updated_movies = 0
+    pending = []
+
+    def flush():
+        nonlocal updated_movies
+        if not pending:
+            return
+        updated = update_movies([(movie, changes) for movie, scraped, changes in pending])
+        with cache.db:
+            for movie, scraped, changes in pending:
+                # Failed updates are not marked, so the next run retries them
+                if movie["id"] in updated:
+                    cache.mark_checked(movie["id"], movie["url"], scraped)
+                    log.info(f"Movie {movie['name']} (ID: {movie['id']}) updated: {', '.join(changes)}.")
+        updated_movies += len(updated)
+        pending.clear()
 
-        # Update progress
+    def handle(movie, scraped):
+        nonlocal processed_movies
+        changes = changed_fields(movie, scraped, cache.applied(movie["id"])) if scraped else {}
+        if changes:
+            pending.append((movie, scraped, changes))
+            if len(pending) >= UPDATE_BATCH_SIZE:
+                flush()
+        else:
+            with cache.db:
+                cache.mark_checked(movie["id"], movie["url"], scraped)
         processed_movies += 1
-        progress = processed_movies / total_movies
-        log.progress(progress)
+        log.progress(processed_movies / total_movies)
+
+    for movie, scraped in cached:
+        handle(movie, scraped)
+
+    # Step 3: Scrape the rest on a bounded pool and send only the changed fields, in batches
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SCRAPES) as executor:
+        for movie, scraped, ok in executor.map(scrape, to_scrape):
+            if not ok:
+                processed_movies += 1
+                continue
+            cache.store_scrape(movie["url"], scraped)
+            handle(movie, scraped)
+    flush()
 
-    log.info("All movies scraped and updated successfully.")
+    cache.finish_run()
+    log.progress(1.0)
+    log.info(f"Checked {len(todo)} movies, updated {updated_movies}.")
+
+if __name__ == "__main__":
+    main(force="--force" in sys.argv)
@@ -2,9 +2,36 @@ import re
 import requests
 import stashapi.log as log
 
+# Settings
+SCENES_PER_PAGE = 1000
+UPDATES_PER_REQUEST = 50     # Aliased sceneUpdate mutations sent in one request
+
+graphql_endpoint = "http://localhost:9999/graphql"
+
+# Title normalization, compiled once rather than per scene
+EXTENSION = re.compile(r'\.[^.]*$')
+
+scenes_page_query = """
+    query StudioScenesPage($studios: [ID!], $page: Int!, $per_page: Int!) {
+        findScenes(
+            scene_filter: { studios: { value: $studios, modifier: INCLUDES } },
+            filter: { page: $page, per_page: $per_page, sort: "id", direction: ASC }
+        ) {
+            count
+            scenes {
+                id
+                title
+                files {
+                    basename
+                }
+            }
+        }
+    }
+"""
+
 # Function to find studio ID, specifically looking for the studio named "Movie"
 def find_studio_id():
-    find_studios_url = "http://localhost:9999/graphql"
+    find_studios_url = graphql_endpoint
     find_studios_payload = {
         "query": """
             query FindStudios {
@@ -30,101 +57,91 @@ def find_studio_id():
         return None
 
 def find_scenes(studio_id):
-    find_scenes_url = "http://localhost:9999/graphql"
-    find_scenes_payload = {
-        "query": f"""
-            query FindScenes {{
-                findScenes(
-                    scene_filter: {{ studios: {{ value: "{studio_id}", modifier: EQUALS }} }},
-                    filter: {{ per_page: -1 }}
-                ) {{
-                    scenes {{
-                        id
-                        title
-                    }}
-                }}
-            }}
-        """
-    }
-    try:
-        response = requests.post(find_scenes_url, json=find_scenes_payload)
-        result = response.json()
-        if "data" in result and "findScenes" in result["data"]:
-            log.info("Scenes found successfully.")
-            return result["data"]["findScenes"]["scenes"]
-        else:
+    """Every scene of the studio with its title and file basenames, fetched a page at a time."""
+    scenes = []
+    page = 1
+    while True:
+        try:
+            response = requests.post(graphql_endpoint, json={
+                "query": scenes_page_query,
+                "variables": {"studios": [studio_id], "page": page, "per_page": SCENES_PER_PAGE}
+            })
+            result = response.json()
+        except Exception as e:
+            log.error(f"Exception in finding scenes: {str(e)}")
+            return None
+        if not result.get("data") or not result["data"].get("findScenes"):
             log.error(f"Error finding scenes: {result.get('errors')}")
             return None
-    except Exception as e:
-        log.error(f"Exception in finding scenes: {str(e)}")
-        return None
+        found = result["data"]["findScenes"]
+        scenes.extend(found["scenes"])
+        log.progress(min(len(scenes) / max(found["count"], 1), 1.0) / 2)
+        if len(found["scenes"]) < SCENES_PER_PAGE:
+            break
+        page += 1
+    log.info(f"Found {len(scenes)} scenes.")
+    return scenes
 
-def find_scene_details(scene_id):
-    find_scene_query = f"""
-        query FindScene {{
-            findScene(id: {scene_id}) {{
-                title
-                files {{
-                    basename
-                }}
-            }}
-        }}
-    """
-    try:
-        response = requests.post("http://localhost:9999/graphql", json={"query": find_scene_query})
-        result = response.json()
-        if "data" in result and "findScene" in result["data"]:
-            log.info("Scene details retrieved successfully.")
-            return result["data"]["findScene"]
-        else:
-            log.error(f"Error finding scene details: {result.get('errors')}")
-            return None
-    except Exception as e:
-        log.error(f"Exception in finding scene details: {str(e)}")
-        return None
+def title_from_basename(file_basename):
+    return EXTENSION.sub('', file_basename)
 
-def update_title_with_basename(scene_id, file_basename):
-    title = re.sub(r'\.[^.]*$', '', file_basename)
-    update_scene_mutation = f"""
-        mutation SceneUpdate {{
-            sceneUpdate(input: {{ id: {scene_id}, title: "{title}" }}) {{
-                title
-            }}
-        }}
-    """
+def title_corrections(scenes):
+    """(scene ID, new title) for every untitled scene with a file, named after its first file."""
+    return [(scene["id"], title_from_basename(scene["files"][0]["basename"]))
+            for scene in scenes
+            if not scene["title"] and scene["files"]]
+
+def update_titles(batch):
+    """Send one request with an aliased sceneUpdate per correction; returns the IDs that were updated."""
+    parameters = ", ".join(f"$id{i}: ID!, $title{i}: String" for i in range(len(batch)))
+    fields = "\n".join(
+        f"u{i}: sceneUpdate(input: {{ id: $id{i}, title: $title{i} }}) {{ id }}" for i in range(len(batch))
+    )
+    variables = {}
+    for i, (scene_id, title) in enumerate(batch):
+        variables[f"id{i}"] = scene_id
+        variables[f"title{i}"] = title
     try:
-        log.debug(f"GraphQL Mutation to Update Scene Title: {update_scene_mutation}")
-        response = requests.post("http://localhost:9999/graphql", json={"query": update_scene_mutation})
+        response = requests.post(graphql_endpoint, json={
+            "query": f"mutation UpdateSceneTitles({parameters}) {{\n{fields}\n}}",
+            "variables": variables
+        })
         result = response.json()
-        if result.get("data"):
-            log.info(f"Updated Scene ID: {scene_id} with new title: {title}")
-        else:
-            log.error(f"Failed to update title for Scene ID: {scene_id}")
     except Exception as e:
-        log.error(f"Exception during mutation for Scene ID: {scene_id}: {str(e)}")
+        log.error(f"Exception while updating {len(batch)} scene titles: {str(e)}")
+        return set()
+    if result.get("errors"):
+        log.error(f"Errors while updating scene titles: {result['errors']}")
+    data = result.get("data") or {}
+    return {scene_id for i, (scene_id, _) in enumerate(batch) if data.get(f"u{i}")}
 
-if __name__ == "__main__":
+def main():
     log.info("Starting process to find scenes for Studio: Movie")
     studio_id = find_studio_id()
+    if not studio_id:
+        log.error("Failed to retrieve studio ID for 'Movie'.")
+        return
 
-    if studio_id:
-        scenes = find_scenes(studio_id)
+    scenes = find_scenes(studio_id)
+    if not scenes:
+        log.error("No scenes found for studio.")
+        return
 
-        if scenes:
-            log.info("Processing scenes for updates.")
-            for scene in scenes:
-                scene_details = find_scene_details(scene['id'])
+    corrections = title_corrections(scenes)
+    log.info(f"{len(corrections)} of {len(scenes)} scenes need a title.")
+    updated = 0
+    for start in range(0, len(corrections), UPDATES_PER_REQUEST):
+        batch = corrections[start:start + UPDATES_PER_REQUEST]
+        done = update_titles(batch)
+        for scene_id, title in batch:
+            if scene_id in done:
+                log.debug(f"Updated Scene ID: {scene_id} with new title: {title}")
+            else:
+                log.error(f"Failed to update title for Scene ID: {scene_id}")
+        updated += len(done)
+        log.progress(0.5 + (start + len(batch)) / len(corrections) / 2)
+    log.progress(1.0)
+    log.info(f"Updated the titles of {updated} scenes.")
 
-                if scene_details:
-                    title = scene_details["title"]
-                    file_basename = scene_details["files"][0]["basename"] if scene_details["files"] else None
-                    if not title and file_basename:
-                        update_title_with_basename(scene['id'], file_basename)
-                    else:
-                        log.info(f"No update needed for Scene ID: {scene['id']}.")
-                else:
-                    log.error("Failed to retrieve details for scene.")
-        else:
-            log.error("No scenes found for studio.")
-    else:
-        log.error("Failed to retrieve studio ID for 'Movie'.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark the title check against a synthetic "Movie" studio.
+
+Runs the task, and the per-scene approach it replaced, against an in-process
+stand-in for Stash holding a studio of synthetic scenes, and reports requests
+sent and time taken. Real round trips to Stash are not made; --round-trip-ms
+projects what the request counts cost at a given latency.
+
+Usage: python benchmark_titles.py [--scenes 50000] [--untitled 0.3] [--round-trip-ms 5]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import importlib.util
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Movie-Fy Check and Update Scene Titles.py")
+
+
+class Response:
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeStash:
+    """Answers the queries the title check sends, for one studio of synthetic scenes."""
+
+    def __init__(self, scene_count, untitled, seed=1):
+        rng = random.Random(seed)
+        self.scenes = {}
+        for i in range(1, scene_count + 1):
+            name = f"Movie {rng.randint(1, scene_count // 4 or 1)} - Scene {rng.randint(1, 12)}"
+            self.scenes[str(i)] = {
+                "id": str(i),
+                "title": None if rng.random() < untitled else name,
+                "files": [{"basename": f"{name}.{rng.choice(['mp4', 'mkv', 'wmv'])}"}] if rng.random() > 0.01 else [],
+            }
+        self.requests = 0
+
+    def post(self, url, json=None, **kwargs):
+        self.requests += 1
+        query = json["query"]
+        variables = json.get("variables") or {}
+        if "findStudios" in query:
+            return Response({"data": {"findStudios": {"studios": [{"id": "1"}]}}})
+        if "findScenes" in query:
+            scenes = list(self.scenes.values())
+            per_page = variables.get("per_page", -1)
+            if per_page > 0:
+                start = (variables["page"] - 1) * per_page
+                page = scenes[start:start + per_page]
+            else:
+                page = [{"id": scene["id"], "title": scene["title"]} for scene in scenes]
+            return Response({"data": {"findScenes": {"count": len(scenes), "scenes": page}}})
+        if "findScene(" in query:
+            scene = self.scenes[re.search(r'findScene\(id: (\d+)\)', query).group(1)]
+            return Response({"data": {"findScene": {"title": scene["title"], "files": scene["files"]}}})
+        if variables:
+            # Aliased, parameterized updates
+            data = {}
+            for key, scene_id in variables.items():
+                if key.startswith("id"):
+                    i = key[2:]
+                    self.scenes[scene_id]["title"] = variables[f"title{i}"]
+                    data[f"u{i}"] = {"id": scene_id}
+            return Response({"data": data})
+        # A single update with its values interpolated into the query
+        match = re.search(r'id: (\d+), title: "(.*)" \}', query)
+        self.scenes[match.group(1)]["title"] = match.group(2)
+        return Response({"data": {"sceneUpdate": {"title": match.group(2)}}})
+
+
+def per_scene(module):
+    """The approach the task used before: one findScene and one sceneUpdate per scene."""
+    studio_id = module.find_studio_id()
+    response = module.requests.post(module.graphql_endpoint, json={"query": f"""
+        query FindScenes {{
+            findScenes(scene_filter: {{ studios: {{ value: "{studio_id}", modifier: EQUALS }} }}, filter: {{ per_page: -1 }}) {{
+                scenes {{ id title }}
+            }}
+        }}
+    """})
+    for scene in response.json()["data"]["findScenes"]["scenes"]:
+        details = module.requests.post(module.graphql_endpoint, json={
+            "query": f"query FindScene {{ findScene(id: {scene['id']}) {{ title files {{ basename }} }} }}"
+        }).json()["data"]["findScene"]
+        if not details["title"] and details["files"]:
+            title = re.sub(r'\.[^.]*$', '', details["files"][0]["basename"])
+            module.requests.post(module.graphql_endpoint, json={
+                "query": f'mutation SceneUpdate {{ sceneUpdate(input: {{ id: {scene["id"]}, title: "{title}" }}) {{ title }} }}'
+            })
+
+
+def run(label, function, module, options):
+    stash = FakeStash(options.scenes, options.untitled)
+    module.requests.post = stash.post
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    untitled = sum(1 for scene in stash.scenes.values() if not scene["title"] and scene["files"])
+    projected = elapsed + stash.requests * options.round_trip_ms / 1000
+    print(f"{label:<11} {stash.requests:>8} requests {elapsed:>8.2f}s local "
+          f"{projected:>9.1f}s at {options.round_trip_ms:g} ms per request  ({untitled} still untitled)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Movie-Fy scene title check.")
+    parser.add_argument("--scenes", type=int, default=50000)
+    parser.add_argument("--untitled", type=float, default=0.3, help="Share of scenes without a title")
+    parser.add_argument("--round-trip-ms", type=float, default=5)
+    options = parser.parse_args()
+
+    spec = importlib.util.spec_from_file_location("check_titles", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # Keep the task's logging out of the timings
+    for name in ("info", "debug", "error", "progress"):
+        setattr(module.log, name, lambda *args, **kwargs: None)
+
+    print(f"{options.scenes} scenes in studio 'Movie', {options.untitled:.0%} untitled")
+    run("per scene", lambda: per_scene(module), module, options)
+    run("batched", module.main, module, options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,42 @@
+import sys
+import json
 import requests
 import stashapi.log as log
 
+# Settings
+MOVIES_PER_PAGE = 100
+BULK_CHUNK_SIZE = 500    # Scene IDs per bulkSceneUpdate
+
+graphql_endpoint = "http://localhost:9999/graphql"
+
+movies_page_query = """
+query MovieStudiosPage($page: Int!, $per_page: Int!) {
+    findMovies(filter: { page: $page, per_page: $per_page, sort: "id", direction: ASC }) {
+        movies {
+            id
+            name
+            studio {
+                id
+            }
+            scenes {
+                id
+                studio {
+                    id
+                }
+            }
+        }
+    }
+}
+"""
+
+bulk_studio_mutation = """
+mutation BulkSceneStudio($ids: [ID!], $studio_id: ID) {
+    bulkSceneUpdate(input: { ids: $ids, studio_id: $studio_id }) {
+        id
+    }
+}
+"""
+
 def get_all_movies():
     query = """
     query AllMovies {
@@ -79,5 +115,95 @@ def main():
 
     log.info("Update process completed.")
 
+def post(query, variables):
+    """Send a GraphQL request; returns the response and the bytes sent and received."""
+    body = json.dumps({"query": query, "variables": variables})
+    response = requests.post(graphql_endpoint, data=body, headers={"Content-Type": "application/json"})
+    return response.json(), len(body), len(response.content)
+
+def iter_movies():
+    page = 1
+    while True:
+        data, _, _ = post(movies_page_query, {"page": page, "per_page": MOVIES_PER_PAGE})
+        if not data.get("data"):
+            log.error(f"Failed to fetch movies: {data.get('errors', 'Unknown Error')}")
+            return
+        movies = data["data"]["findMovies"]["movies"]
+        yield from movies
+        if len(movies) < MOVIES_PER_PAGE:
+            return
+        page += 1
+
+def plan_studio_changes(movies):
+    """Map each movie studio ID to the IDs of its movies' scenes that have another studio.
+
+    Follows the same rules as the per-scene update: movies and scenes without a
+    studio are left alone. A scene in movies of different studios takes the
+    studio of the first of them.
+    """
+    plan = {}
+    claimed = {}
+    for movie in movies:
+        movie_studio = movie.get("studio")
+        if movie_studio is None:
+            continue
+        movie_studio_id = movie_studio["id"]
+        for scene in movie.get("scenes", []):
+            scene_id = scene["id"]
+            scene_studio = scene.get("studio")
+            if scene_studio is None:
+                continue
+            if scene_id in claimed:
+                if claimed[scene_id] != movie_studio_id:
+                    log.warning(f"Scene {scene_id} is in movies of different studios; keeping studio ID {claimed[scene_id]}.")
+                continue
+            claimed[scene_id] = movie_studio_id
+            if scene_studio["id"] != movie_studio_id:
+                plan.setdefault(movie_studio_id, []).append(scene_id)
+    return plan
+
+def reconcile():
+    """Apply every needed studio change with one bulkSceneUpdate per studio and chunk of scenes."""
+    log.info("Reconciling scene studios with movie studios...")
+    plan = plan_studio_changes(iter_movies())
+    total_changes = sum(len(scene_ids) for scene_ids in plan.values())
+    if not total_changes:
+        log.info("All scene studios already match their movies.")
+        log.progress(1.0)
+        return
+    log.info(f"Moving {total_changes} scenes to {len(plan)} studios...")
+
+    applied = 0
+    sent = received = 0
+    for studio_id, scene_ids in plan.items():
+        for start in range(0, len(scene_ids), BULK_CHUNK_SIZE):
+            chunk = scene_ids[start:start + BULK_CHUNK_SIZE]
+            try:
+                data, request_bytes, response_bytes = post(bulk_studio_mutation, {"ids": chunk, "studio_id": studio_id})
+            except (requests.exceptions.RequestException, ValueError) as e:
+                log.error(f"Failed to move {len(chunk)} scenes to studio ID {studio_id}: {e}")
+                continue
+            sent += request_bytes
+            received += response_bytes
+            if data.get("errors"):
+                log.error(f"Errors while moving scenes to studio ID {studio_id}: {data['errors']}")
+            applied += len((data.get("data") or {}).get("bulkSceneUpdate") or [])
+            log.progress(applied / total_changes)
+            log.info(f"{applied}/{total_changes} changes applied ({sent / 1024:.1f} KB sent, {received / 1024:.1f} KB received).")
+
+    log.info(f"Reconciliation completed: {applied} of {total_changes} scenes updated.")
+
+def get_mode():
+    # Stash passes the task's defaultArgs as JSON on stdin
+    if sys.stdin is None or sys.stdin.isatty():
+        return None
+    try:
+        return json.loads(sys.stdin.read() or "{}").get("args", {}).get("mode")
+    except ValueError:
+        return None
+
 if __name__ == "__main__":
-    main()
+    if "--reconcile" in sys.argv or get_mode() == "reconcile_scene_studios":
+        reconcile()
+    else:
+        main()
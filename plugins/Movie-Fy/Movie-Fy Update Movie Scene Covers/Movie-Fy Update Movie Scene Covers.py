@@ -1,82 +1,146 @@
+import os
+import json
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import stashapi.log as log  # Importing progress tracking module
 
+# Settings
+MOVIES_PER_PAGE = 100
+SCENES_PER_REQUEST = 20      # Aliased sceneUpdate mutations sent in one request
+CONCURRENT_REQUESTS = 4      # Requests in flight; Stash downloads the cover for every scene
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cover_sync_state.json")
+
 # Define the GraphQL queries
-all_movies_query = """
-    query AllMovies {
-        allMovies {
-            id
-            name
-            front_image_path
-            scenes {
+movies_page_query = """
+    query MoviesPage($page: Int!, $per_page: Int!) {
+        findMovies(filter: { page: $page, per_page: $per_page, sort: "id", direction: ASC }) {
+            count
+            movies {
                 id
+                name
+                front_image_path
+                scenes {
+                    id
+                }
             }
         }
     }
 """
 
-scene_update_mutation = """
-    mutation SceneUpdate($movie_scene_id: ID!, $movie_front_image_path: String!) {
-        sceneUpdate(input: { id: $movie_scene_id, cover_image: $movie_front_image_path }) {
-            id
-        }
-    }
-"""
-
 # GraphQL endpoint
 graphql_endpoint = "http://localhost:9999/graphql"
 
-def update_scene_cover_images():
-    # Send the GraphQL query to fetch all movies and their scenes
-    response = requests.post(graphql_endpoint, json={"query": all_movies_query})
-    data = response.json()
-    
-    if "data" in data and "allMovies" in data["data"]:
-        all_movies = data["data"]["allMovies"]
-        
-        total_movies = len(all_movies)
-        processed_movies = 0
+def has_image(image_path):
+    # Stash serves a placeholder, flagged with default=true, for movies without a front image
+    return bool(image_path) and "default=true" not in image_path
 
-        for movie in all_movies:
-            movie_id = movie["id"]
-            front_image_path = movie["front_image_path"]
-            scenes = movie["scenes"]
+def load_state():
+    """scene ID -> the movie front image path this script last set as the scene's cover."""
+    try:
+        with open(STATE_PATH, "r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
 
-            # Check if the scene cover image already matches the movie's front image
-            if all(scene.get("cover_image") == front_image_path for scene in scenes):
-                print(f"Skipping movie {movie_id}: all scene covers already match the movie front image")
-                processed_movies += 1
-                progress = processed_movies / total_movies
-                log.progress(progress)
-                continue
+def save_state(state):
+    temp_path = STATE_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file)
+    os.replace(temp_path, STATE_PATH)
 
-            # Update each scene with the movie's front image path
-            for scene in scenes:
+def iter_movies():
+    """All movies with their scene IDs, one page at a time."""
+    page = 1
+    while True:
+        response = requests.post(graphql_endpoint, json={
+            "query": movies_page_query,
+            "variables": {"page": page, "per_page": MOVIES_PER_PAGE}
+        })
+        data = response.json()
+        if "data" not in data or not data["data"] or "findMovies" not in data["data"]:
+            log.error(f"Failed to fetch movies: {data.get('errors', 'Unknown Error')}")
+            return
+        movies = data["data"]["findMovies"]["movies"]
+        yield data["data"]["findMovies"]["count"], movies
+        if len(movies) < MOVIES_PER_PAGE:
+            return
+        page += 1
+
+def find_stale_scenes(state):
+    """Scenes whose cover was not set from their movie's current front image, as (scene ID, movie ID, front image path).
+
+    A movie's front_image_path carries its updated-at timestamp, so a new front
+    image shows up as a different path. Scene screenshot paths are not compared:
+    they change with any edit to the scene, and a cover replaced by hand is left alone.
+    """
+    stale = []
+    seen = set()
+    for _, movies in iter_movies():
+        for movie in movies:
+            front_image_path = movie["front_image_path"]
+            if not has_image(front_image_path):
+                continue
+            for scene in movie["scenes"]:
                 scene_id = scene["id"]
+                if scene_id in seen:
+                    continue  # A scene in several movies takes the cover of the first one
+                seen.add(scene_id)
+                applied = state.get(scene_id)
+                if isinstance(applied, list):
+                    applied = applied[0]  # Older state files also kept the scene's screenshot path
+                if applied != front_image_path:
+                    stale.append((scene_id, movie["id"], front_image_path))
+    return stale
 
-                # Check if the scene cover image already matches the movie's front image
-                if scene.get("cover_image") == front_image_path:
-                    print(f"Skipping scene {scene_id} in movie {movie_id}: scene cover already matches the movie front image")
-                    continue
+def update_covers(batch):
+    """One request with an aliased sceneUpdate per scene; returns the IDs that were updated."""
+    parameters = ", ".join(f"$id{i}: ID!, $cover{i}: String!" for i in range(len(batch)))
+    fields = "\n".join(
+        f"s{i}: sceneUpdate(input: {{ id: $id{i}, cover_image: $cover{i} }}) {{ id }}"
+        for i in range(len(batch))
+    )
+    variables = {}
+    for i, (scene_id, movie_id, front_image_path) in enumerate(batch):
+        variables[f"id{i}"] = scene_id
+        variables[f"cover{i}"] = front_image_path
+    try:
+        response = requests.post(graphql_endpoint, json={
+            "query": f"mutation UpdateSceneCovers({parameters}) {{\n{fields}\n}}",
+            "variables": variables
+        })
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.error(f"Failed to update {len(batch)} scene covers: {e}")
+        return set()
+    if data.get("errors"):
+        log.error(f"Errors while updating scene covers: {data['errors']}")
+    results = data.get("data") or {}
+    return {scene_id for i, (scene_id, _, _) in enumerate(batch) if results.get(f"s{i}")}
 
-                variables = {
-                    "movie_scene_id": scene_id,
-                    "movie_front_image_path": front_image_path
-                }
-                
-                # Send the mutation to update the scene cover image
-                mutation_response = requests.post(graphql_endpoint, json={"query": scene_update_mutation, "variables": variables})
-                mutation_data = mutation_response.json()
-                
-                if "data" in mutation_data and "sceneUpdate" in mutation_data["data"]:
-                    print(f"Updated scene {scene_id} cover image with movie front image for movie {movie_id}")
+def update_scene_cover_images():
+    state = load_state()
+    stale = find_stale_scenes(state)
+    if not stale:
+        log.info("All scene covers already match their movie front images.")
+        log.progress(1.0)
+        return
+    log.info(f"Updating covers of {len(stale)} scenes...")
+
+    batches = [stale[start:start + SCENES_PER_REQUEST] for start in range(0, len(stale), SCENES_PER_REQUEST)]
+    updated_scenes = 0
+    with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
+        for done, (batch, updated) in enumerate(zip(batches, executor.map(update_covers, batches)), start=1):
+            for scene_id, movie_id, front_image_path in batch:
+                if scene_id in updated:
+                    state[scene_id] = front_image_path
                 else:
                     print(f"Failed to update scene {scene_id} cover image for movie {movie_id}")
-
-            # Update progress for movies after processing all scenes for each movie
-            processed_movies += 1
-            progress = processed_movies / total_movies
-            log.progress(progress)
+            updated_scenes += len(updated)
+            if done % 10 == 0:
+                save_state(state)
+            log.progress(done / len(batches))
+    save_state(state)
+    log.info(f"Updated {updated_scenes} of {len(stale)} scene covers.")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,12 @@
 import json
 import requests
-from thefuzz import process
 import re
 from collections import defaultdict
 import os
+import argparse
+from movie_index import MovieIndex
+import batch_match
+import grouping
 
 # Global variable to store scene IDs
 scene_ids = []
@@ -81,28 +84,27 @@ def find_scenes(studio_id):
         return None
 
 
-def process_scenes(studio_id, scenes, movie_data):
+def process_scenes(studio_id, scenes, movie_data, depth=None, state=None):
     global scene_groups  # Declare scene_groups as global
-    
-    scene_groups = defaultdict(list)
 
-    for current_scene_index, scene in enumerate(scenes):
-        print(f"Processing scene: {scene['title']}")
-        
-        # Check if the scene is already attached to a movie
-        if scene['movies']:
-            print("Scene is already attached to a movie. Skipping.")
-            continue
-        
-        # Extract the subdirectory from the file path
-        file_path = scene.get('files', [{}])[0].get('path', '')
-        subdirectory = os.path.dirname(file_path)
-        
-        # Group scenes by subdirectory
-        scene_groups[subdirectory].append(scene)
-    
+    scene_groups = group_scenes_by_directory(scenes, verbose=True, depth=depth)
+    if state is not None:
+        total_groups = len(scene_groups)
+        scene_groups = state.pending(scene_groups, ('seen',))
+        print(f"{len(scene_groups)} of {total_groups} scene groups have scenes you have not been shown yet.")
+
     # Process scene groups after all scenes are grouped
-    process_scene_groups(scene_groups, movie_data)
+    process_scene_groups(scene_groups, movie_data, state)
+
+# Function to group scenes that are not attached to a movie yet by folder (see grouping.py)
+def group_scenes_by_directory(scenes, verbose=False, depth=None):
+    if verbose:
+        for scene in scenes:
+            print(f"Processing scene: {scene['title']}")
+            # Check if the scene is already attached to a movie
+            if scene['movies']:
+                print("Scene is already attached to a movie. Skipping.")
+    return grouping.group_scenes(scenes, depth)
 
 # Function to handle movie matches found through fuzzy search
 def handle_movie_matches(movie_matches, group_scenes, movie_data):
@@ -173,18 +175,8 @@ def find_or_create_movie(movie_name, movie_url):
 
 # Function to find movie information with fuzzy matching and lexical sorting
 def find_movie_info(movie_name, movie_data):
-    matches = []
-    unique_urls = set()  # Set to store unique URLs
-    for entry in movie_data:
-        match_ratio = process.extractOne(movie_name.lower(), [entry.get('Name', '').lower()])
-        if match_ratio[1] >= 90:  # Adjust threshold as needed
-            # Check if URL is unique before adding to matches
-            if entry['Source'] not in unique_urls:
-                matches.append(entry)
-                unique_urls.add(entry['Source'])
-    # Sort matches lexicographically by movie name
-    matches.sort(key=lambda x: (re.split(r'(\d+)', x['Name'].lower()), x['Name']))
-    return matches
+    # movie_data is the MovieIndex built from Movie-Fy URLs.json
+    return movie_data.search(movie_name, threshold=90)  # Adjust threshold as needed
 
 # Function to create a new movie with title and URL
 def create_movie(movie_name, movie_url):
@@ -301,7 +293,7 @@ def compare_with_previous(matches):
                     return True
     return False
 
-def process_scene_groups(scene_groups, movie_data):
+def process_scene_groups(scene_groups, movie_data, state=None):
     # Create a copy of scene_groups to iterate over
     scene_groups_copy = scene_groups.copy()
     for subdirectory, group_scenes in scene_groups_copy.items():
@@ -311,6 +303,10 @@ def process_scene_groups(scene_groups, movie_data):
             print(f"{i}. {scene['title']}")
         
         handle_user_choice(group_scenes, movie_data)
+        if state is not None:
+            # Saved after every group so an interrupted session resumes where it stopped
+            state.mark(group_scenes, 'seen')
+            state.save()
 
 
 def find_existing_movie_id(movie_name, movie_data):
@@ -469,7 +465,135 @@ def handle_movie_matches(movie_matches, group_scenes, movie_data):
             print("Invalid choice.")
 
 
-def main():
+# Function to send one GraphQL request and return its data, or None on errors
+def graphql_request(query, variables=None):
+    graphql_url = "http://localhost:9999/graphql"
+    try:
+        response = requests.post(graphql_url, json={"query": query, "variables": variables or {}})
+        response.raise_for_status()
+        result = response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"Error sending request to server: {e}")
+        return None
+    except ValueError as e:
+        print(f"Error parsing JSON response: {e}")
+        return None
+    if result.get("errors"):
+        print("GraphQL error:", result["errors"])
+    return result.get("data")
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# Function to find or create many movies with one aliased query (and one aliased mutation) per chunk
+def find_or_create_movies(movies, chunk_size=50):
+    """movies maps URL -> name; returns URL -> movie ID for every movie found or created."""
+    movie_ids = {}
+    items = list(movies.items())
+    for chunk in chunked(items, chunk_size):
+        parameters = ", ".join(f"$n{i}: String!" for i in range(len(chunk)))
+        fields = "\n".join(
+            f"m{i}: findMovies(movie_filter: {{ name: {{ value: $n{i}, modifier: EQUALS }} }}) {{ movies {{ id }} }}"
+            for i in range(len(chunk))
+        )
+        data = graphql_request(f"query FindMovies({parameters}) {{\n{fields}\n}}",
+                               {f"n{i}": name for i, (_, name) in enumerate(chunk)}) or {}
+        missing = []
+        for i, (url, name) in enumerate(chunk):
+            found = (data.get(f"m{i}") or {}).get("movies")
+            if found:
+                movie_ids[url] = found[0]["id"]
+            else:
+                missing.append((url, name))
+
+        if not missing:
+            continue
+        parameters = ", ".join(f"$n{i}: String!, $u{i}: String" for i in range(len(missing)))
+        fields = "\n".join(f"m{i}: movieCreate(input: {{ name: $n{i}, url: $u{i} }}) {{ id }}" for i in range(len(missing)))
+        variables = {}
+        for i, (url, name) in enumerate(missing):
+            variables[f"n{i}"] = name
+            variables[f"u{i}"] = url
+        data = graphql_request(f"mutation CreateMovies({parameters}) {{\n{fields}\n}}", variables) or {}
+        for i, (url, name) in enumerate(missing):
+            created = data.get(f"m{i}")
+            if created and created.get("id"):
+                movie_ids[url] = created["id"]
+                print(f"Movie '{name}' created successfully with ID: {created['id']}.")
+            else:
+                print(f"Failed to create movie '{name}'.")
+    return movie_ids
+
+# Function to add scenes to movies with bulkSceneUpdate, several movies per request
+def bulk_add_scenes_to_movies(scenes_by_movie, scenes_per_call=500, calls_per_request=20):
+    """scenes_by_movie maps movie ID -> scene IDs; returns the number of scenes updated."""
+    calls = [(movie_id, scene_ids) for movie_id, all_scene_ids in scenes_by_movie.items()
+             for scene_ids in chunked(all_scene_ids, scenes_per_call)]
+    updated = 0
+    for chunk in chunked(calls, calls_per_request):
+        parameters = ", ".join(f"$s{i}: [ID!], $m{i}: [ID!]" for i in range(len(chunk)))
+        fields = "\n".join(
+            f"b{i}: bulkSceneUpdate(input: {{ ids: $s{i}, movie_ids: {{ ids: $m{i}, mode: ADD }} }}) {{ id }}"
+            for i in range(len(chunk))
+        )
+        variables = {}
+        for i, (movie_id, scene_ids) in enumerate(chunk):
+            variables[f"s{i}"] = scene_ids
+            variables[f"m{i}"] = [movie_id]
+        data = graphql_request(f"mutation BulkAddScenesToMovies({parameters}) {{\n{fields}\n}}", variables) or {}
+        for i, (movie_id, scene_ids) in enumerate(chunk):
+            if data.get(f"b{i}") is not None:
+                updated += len(scene_ids)
+            else:
+                print(f"Failed to add {len(scene_ids)} scene(s) to movie {movie_id}.")
+    return updated
+
+# Function to match every scene group without prompting: confident matches are applied, the rest go to a review file
+def run_batch(scenes, json_path, threshold, margin, workers, review_path, depth=None, state=None):
+    scene_groups = group_scenes_by_directory(scenes, depth=depth)
+    if state is not None:
+        total_groups = len(scene_groups)
+        scene_groups = state.pending(scene_groups, ('seen', 'review'))
+        print(f"{len(scene_groups)} of {total_groups} scene groups have new scenes.")
+    print(f"Scoring {len(scene_groups)} scene groups against the catalogue...")
+    scores = batch_match.score_groups(scene_groups, json_path, workers=workers)
+    accepted, review = batch_match.classify(scene_groups, scores, threshold=threshold, margin=margin)
+    print(f"{len(accepted)} groups matched automatically, {len(review)} need review.")
+
+    if accepted:
+        movies = {entry['Source']: entry['Name'] for entry in accepted.values()}
+        movie_ids = find_or_create_movies(movies)
+        scenes_by_movie = defaultdict(list)
+        for subdirectory, entry in accepted.items():
+            movie_id = movie_ids.get(entry['Source'])
+            if movie_id:
+                scenes_by_movie[movie_id].extend(scene['id'] for scene in scene_groups[subdirectory])
+        updated = bulk_add_scenes_to_movies(scenes_by_movie)
+        print(f"Added {updated} scenes to {len(scenes_by_movie)} movies.")
+
+    if review:
+        if state is not None:
+            for group in review:
+                state.mark(scene_groups[group['directory']], 'review')
+            state.save()
+        batch_match.write_review(review_path, review)
+        print(f"Wrote {len(review)} groups to '{review_path}'. Run Movie-Fy without --batch to match them by hand.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Match scenes in the 'Movie' studio to movies from Movie-Fy URLs.json.")
+    parser.add_argument("--batch", action="store_true", help="Match all scene groups without prompting")
+    parser.add_argument("--threshold", type=float, default=95, help="Lowest score accepted automatically in batch mode (default 95)")
+    parser.add_argument("--margin", type=float, default=5, help="Points the best match must lead the next one by (default 5)")
+    parser.add_argument("--workers", type=int, default=None, help="Processes used to score groups (default: all cores)")
+    parser.add_argument("--review-file", default="Movie-Fy Review.json", help="Where batch mode writes groups it could not decide")
+    parser.add_argument("--group-depth", type=int, default=None,
+                        help="Group all scenes below this many folders from the root together (default: one group per folder)")
+    parser.add_argument("--state-file", default="Movie-Fy Groups.json", help="Where Movie-Fy remembers the scenes it already offered")
+    parser.add_argument("--all-groups", action="store_true", help="Offer every scene group again, not only those with new scenes")
+    return parser.parse_args()
+
+def main(options=None):
     print("Starting process...")
     studio_id = find_studio_id()
     if not studio_id:
@@ -486,15 +610,24 @@ def main():
     print(f"Found {len(scenes)} scenes.")
     
     try:
-        with open('Movie-Fy URLs.json', 'r', encoding='utf-8') as json_file:
-            movie_data = json.load(json_file)
+        movie_data = MovieIndex.load('Movie-Fy URLs.json')
     except Exception as e:
         print(f"Error reading JSON file: {e}")
         return
+    print(f"Loaded {len(movie_data)} movies from Movie-Fy URLs.json.")
+
+    depth = options.group_depth if options is not None else None
+    state = None
+    if options is not None and not options.all_groups:
+        state = grouping.GroupState(options.state_file)
+
+    if options is not None and options.batch:
+        run_batch(scenes, 'Movie-Fy URLs.json', options.threshold, options.margin, options.workers, options.review_file,
+                  depth, state)
+        return
 
-    process_scenes(studio_id, scenes, movie_data)
+    process_scenes(studio_id, scenes, movie_data, depth, state)
 
 # Entry point of the program
 if __name__ == "__main__":
-    main()
-         
+    main(parse_args())
@@ -0,0 +1,76 @@
+import os
+import re
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from movie_index import MovieIndex
+
+# Set in each worker process by _init_worker
+_worker_index = None
+
+
+def group_query(group_scenes):
+    """Search term for a scene group: the first scene's title without its 'Scene 4 ...' or ' - ...' suffix."""
+    title = group_scenes[0].get('title') or ''
+    query = re.sub(r'\bscene\b.*', '', title, flags=re.IGNORECASE)
+    query = re.sub(r'\s-.*', '', query).strip()
+    return query or title
+
+
+def _init_worker(json_path):
+    global _worker_index
+    # Maps the catalogue the parent process just converted; the pages are shared between workers
+    _worker_index = MovieIndex.load(json_path)
+
+
+def _score(job):
+    key, query, min_score = job
+    return key, [(entry, score) for entry, score in _worker_index.scored(query, threshold=min_score)[:5]]
+
+
+def score_groups(scene_groups, json_path, workers=None, min_score=80):
+    """Score every group against the catalogue on a pool of processes.
+
+    Returns {group key: [(entry, score), ...]} with the best five candidates per group.
+    """
+    # Convert the catalogue once up front so the workers only have to map it
+    index = MovieIndex.load(json_path)
+    jobs = [(key, group_query(group_scenes), min_score) for key, group_scenes in scene_groups.items()]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < 50:
+        return {key: [(entry, score) for entry, score in index.scored(query, threshold=min_score)[:5]]
+                for key, query, min_score in jobs}
+
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(json_path,)) as executor:
+        return dict(executor.map(_score, jobs, chunksize=chunksize))
+
+
+def classify(scene_groups, scores, threshold=95, margin=5):
+    """Split groups into auto-accepted matches and ones that need a human.
+
+    A group is accepted when its best candidate reaches threshold and beats the
+    runner-up by at least margin points.
+    """
+    accepted = {}
+    review = []
+    for key, group_scenes in scene_groups.items():
+        candidates = scores.get(key, [])
+        best = candidates[0] if candidates else None
+        runner_up = candidates[1][1] if len(candidates) > 1 else 0
+        if best and best[1] >= threshold and best[1] - runner_up >= margin:
+            accepted[key] = best[0]
+        else:
+            review.append({
+                'directory': key,
+                'query': group_query(group_scenes),
+                'scenes': [{'id': scene['id'], 'title': scene.get('title')} for scene in group_scenes],
+                'candidates': [{'Name': entry['Name'], 'Source': entry['Source'], 'score': round(score, 1)}
+                               for entry, score in candidates],
+            })
+    return accepted, review
+
+
+def write_review(path, review):
+    with open(path, 'w', encoding='utf-8') as review_file:
+        json.dump(review, review_file, indent=2, ensure_ascii=False)
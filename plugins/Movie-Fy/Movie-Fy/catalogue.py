@@ -0,0 +1,234 @@
+"""Compact, memory-mapped form of Movie-Fy URLs.json.
+
+Layout (native byte order, recorded in the header):
+
+    header      magic, version, byte order, entry count, trigram count,
+                source JSON size/mtime/SHA-1, then (offset, length) of each section
+    names       uint64 offsets (count + 1) + UTF-8 blob
+    sources     uint64 offsets (count + 1) + UTF-8 blob
+    keys        uint64 offsets (count + 1) + UTF-8 blob of normalized names
+    gram_counts uint16 per entry, an upper bound of its trigram count
+    grams       sorted trigrams joined by NUL
+    postings    uint64 offsets (trigrams + 1) + uint32 entry ids
+
+Opening it only maps the file; names and postings are read from the mapping
+when a search touches them, so startup cost does not grow with the catalogue.
+
+Usage: python catalogue.py "Movie-Fy URLs.json" ["Movie-Fy URLs.mfc"]
+"""
+import os
+import sys
+import mmap
+import json
+import struct
+import hashlib
+from array import array
+
+from movie_index import MovieIndex, normalize
+
+MAGIC = b'MFYCAT\x00\x00'
+VERSION = 1
+SECTIONS = ('name_offsets', 'name_blob', 'source_offsets', 'source_blob', 'key_offsets', 'key_blob',
+            'gram_counts', 'gram_blob', 'posting_offsets', 'postings')
+HEADER = struct.Struct('<8sII?QQd20s')
+SECTION = struct.Struct('<QQ')
+HEADER_SIZE = HEADER.size + SECTION.size * len(SECTIONS)
+
+
+def catalogue_path(json_path):
+    return os.path.splitext(json_path)[0] + '.mfc'
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def _string_table(strings):
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets.tobytes(), bytes(blob)
+
+
+def convert(json_path, output_path=None):
+    """Write the binary catalogue for a Movie-Fy URLs.json; returns its path."""
+    output_path = output_path or catalogue_path(json_path)
+    stat = os.stat(json_path)
+    with open(json_path, 'r', encoding='utf-8') as json_file:
+        entries = json.load(json_file)
+
+    names = [entry.get('Name') or '' for entry in entries]
+    sources = [entry.get('Source') or '' for entry in entries]
+    keys = [normalize(name) for name in names]
+    postings = MovieIndex._build_postings(keys)
+    grams = sorted(postings)
+
+    posting_offsets = array('Q', [0])
+    posting_data = array('I')
+    for gram in grams:
+        posting_data.extend(postings[gram])
+        posting_offsets.append(len(posting_data))
+
+    sections = {}
+    sections['name_offsets'], sections['name_blob'] = _string_table(names)
+    sections['source_offsets'], sections['source_blob'] = _string_table(sources)
+    sections['key_offsets'], sections['key_blob'] = _string_table(keys)
+    sections['gram_counts'] = array('H', (min(len(key) + 1, 65535) for key in keys)).tobytes()
+    sections['gram_blob'] = '\x00'.join(grams).encode('utf-8')
+    sections['posting_offsets'] = posting_offsets.tobytes()
+    sections['postings'] = posting_data.tobytes()
+
+    table = []
+    position = HEADER_SIZE
+    for name in SECTIONS:
+        position += -position % 8  # Keep every section 8-byte aligned
+        table.append((position, len(sections[name])))
+        position += len(sections[name])
+
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, len(entries), sys.byteorder == 'little', len(grams),
+                                 stat.st_size, stat.st_mtime, file_digest(json_path)))
+        for offset, length in table:
+            output.write(SECTION.pack(offset, length))
+        for name, (offset, length) in zip(SECTIONS, table):
+            output.write(b'\x00' * (offset - output.tell()))
+            output.write(sections[name])
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+class StringTable:
+    """Read-only sequence of strings stored as offsets plus a UTF-8 blob."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+class CatalogueEntries:
+    """The catalogue as the sequence of {'Name', 'Source'} dicts Movie-Fy works with, built on access."""
+
+    def __init__(self, names, sources):
+        self.names = names
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return {'Name': self.names[i], 'Source': self.sources[i]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class MappedPostings:
+    """Trigram -> entry ids, answered from the mapped file."""
+
+    def __init__(self, grams, offsets, postings):
+        self.ids = {gram: i for i, gram in enumerate(grams)}
+        self.offsets = offsets
+        self.postings = postings
+
+    def get(self, gram, default=None):
+        i = self.ids.get(gram)
+        if i is None:
+            return default
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Catalogue:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as catalogue_file:
+            self.map = mmap.mmap(catalogue_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.count, little_endian, self.gram_total,
+         self.source_size, self.source_mtime, self.source_digest) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or little_endian != (sys.byteorder == 'little'):
+            self.map.close()
+            raise ValueError(f'{path} is not a catalogue this version of Movie-Fy can read')
+
+        view = memoryview(self.map)
+        self.sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(self.map, HEADER.size + i * SECTION.size)
+            self.sections[name] = view[offset:offset + length]
+
+    def close(self):
+        for section in self.sections.values():
+            section.release()
+        self.map.close()
+
+    def _section(self, name, typecode=None):
+        section = self.sections[name]
+        return section.cast(typecode) if typecode else section
+
+    def is_current(self, json_path):
+        """Whether the catalogue was built from json_path as it is now."""
+        try:
+            stat = os.stat(json_path)
+        except OSError:
+            return True  # Only the converted catalogue was shipped
+        if stat.st_size == self.source_size and stat.st_mtime == self.source_mtime:
+            return True
+        return stat.st_size == self.source_size and file_digest(json_path) == self.source_digest
+
+    def index(self):
+        names = StringTable(self._section('name_offsets', 'Q'), self._section('name_blob'))
+        sources = StringTable(self._section('source_offsets', 'Q'), self._section('source_blob'))
+        keys = StringTable(self._section('key_offsets', 'Q'), self._section('key_blob'))
+        grams = str(self._section('gram_blob'), 'utf-8').split('\x00') if self.gram_total else []
+        postings = MappedPostings(grams, self._section('posting_offsets', 'Q'), self._section('postings', 'I'))
+        return MovieIndex(CatalogueEntries(names, sources), keys, postings, self._section('gram_counts', 'H'))
+
+
+def load_index(json_path, path=None):
+    """Map the catalogue next to json_path, converting the JSON first if it is missing or out of date."""
+    path = path or catalogue_path(json_path)
+    catalogue = None
+    try:
+        catalogue = Catalogue(path)
+    except (OSError, ValueError, struct.error):
+        pass
+    if catalogue is not None and catalogue.is_current(json_path):
+        return catalogue.index()
+
+    if catalogue is not None:
+        catalogue.close()
+    print(f"Converting '{json_path}' to '{path}'...")
+    try:
+        convert(json_path, path)
+    except OSError as e:
+        # e.g. Windows will not replace a file another Movie-Fy process has mapped
+        print(f"Could not write the catalogue, using the JSON file directly: {e}")
+        with open(json_path, 'r', encoding='utf-8') as json_file:
+            entries = [{'Name': entry.get('Name') or '', 'Source': entry.get('Source') or ''} for entry in json.load(json_file)]
+        return MovieIndex(entries)
+    return Catalogue(path).index()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python catalogue.py "Movie-Fy URLs.json" ["Movie-Fy URLs.mfc"]')
+        sys.exit(1)
+    written = convert(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    catalogue = Catalogue(written)
+    print(f"Wrote {catalogue.count} movies and {catalogue.gram_total} trigrams to '{written}' ({os.path.getsize(written)} bytes).")
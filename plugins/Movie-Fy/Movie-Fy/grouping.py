@@ -0,0 +1,157 @@
+import os
+import re
+import json
+from collections import Counter
+
+from movie_index import normalize, natural_key
+
+SEPARATORS = re.compile(r'[\\/]+')
+ROOT = re.compile(r'^(?:[A-Za-z]:)?[\\/]*')
+# Disc markers that split one movie over several folders, e.g. 'Title CD1' and 'Title CD2'.
+# Parts and volumes are left out: 'Title Vol 3' and 'Title Vol 4' are separate movies.
+DISC_MARKER = re.compile(r'\b(?:cd|dvd|disc|disk)\s*\d+\b')
+
+
+def dirname(path):
+    # Stash may run on another OS than Movie-Fy, so both separators count
+    cut = max(path.rfind('/'), path.rfind('\\'))
+    return path[:cut] if cut > 0 else path[:cut + 1]
+
+
+def scene_directory(scene):
+    """Folder a scene is grouped by: the one holding most of its files, or its first file's on a tie."""
+    directories = [dirname(file.get('path') or '') for file in scene.get('files') or []]
+    if not directories:
+        return ''
+    counts = Counter(directories)
+    return max(directories, key=lambda directory: counts[directory])  # max keeps the first of equals
+
+
+def title_key(folder_name):
+    """A folder name reduced to the movie title it stands for; empty for folders like 'Disc 2'."""
+    return ' '.join(DISC_MARKER.sub(' ', normalize(folder_name)).split())
+
+
+class Node:
+
+    def __init__(self, path):
+        self.path = path
+        self.children = {}
+        self.scenes = []
+
+    def subtree_scenes(self):
+        scenes = list(self.scenes)
+        for child in self.children.values():
+            scenes.extend(child.subtree_scenes())
+        return scenes
+
+
+def merge(nodes):
+    """One node holding the scenes and, merged by name, the children of several sibling folders."""
+    if len(nodes) == 1:
+        return nodes[0]
+    merged = Node(nodes[0].path)
+    children = {}
+    for node in nodes:
+        merged.scenes.extend(node.scenes)
+        for name, child in node.children.items():
+            children.setdefault(name, []).append(child)
+    merged.children = {name: merge(same) for name, same in children.items()}
+    return merged
+
+
+class PathTrie:
+    """Scene folders as a trie of path components, grouped into one scene group per movie.
+
+    Without a depth every folder is its own group, as Movie-Fy always did,
+    except for the discs of one movie: sibling folders that differ only in a
+    disc marker ('Title CD1', 'Title (CD2)') are grouped together, and folders
+    named only by one ('Disc 2') are grouped with their parent. With a depth,
+    everything below that many folders from the root is also grouped with the
+    folder at that depth.
+    """
+
+    def __init__(self):
+        self.roots = {}
+
+    def add(self, directory, scene):
+        root = ROOT.match(directory).group(0)
+        separator = '\\' if '\\' in directory and '/' not in directory else '/'
+        parts = [part for part in SEPARATORS.split(directory[len(root):]) if part]
+        node = self.roots.get(root)
+        if node is None:
+            node = self.roots[root] = Node(root)
+        for i, part in enumerate(parts):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = Node(root + separator.join(parts[:i + 1]))
+            node = child
+        node.scenes.append(scene)
+
+    def groups(self, depth=None):
+        """Folder path -> scenes; a merged group is keyed by the first of its folders."""
+        groups = {}
+        for node in self.roots.values():
+            self._collect(node, 0, depth, groups)
+        return groups
+
+    def _collect(self, node, level, depth, groups):
+        if depth is not None and level >= depth:
+            scenes = node.subtree_scenes()
+            if scenes:
+                groups[node.path] = scenes
+            return
+
+        scenes = list(node.scenes)
+        titles = {}
+        for name in sorted(node.children, key=lambda name: natural_key(normalize(name))):
+            child = node.children[name]
+            key = title_key(name)
+            if key:
+                titles.setdefault(key, []).append(child)
+            else:
+                scenes.extend(child.subtree_scenes())
+        if scenes:
+            groups[node.path] = scenes
+        for siblings in titles.values():
+            self._collect(merge(siblings), level + 1, depth, groups)
+
+
+def group_scenes(scenes, depth=None):
+    """Group the scenes that are not attached to a movie yet; returns folder path -> scenes."""
+    trie = PathTrie()
+    for scene in scenes:
+        if not scene.get('movies'):
+            trie.add(scene_directory(scene), scene)
+    return trie.groups(depth)
+
+
+class GroupState:
+    """Scenes earlier runs already handled, so a re-run only offers groups with new scenes.
+
+    Scenes are recorded by ID with how they were handled: 'seen' once shown in
+    interactive mode, 'review' once batch mode wrote them to the review file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as state_file:
+                self.scenes = json.load(state_file).get('scenes', {})
+        except (OSError, ValueError):
+            self.scenes = {}
+
+    def pending(self, groups, statuses):
+        """The groups with at least one scene not recorded with one of statuses."""
+        return {key: group_scenes for key, group_scenes in groups.items()
+                if any(self.scenes.get(scene['id']) not in statuses for scene in group_scenes)}
+
+    def mark(self, group_scenes, status):
+        for scene in group_scenes:
+            self.scenes[scene['id']] = status
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as state_file:
+            json.dump({'scenes': self.scenes}, state_file)
+        os.replace(temp_path, self.path)
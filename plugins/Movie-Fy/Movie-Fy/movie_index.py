@@ -0,0 +1,112 @@
+import re
+import heapq
+from array import array
+from collections import Counter
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    from thefuzz import fuzz, process
+
+NON_ALNUM = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(name):
+    """Lowercase and replace punctuation with single spaces, like thefuzz's full_process."""
+    return NON_ALNUM.sub(' ', name).lower().strip()
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def natural_key(name):
+    return (re.split(r'(\d+)', name.lower()), name)
+
+
+class MovieIndex:
+    """Fuzzy search over the Movie-Fy URLs.json catalogue.
+
+    Names are normalized once and broken into trigrams; a search counts shared
+    trigrams through the inverted index to pick a few hundred candidates and
+    only scores those with WRatio, instead of scoring every catalogue entry.
+    """
+
+    def __init__(self, entries, keys=None, postings=None, gram_counts=None):
+        # entries, keys and postings may be plain lists and dicts, or views into a mapped catalogue (see catalogue.py)
+        self.entries = entries
+        self.keys = keys if keys is not None else [normalize(entry.get('Name', '')) for entry in entries]
+        self.postings = postings if postings is not None else self._build_postings(self.keys)
+        if gram_counts is None:
+            gram_counts = array('H', (min(len(key) + 1, 65535) for key in self.keys))  # Trigrams per padded key, at most
+        self.gram_counts = gram_counts
+
+    @staticmethod
+    def _build_postings(keys):
+        postings = {}
+        for i, key in enumerate(keys):
+            for gram in trigrams(key):
+                bucket = postings.get(gram)
+                if bucket is None:
+                    bucket = postings[gram] = array('I')
+                bucket.append(i)
+        return postings
+
+    @classmethod
+    def load(cls, json_path):
+        """Open the catalogue through its memory-mapped form, rebuilt whenever the JSON file changes."""
+        from catalogue import load_index
+        return load_index(json_path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def candidates(self, key, limit=256, min_shared=3):
+        """Entry ids sharing the largest share of trigrams with key.
+
+        Shared trigrams are divided by the trigram count of the shorter of the
+        two names, so a short title contained in a long query ranks as high as
+        a full match, which is what WRatio's partial scoring rewards.
+        """
+        query_grams = trigrams(key)
+        counts = Counter()
+        for gram in query_grams:
+            bucket = self.postings.get(gram)
+            if bucket is not None:
+                counts.update(bucket)  # Counted in C
+        if len(counts) <= limit:
+            return list(counts)
+        query_size = len(query_grams)
+        min_shared = min(min_shared, query_size)
+        gram_counts = self.gram_counts
+        ranked = ((count / min(query_size, gram_counts[i]), count, i) for i, count in counts.items() if count >= min_shared)
+        return [i for _, _, i in heapq.nlargest(limit, ranked)]
+
+    def scored(self, movie_name, threshold=90, limit=256):
+        """(entry, score) pairs scoring at least threshold, one per URL, best first."""
+        key = normalize(movie_name)
+        if not key:
+            return []
+        choices = {i: self.keys[i] for i in self.candidates(key, limit)}
+        scored = process.extract(key, choices, scorer=fuzz.WRatio, processor=None, limit=None)
+
+        matches = []
+        unique_urls = set()
+        for _, score, i in sorted(scored, key=lambda result: -result[1]):
+            if score < threshold:
+                break
+            entry = self.entries[i]
+            if entry['Source'] not in unique_urls:
+                matches.append((entry, score))
+                unique_urls.add(entry['Source'])
+        return matches
+
+    def search(self, movie_name, threshold=90, limit=256):
+        """Entries scoring at least threshold, one per URL, in natural name order."""
+        matches = [entry for entry, _ in self.scored(movie_name, threshold, limit)]
+        matches.sort(key=lambda entry: natural_key(entry['Name']))
+        return matches
@@ -5,11 +5,13 @@ from pathlib import Path
 import time
 import requests
 from renamer_settings import config
+from webhook_queue import WebhookQueue, webhook_targets
 
 print("Renamer Library Service Running.")
 
 lock_file_name = "renamer-lock.dat"
 lock_file_location = Path(os.path.join(os.path.dirname(__file__), lock_file_name))
+webhook_db_location = Path(os.path.join(os.path.dirname(__file__), "renamer-webhooks.db"))
 
 while True:
     if not lock_file_location.exists():
@@ -76,34 +78,23 @@ def deduplicate_ordered(items: list[str]) -> list[str]:
             result.append(item)
     return result
 
-import requests
-
 def send_webhook(paths: list[str]):
 
-    if len(paths) == 0:
+    targets = webhook_targets(config)
+    if not targets:
         return
 
-    webhook = config["webhook"]
-    if not webhook or not webhook["url"] or not webhook["url"]:
-        return
-
-    headers = {
-        "Content-Type": "application/json",        
-        "X-API": webhook["api_key"] or ""
-    }
-
-    payload = {
-        "instanceName": "StashDB",
-        "event": 'updated',
-        "paths": paths
-    }
-
+    # Persist first so notifications survive a transcoder restart, then deliver
+    # whatever is due (including batches left over from earlier runs).
+    queue = WebhookQueue(webhook_db_location, config.get("webhook_queue"))
     try:
-        response = requests.post(webhook["url"], json=payload, headers=headers)
-        response.raise_for_status()
-        print(f"✅ Webhook sent: {response.status_code}")
-    except requests.RequestException as e:
-        print(f"❌ Webhook failed: {e}")
+        if paths:
+            queued = queue.enqueue(targets, paths)
+            print(f"📥 Queued {queued} webhook batch(es) for {len(targets)} target(s)")
+        if queue.pending() and queue.drain():
+            print("✅ Webhook queue drained")
+    finally:
+        queue.close()
 
 
 # Read in paths we have updated so we can scan the library paths
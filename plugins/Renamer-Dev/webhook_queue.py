@@ -0,0 +1,209 @@
+# Persistent outbound webhook queue used by service.py
+#
+# Notifications are written to a small SQLite database before any delivery is
+# attempted, so a transcoder that is down or restarting only delays them.
+# Each target gets its own ordered stream of batches; failed batches are retried
+# with exponential backoff and moved to a dead-letter table once they run out of
+# attempts.
+
+import json
+import random
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_SETTINGS = {
+    "batch_size": 500,       # Maximum number of paths per webhook payload
+    "max_attempts": 10,      # Attempts before a batch is moved to the dead-letter table
+    "backoff_base": 5,       # Seconds to wait after the first failure, doubled per attempt
+    "backoff_max": 900,      # Upper bound for the wait between two attempts
+    "timeout": 15,           # Per-request timeout in seconds
+    "drain_seconds": 300,    # How long the service keeps retrying before leaving the rest for the next run
+}
+
+
+def webhook_targets(config) -> list[dict]:
+    """Return every configured webhook target as a list of {url, api_key} dicts.
+
+    Accepts the original single "webhook" dict as well as a list of them, either
+    under "webhook" or "webhooks".
+    """
+    raw = config.get("webhooks") or config.get("webhook") or []
+    if isinstance(raw, dict):
+        raw = [raw]
+
+    targets = []
+    seen = set()
+    for target in raw:
+        url = (target or {}).get("url")
+        if not url or url in seen:
+            continue
+        seen.add(url)
+        targets.append({"url": url, "api_key": target.get("api_key") or ""})
+    return targets
+
+
+class WebhookQueue:
+
+    def __init__(self, db_path, settings=None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.db = sqlite3.connect(str(db_path), timeout=30)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                api_key TEXT NOT NULL DEFAULT '',
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (url, next_attempt);
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                idempotency_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                created REAL NOT NULL,
+                failed REAL NOT NULL
+            );
+        """)
+        self.session = requests.Session()
+
+    def close(self):
+        self.session.close()
+        self.db.close()
+
+    def enqueue(self, targets: list[dict], paths: list[str], event="updated"):
+        """Split paths into batches and persist one row per batch and target."""
+        if not targets or not paths:
+            return 0
+
+        size = max(1, int(self.settings["batch_size"]))
+        now = time.time()
+        rows = []
+        for start in range(0, len(paths), size):
+            payload = json.dumps({
+                "instanceName": "StashDB",
+                "event": event,
+                "paths": paths[start:start + size]
+            })
+            for target in targets:
+                rows.append((target["url"], target["api_key"], uuid.uuid4().hex, payload, now, now))
+
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO outbox (url, api_key, idempotency_key, payload, next_attempt, created) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return len(rows)
+
+    def pending(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def next_due(self):
+        row = self.db.execute("SELECT MIN(next_attempt) FROM outbox").fetchone()
+        return row[0]
+
+    def deliver_due(self):
+        """Send every batch that is due, one worker per target, and record the outcome."""
+        now = time.time()
+        rows = self.db.execute(
+            "SELECT id, url, api_key, idempotency_key, payload, attempts, next_attempt FROM outbox ORDER BY id"
+        ).fetchall()
+
+        # Keep each target's batches in order and stop at the first one that is
+        # still backing off, so a later batch never overtakes an earlier one.
+        streams = {}
+        blocked = set()
+        for *row, next_attempt in rows:
+            url = row[1]
+            if url in blocked:
+                continue
+            if next_attempt > now:
+                blocked.add(url)
+                continue
+            streams.setdefault(url, []).append(tuple(row))
+
+        if not streams:
+            return 0, 0
+
+        with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+            outcomes = [outcome for stream in pool.map(self._deliver_stream, streams.values()) for outcome in stream]
+
+        sent = failed = 0
+        with self.db:
+            for row, error in outcomes:
+                if error is None:
+                    self.db.execute("DELETE FROM outbox WHERE id = ?", (row[0],))
+                    sent += 1
+                else:
+                    self._record_failure(row, error)
+                    failed += 1
+        return sent, failed
+
+    def drain(self, deadline=None):
+        """Deliver until the outbox is empty or the deadline (in seconds) passes."""
+        deadline = time.time() + (self.settings["drain_seconds"] if deadline is None else deadline)
+        while True:
+            sent, failed = self.deliver_due()
+            if sent or failed:
+                print(f"📨 Webhooks: {sent} delivered, {failed} failed, {self.pending()} pending")
+
+            due = self.next_due()
+            if due is None:
+                return True
+            if due > deadline:
+                print(f"⏳ Leaving {self.pending()} webhook batch(es) queued for the next run")
+                return False
+            time.sleep(max(0.0, due - time.time()))
+
+    def _deliver_stream(self, rows):
+        outcomes = []
+        for row in rows:
+            _, url, api_key, idempotency_key, payload, _ = row
+            try:
+                response = self.session.post(
+                    url,
+                    data=payload,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-API": api_key,
+                        "Idempotency-Key": idempotency_key
+                    },
+                    timeout=self.settings["timeout"]
+                )
+                response.raise_for_status()
+                outcomes.append((row, None))
+            except requests.RequestException as e:
+                outcomes.append((row, str(e)))
+                break  # Target is unhealthy, retry the rest of its stream later
+        return outcomes
+
+    def _record_failure(self, row, error):
+        batch_id, url, _, idempotency_key, payload, attempts = row
+        attempts += 1
+        if attempts >= self.settings["max_attempts"]:
+            self.db.execute(
+                "INSERT INTO dead_letter (id, url, idempotency_key, payload, attempts, last_error, created, failed) "
+                "SELECT id, url, idempotency_key, payload, ?, ?, created, ? FROM outbox WHERE id = ?",
+                (attempts, error, time.time(), batch_id)
+            )
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (batch_id,))
+            print(f"☠️ Webhook batch {idempotency_key} to {url} moved to dead letter after {attempts} attempts: {error}")
+            return
+
+        delay = min(self.settings["backoff_max"], self.settings["backoff_base"] * (2 ** (attempts - 1)))
+        delay *= random.uniform(0.8, 1.2)
+        self.db.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+            (attempts, time.time() + delay, error, batch_id)
+        )
+        print(f"❌ Webhook to {url} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
@@ -0,0 +1,83 @@
+# projection.py
+#
+# Builds the smallest GraphQL selection set a Renamer configuration needs.
+# A template like "$studio - $date - $title" only needs id, title, date,
+# files { path } and studio { name }; performers, tags and stash ids are only
+# requested when a key, template or tag-specific path actually uses them.
+
+import re
+from functools import lru_cache
+
+# Field paths (dot separated) that each filename/folder key reads
+KEY_FIELDS = {
+    "title": ("title",),
+    "date": ("date",),
+    "year": ("date",),
+    "studio": ("studio.name",),
+    "performers": ("performers.name",),
+    "tags": ("tags.name",),
+    "stash_id": ("stash_ids.stash_id",),
+    "height": ("files.height",),
+    "video_codec": ("files.video_codec",),
+    "frame_rate": ("files.frame_rate",),
+}
+
+# Needed by the engine itself: identifying the scene, skipping untitled scenes,
+# locating the files and building the studio folder
+BASE_FIELDS = ("id", "title", "files.path", "studio.name")
+
+TEMPLATE_KEY_PATTERN = re.compile(r'\$(\w+)')
+
+
+def template_keys(template):
+    return TEMPLATE_KEY_PATTERN.findall(template or "")
+
+
+def config_fingerprint(config, extra_fields=()):
+    """Hashable summary of everything in a config that influences the projection."""
+    return (
+        tuple(config.get("key_order") or []),
+        tuple(config.get("folder_key_order") or []),
+        tuple(sorted(config.get("exclude_keys") or [])),
+        tuple(sorted((config.get("studio_templates") or {}).values())),
+        bool(config.get("tag_specific_paths")),
+        tuple(sorted(extra_fields)),
+    )
+
+
+def scene_selection(config, extra_fields=()):
+    """Return the selection set for a scene, e.g. 'id title date files { path } studio { name }'."""
+    return _build_selection(config_fingerprint(config, extra_fields))
+
+
+@lru_cache(maxsize=32)
+def _build_selection(fingerprint):
+    key_order, folder_key_order, exclude_keys, templates, needs_tags, extra_fields = fingerprint
+    keys = (set(key_order) | set(folder_key_order)) - set(exclude_keys)
+    for template in templates:
+        keys.update(template_keys(template))
+
+    paths = list(BASE_FIELDS)
+    if needs_tags:
+        paths.append("tags.name")
+    for key in sorted(keys):
+        paths.extend(KEY_FIELDS.get(key, ()))
+    paths.extend(extra_fields)
+    return render_selection(paths)
+
+
+def render_selection(paths):
+    """Merge dotted field paths into a nested GraphQL selection, keeping first-seen order."""
+    tree = {}
+    for path in paths:
+        node = tree
+        for part in path.split("."):
+            node = node.setdefault(part, {})
+    return _render(tree)
+
+
+def _render(tree):
+    parts = []
+    for name, children in tree.items():
+        parts.append(f"{name} {{ {_render(children)} }}" if children else name)
+    return " ".join(parts)
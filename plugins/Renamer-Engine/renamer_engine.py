@@ -0,0 +1,623 @@
+# renamer_engine.py
+#
+# Shared renaming engine used by the Renamer and Renamer-Dev plugins.
+# The plugins only read their settings and plugin input, then hand the scene
+# over to this module, which fetches it, builds the new file/folder names and
+# moves or renames the files.
+
+import datetime
+import hashlib
+import os
+import platform
+import re
+import shutil
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+import stashapi.log as log
+
+from projection import TEMPLATE_KEY_PATTERN, scene_selection
+from rules import RuleSet
+
+IS_WINDOWS = platform.system() == 'Windows'
+
+DEFAULT_CONFIG = {
+    "api_key": "",
+    "endpoint": "",
+    "wrapper_styles": {},
+    "separator": ' - ',
+    "illegal_character_replacement": ' - ',
+    "performer_separator": None,  # None joins performers with "separator"
+    "sort_performers": True,
+    "collapse_double_dashes": False,  # Renamer's original '--' -> '-' pass over the joined name
+    "key_order": ["studio", "date", "performers", "title"],
+    "folder_key_order": [],
+    "exclude_keys": [],
+    "move_files": False,
+    "rename_files": True,
+    "move_trickplay": False,
+    "dry_run": True,
+    "max_tag_keys": None,
+    "tag_whitelist": [],
+    "exclude_paths": [],
+    "tag_specific_paths": {},
+    "regex_transformations": {},
+    "associated_files": [],
+    "unassociated_files": [],
+    "performer_limit": None,
+    "date_format": "%Y-%m-%d",
+    "studio_templates": {},
+    "folder-map": {},
+    "move_layout": "stash",  # "stash": <stash>/<studio>/<folder>, "parent": <current folder>/<studio>
+    "max_filename_length": 240,
+    "dry_run_report": "dry_run_report.csv.gz",  # Relative paths are resolved against the plugin folder
+    "dry_run_report_page_size": 1000,
+}
+
+
+def normalize_config(config, **overrides):
+    """Return a copy of a Renamer or Renamer-Dev settings dict with every key the engine uses.
+
+    Wrapper styles may be written as tuples ('[', ']') or, as in the original
+    Renamer settings, as two-character strings like '[]'.
+    """
+    normalized = {**DEFAULT_CONFIG, **config, **overrides}
+
+    wrapper_styles = {}
+    for key, style in (normalized.get("wrapper_styles") or {}).items():
+        if isinstance(style, str):
+            style = (style[:1], style[1:2]) if style else ('', '')
+        wrapper_styles[key] = tuple(style)
+    normalized["wrapper_styles"] = wrapper_styles
+
+    for key in ("tag_whitelist", "exclude_paths", "exclude_keys", "associated_files", "unassociated_files", "folder_key_order"):
+        normalized[key] = normalized.get(key) or []
+    for key in ("tag_specific_paths", "regex_transformations", "studio_templates", "folder-map"):
+        normalized[key] = normalized.get(key) or {}
+    return normalized
+
+
+###############################################################################
+# Scene fetch layer
+###############################################################################
+
+class SceneFetcher:
+    """Single GraphQL access point: one pooled session, per-scene cache."""
+
+    def __init__(self, endpoint, api_key="", selection=None, pool_size=10, session_cookie=None):
+        self.endpoint = endpoint
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate, br",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        })
+        if api_key:
+            self.session.headers["ApiKey"] = api_key
+        if isinstance(session_cookie, dict) and session_cookie.get("Name") and session_cookie.get("Value"):
+            self.session.cookies.set(session_cookie["Name"], session_cookie["Value"])
+        self.selection = selection or "id title files { path } studio { name }"
+        self._scene_cache = {}
+        self._stash_directories = None
+
+    @classmethod
+    def from_config(cls, config, server_connection=None):
+        endpoint = config.get("endpoint") or endpoint_from_connection(server_connection)
+        session_cookie = (server_connection or {}).get("SessionCookie")
+        return cls(endpoint, config.get("api_key", ""), scene_selection(config), session_cookie=session_cookie)
+
+    def graphql_request(self, query, variables=None):
+        response = self.session.post(self.endpoint, json={'query': query, 'variables': variables})
+        try:
+            data = response.json()
+        except ValueError:
+            log.error(f"Failed to decode JSON from response: {response.text}")
+            return None
+        if data.get('errors'):
+            log.error(f"GraphQL errors: {data['errors']}")
+        return data.get('data')
+
+    def find_scene_by_id(self, scene_id):
+        scene_id = str(scene_id)
+        if scene_id in self._scene_cache:
+            return self._scene_cache[scene_id]
+
+        query = """
+        query FindScene($scene_id: ID!) {
+            findScene(id: $scene_id) {
+                %s
+            }
+        }
+        """ % self.selection
+        result = self.graphql_request(query, variables={"scene_id": scene_id})
+        scene = result.get('findScene') if result else None
+        if scene:
+            self._scene_cache[scene_id] = scene
+        return scene
+
+    def invalidate(self, scene_id=None):
+        if scene_id is None:
+            self._scene_cache.clear()
+        else:
+            self._scene_cache.pop(str(scene_id), None)
+
+    def latest_updated_scene_id(self):
+        query = """
+        query LatestScene {
+            findScenes(filter: { per_page: 1, sort: "updated_at", direction: DESC }) {
+                scenes { id }
+            }
+        }
+        """
+        result = self.graphql_request(query)
+        scenes = (result or {}).get('findScenes', {}).get('scenes', [])
+        return scenes[0]['id'] if scenes else None
+
+    def iter_scene_pages(self, selection=None, per_page=1000):
+        """Yield (scenes, total count) one findScenes page at a time, bypassing the per-scene cache."""
+        query = """
+        query FindScenes($filter: FindFilterType) {
+            findScenes(filter: $filter) {
+                count
+                scenes {
+                    %s
+                }
+            }
+        }
+        """ % (selection or self.selection)
+        page = 1
+        while True:
+            variables = {"filter": {"page": page, "per_page": per_page, "sort": "id", "direction": "ASC"}}
+            result = self.graphql_request(query, variables)
+            data = (result or {}).get('findScenes') or {}
+            scenes = data.get('scenes') or []
+            if not scenes:
+                return
+            yield scenes, data.get('count', 0)
+            if len(scenes) < per_page:
+                return
+            page += 1
+
+    def fetch_stash_directories(self):
+        """Top level stash library paths, fetched once per run."""
+        if self._stash_directories is None:
+            query = """
+            query Configuration {
+                configuration {
+                    general {
+                        stashes {
+                            path
+                        }
+                    }
+                }
+            }
+            """
+            result = self.graphql_request(query)
+            stashes = (result or {}).get('configuration', {}).get('general', {}).get('stashes', [])
+            self._stash_directories = [stash['path'] for stash in stashes]
+        return self._stash_directories
+
+    def metadata_scan(self, paths):
+        query = """
+        mutation MetadataScan($input: ScanMetadataInput!) {
+            metadataScan(input: $input)
+        }
+        """
+        return self.graphql_request(query, {"input": {"paths": list(paths), "rescan": False}})
+
+
+def endpoint_from_connection(server_connection):
+    """Build the GraphQL URL from the server_connection block Stash passes to plugins."""
+    server_connection = server_connection or {}
+    scheme = server_connection.get("Scheme", "http")
+    host = server_connection.get("Host", "localhost")
+    if host == "0.0.0.0":
+        host = "localhost"
+    port = server_connection.get("Port", 9999)
+    return f"{scheme}://{host}:{port}/graphql"
+
+
+###############################################################################
+# Renaming engine
+###############################################################################
+
+class RenamerEngine:
+
+    def __init__(self, config, fetcher=None, ext_log=None, server_connection=None):
+        self.config = normalize_config(config)
+        self.rules = RuleSet(self.config, self.make_path)
+        self.fetcher = fetcher or SceneFetcher.from_config(self.config, server_connection)
+        self.ext_log = ext_log
+
+    # -------------------------------------------------------------------------
+    # Paths
+    # -------------------------------------------------------------------------
+    def linux_to_windows_path(self, linux_path: str) -> str:
+        if IS_WINDOWS:
+            for linux_root, windows_root in self.config["folder-map"].items():
+                if linux_path.startswith(linux_root):
+                    # Replace the root and convert slashes
+                    relative_path = linux_path[len(linux_root):].lstrip('/')
+                    return f"{windows_root}\\{relative_path}".replace('/', '\\')
+            # If no match, just convert slashes
+            return linux_path.replace('/', '\\')
+        return linux_path
+
+    def make_path(self, linux_path: str) -> Path:
+        return Path(self.linux_to_windows_path(linux_path))
+
+    def is_excluded(self, path: Path) -> bool:
+        return self.rules.is_excluded(path)
+
+    # -------------------------------------------------------------------------
+    # Value formatting
+    # -------------------------------------------------------------------------
+    def apply_regex_transformations(self, value, key):
+        return self.rules.transform(value, key)
+
+    def apply_date_format(self, value, date_format=None):
+        try:
+            return datetime.datetime.strptime(value, "%Y-%m-%d").strftime(date_format or self.config['date_format'])
+        except ValueError as e:
+            if self.ext_log:
+                self.ext_log.error(f"Date formatting error: {str(e)}")
+            return value
+
+    def sort_performers(self, performers):
+        sorted_performers = sorted(performers, key=lambda x: x['name']) if self.config['sort_performers'] else list(performers)
+        limit = self.config['performer_limit']
+        if limit is not None and len(sorted_performers) > limit:
+            sorted_performers = sorted_performers[:limit]
+        return sorted_performers
+
+    def filter_tags(self, tags):
+        return self.rules.filter_tags(tags)
+
+    def format_value(self, scene, key):
+        """Return the unwrapped, sanitised text for one filename key, or '' if it has no value."""
+        separator = self.config['separator']
+        value = scene.get(key)
+
+        if key == 'tags':
+            tag_wrapper = self.config['wrapper_styles'].get('tag', ('', ''))
+            value = separator.join(f"{tag_wrapper[0]}{name}{tag_wrapper[1]}" for name in self.filter_tags(value or []))
+        elif key == 'performers':
+            performer_separator = self.config['performer_separator']
+            if performer_separator is None:
+                performer_separator = separator
+            value = performer_separator.join(performer['name'] for performer in self.sort_performers(value or []))
+        elif key == 'stash_id':
+            value = next((str(stash_id.get('stash_id')) for stash_id in scene.get('stash_ids') or [] if stash_id.get('stash_id')), '')
+        elif key == 'date' and value:
+            value = self.apply_date_format(value)
+        elif key == 'year':
+            value = self.apply_date_format(scene['date'], "%Y") if scene.get('date') else ''
+        elif key in ('height', 'video_codec', 'frame_rate'):
+            file_info_value = next((file_info.get(key) for file_info in scene.get('files') or []), '')
+            if not file_info_value:
+                value = ''
+            elif key == 'height':
+                value = str(file_info_value) + 'p'
+            elif key == 'video_codec':
+                value = file_info_value.upper()
+            else:
+                value = str(file_info_value) + ' FPS'
+        elif isinstance(value, dict):
+            value = value.get('name', '')
+
+        if not value or not isinstance(value, str):
+            return ''
+        value = self.apply_regex_transformations(value, key)
+        return replace_illegal_characters(value, self.config['illegal_character_replacement'])
+
+    def wrap(self, key, value):
+        if key == 'tags':
+            return value  # Each tag carries its own wrapper
+        wrapper = self.config['wrapper_styles'].get(key, ('', ''))
+        return f"{wrapper[0]}{value}{wrapper[1]}"
+
+    def join_keys(self, scene, keys):
+        parts = []
+        for key in keys:
+            if key in self.config['exclude_keys']:
+                continue
+            value = self.format_value(scene, key)
+            if value:  # Skip empty values
+                parts.append(self.wrap(key, value))
+        separator = self.config['separator']
+        return self.collapse_dashes(separator.join(parts).rstrip(separator))
+
+    def collapse_dashes(self, name):
+        return name.replace('--', '-') if self.config['collapse_double_dashes'] else name
+
+    # -------------------------------------------------------------------------
+    # Names
+    # -------------------------------------------------------------------------
+    def apply_studio_template(self, studio_name, scene):
+        template = self.config["studio_templates"].get(studio_name, "") if studio_name else ""
+        if not template:
+            return None
+
+        def render(match):
+            key = match.group(1)
+            value = self.format_value(scene, key)
+            return self.wrap(key, value) if value else ''
+
+        return self.collapse_dashes(TEMPLATE_KEY_PATTERN.sub(render, template))
+
+    def build_filename(self, scene):
+        """New base filename for a scene, without logging; returns (filename, studio template used)."""
+        studio = scene.get('studio')
+        studio_name = studio.get('name', '') if studio else None
+
+        filename = self.apply_studio_template(studio_name, scene)
+        if filename:
+            return self.limit_length(filename), studio_name
+        return self.limit_length(self.join_keys(scene, self.config['key_order'])), None
+
+    def form_new_filename(self, scene):
+        filename, template = self.build_filename(scene)
+        if template:
+            log.info(f"Studio template detected for '{template}' and applied: {filename}")
+        else:
+            log.info(f"Generated filename: {filename}")
+        return filename
+
+    def form_new_foldername(self, scene):
+        foldername = self.join_keys(scene, self.config['folder_key_order'])
+        log.info(f"Generated foldername: {foldername}")
+        return foldername
+
+    def limit_length(self, filename):
+        """Truncate over-long names, keeping them unique with a short hash suffix."""
+        max_length = self.config['max_filename_length']
+        if not max_length or len(filename) <= max_length:
+            return filename
+        suffix = hashlib.md5(filename.encode()).hexdigest()[:8]
+        return f"{filename[:max_length - len(suffix) - 1]}_{suffix}"
+
+    def target_directory(self, scene, original_path, move):
+        if not move:
+            return original_path.parent
+
+        studio = scene.get('studio')
+        studio_name = replace_illegal_characters(studio.get('name'), self.config['illegal_character_replacement']) if studio and studio.get('name') else 'No Studio'
+
+        if self.config['move_layout'] == 'parent':
+            parent = original_path.parent
+            return parent if parent.name == studio_name else parent / studio_name
+
+        tag_path = self.tag_specific_path(scene)
+        if tag_path:
+            root = tag_path
+        else:
+            root = next((stash for stash in self.stash_directories() if original_path.is_relative_to(stash)), None)
+            if root is None:
+                return None
+
+        foldername = self.join_keys(scene, self.config['folder_key_order'])
+        return root / studio_name / foldername if foldername else root / studio_name
+
+    def tag_specific_path(self, scene):
+        return self.rules.tag_path(scene.get('tags') or [])
+
+    def stash_directories(self):
+        return [self.make_path(path) for path in self.fetcher.fetch_stash_directories()]
+
+    # -------------------------------------------------------------------------
+    # File operations
+    # -------------------------------------------------------------------------
+    def log_move(self, message, original_path, new_path, scene_id):
+        if self.ext_log and scene_id:
+            self.ext_log.info(message, extra={"original_path": str(original_path), "new_path": str(new_path), "scene_id": scene_id})
+
+    def move_associated_files(self, directory, new_directory, filename_base, dry_run, scene_id=None):
+        candidates = []
+        for ext in self.config['associated_files']:
+            candidates.append(f"{filename_base}{ext}" if ext[0] in {'.', '-'} else f"{filename_base}.{ext}")
+        for file in self.config['unassociated_files']:
+            for ext in self.config['associated_files']:
+                candidates.append(f"{file}{ext}" if ext[0] in {'.', '-'} else f"{file}.{ext}")
+
+        for check_file in candidates:
+            associated_file = directory / check_file
+            if not associated_file.exists():
+                continue
+            new_associated_file = new_directory / check_file
+            if dry_run:
+                log.info(f"Dry run: Would move '{associated_file}' to '{new_associated_file}'")
+            else:
+                shutil.move(str(associated_file), str(new_associated_file))
+                log.info(f"Moved associated file '{associated_file}' to '{new_associated_file}'")
+                self.log_move("Moved associated file", associated_file, new_associated_file, scene_id)
+
+    def move_trickplay_folder(self, original_base_name, new_base_name, original_dir, destination_dir, dry_run):
+        source_folder = os.path.join(original_dir, f"{original_base_name}.trickplay")
+        if os.path.isdir(source_folder):
+            dest_folder = os.path.join(destination_dir, f"{new_base_name}.trickplay")
+            if dry_run:
+                log.info(f"Dry run: Would move trickplay '{source_folder}' to '{dest_folder}'")
+            else:
+                shutil.move(source_folder, dest_folder)
+                log.info(f"Moved trickplay '{source_folder}' to '{dest_folder}'")
+
+    def plan_file(self, scene, file_info, new_filename, move, rename):
+        """Work out where one file would go, without touching the filesystem.
+
+        status is "excluded", "no_stash" (outside every library path), "unchanged" or "ok".
+        """
+        original_path = self.make_path(file_info['path'])
+        plan = {"original_path": original_path, "new_path": None, "target_directory": None, "move": False, "rename": False}
+
+        if self.is_excluded(original_path):
+            return {**plan, "status": "excluded"}
+
+        target_directory = self.target_directory(scene, original_path, move)
+        if target_directory is None:
+            return {**plan, "status": "no_stash"}
+
+        new_path = target_directory / ((new_filename if rename else original_path.stem) + original_path.suffix)
+        file_move = bool(move) and original_path.parent != new_path.parent
+        file_rename = bool(rename) and original_path.name != new_path.name
+        return {
+            "original_path": original_path,
+            "new_path": new_path,
+            "target_directory": target_directory,
+            "move": file_move,
+            "rename": file_rename,
+            "status": "ok" if (file_move or file_rename) else "unchanged",
+        }
+
+    def move_or_rename_files(self, scene, new_filename, move=None, rename=None, dry_run=None):
+        """Move and/or rename every file of a scene. Returns one result dict per file handled."""
+        move = self.config['move_files'] if move is None else move
+        rename = self.config['rename_files'] if rename is None else rename
+        dry_run = self.config['dry_run'] if dry_run is None else dry_run
+
+        if not scene:
+            log.error("No scene data provided to process.")
+            return []
+
+        scene_id = scene.get('id', 'Unknown')
+        results = []
+
+        if not scene.get('title'):
+            log.info(f"Skipping scene {scene_id} due to missing title.")
+            return results
+
+        for file_info in scene.get('files') or []:
+            plan = self.plan_file(scene, file_info, new_filename, move, rename)
+            original_path = plan["original_path"]
+
+            if plan["status"] == "excluded":
+                log.info(f"File {original_path} belongs to an excluded path. Skipping modification.")
+                continue
+
+            if not original_path.exists():
+                log.error(f"Source file not found: {original_path}")
+                continue
+
+            if plan["status"] == "no_stash":
+                if not dry_run and self.ext_log:
+                    self.ext_log.error("File is not in any known stash path", extra={"file_path": str(original_path), "scene_id": scene_id})
+                continue
+
+            if plan["status"] == "unchanged":
+                log.info(f"File '{original_path}' is already in the correct location.")
+                continue
+
+            new_path, target_directory = plan["new_path"], plan["target_directory"]
+            file_move, file_rename = plan["move"], plan["rename"]
+
+            action = "move" if file_move else "rename"
+            if dry_run:
+                log.info(f"Dry run: Would {action} file: {original_path} -> {new_path}")
+                if file_move:
+                    if self.config["move_trickplay"]:
+                        self.move_trickplay_folder(original_path.stem, new_path.stem, original_path.parent, target_directory, dry_run)
+                    self.move_associated_files(original_path.parent, target_directory, original_path.stem, dry_run, scene_id)
+                results.append({"action": action, "original_path": str(original_path), "new_path": str(new_path), "scene_id": scene_id})
+                continue
+
+            try:
+                target_directory.mkdir(parents=True, exist_ok=True)
+                new_path = safe_file_operation(original_path, new_path, action)
+                if not new_path:
+                    continue
+
+                action = "Moved" if file_move else "Renamed"
+                self.log_move(f"{action} main file", original_path, new_path, scene_id if scene_id != 'Unknown' else None)
+                if file_move:
+                    if self.config["move_trickplay"]:
+                        self.move_trickplay_folder(original_path.stem, new_path.stem, original_path.parent, target_directory, dry_run)
+                    self.move_associated_files(original_path.parent, target_directory, original_path.stem, dry_run, scene_id)
+
+                log.info(f"{action} file from '{original_path}' to '{new_path}'.")
+                results.append({"action": action, "original_path": str(original_path), "new_path": str(new_path), "scene_id": scene_id})
+
+                if file_move and is_directory_empty(original_path.parent):
+                    try:
+                        os.rmdir(original_path.parent)
+                        log.info(f"Delete empty folder: {original_path.parent}")
+                    except OSError as e:
+                        log.warning(f"Could not delete '{original_path.parent}': {e}")
+            except Exception as e:
+                log.error(f"Failed to {action} file: {str(e)}")
+
+        self.fetcher.invalidate(scene_id)
+        return results
+
+    def rename_scene(self, scene_id):
+        scene = self.fetcher.find_scene_by_id(scene_id)
+        if not scene:
+            log.error(f"Failed to fetch details for scene ID: {scene_id}")
+            return []
+        return self.move_or_rename_files(scene, self.form_new_filename(scene))
+
+
+###############################################################################
+# Helpers
+###############################################################################
+
+ILLEGAL_CHARACTERS = re.compile(r'[<>:"/\\|?*]')
+REPEATED_SPACES = re.compile(r'\s{2,}')
+
+
+def replace_illegal_characters(filename, replacement=' - '):
+    if filename is None:
+        return None
+    replaced = ILLEGAL_CHARACTERS.sub(replacement, filename)
+    # Collapse the doubled spaces a spaced replacement like ' - ' leaves next to existing ones
+    return REPEATED_SPACES.sub(' ', replaced) if replacement.strip() != replacement else replaced
+
+
+def is_directory_empty(path):
+    return not os.listdir(path)
+
+
+def get_unique_path(target_path):
+    """Generate a unique path if target already exists by adding a date or number suffix."""
+    if not target_path.exists():
+        return target_path
+
+    directory = target_path.parent
+    name = target_path.stem
+    extension = target_path.suffix
+
+    formatted_date = datetime.datetime.fromtimestamp(target_path.stat().st_mtime).strftime("%Y-%m-%d")
+    new_path = directory / f"{name} ({formatted_date}){extension}"
+    if not new_path.exists():
+        return new_path
+
+    counter = 1
+    while True:
+        new_path = directory / f"{name} ({counter}){extension}"
+        if not new_path.exists():
+            return new_path
+        counter += 1
+
+
+def safe_file_operation(source_path, target_path, operation='move'):
+    """Move or rename a file without overwriting an existing one."""
+    if not source_path.exists():
+        log.error(f"Source file not found: {source_path}")
+        return None
+
+    unique_target = get_unique_path(target_path)
+    if unique_target != target_path:
+        log.info(f"File already exists at {target_path}, using {unique_target} instead")
+
+    try:
+        if operation == 'move':
+            shutil.move(str(source_path), str(unique_target))
+        else:
+            source_path.rename(unique_target)
+        log.info(f"Successfully {operation}d file to '{unique_target}'")
+        return unique_target
+    except Exception as e:
+        log.error(f"Failed to {operation} file: {str(e)}")
+        return None
@@ -0,0 +1,207 @@
+# report.py
+#
+# Library-wide dry-run report. Instead of one log line per file, the whole
+# rename plan is fetched page by page through findScenes and streamed to a
+# compact table (gzip CSV, or Parquet when pyarrow is installed), followed by
+# a small JSON summary per studio and per device.
+
+import csv
+import gzip
+import json
+import os
+from pathlib import Path
+
+import stashapi.log as log
+
+from projection import scene_selection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+COLUMNS = (
+    "scene_id", "studio", "old_path", "new_path", "action",
+    "target_exists", "duplicate_target", "cross_device", "source_missing",
+    "size", "bytes_to_move", "source_device", "target_device",
+)
+
+
+class _CsvWriter:
+
+    def __init__(self, path):
+        opener = gzip.open if path.suffix == ".gz" else open
+        self.handle = opener(path, "wt", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.handle)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.handle.close()
+
+
+class _ParquetWriter:
+    """One row group per findScenes page, so memory stays flat however large the library is."""
+
+    SCHEMA = (
+        ("scene_id", "string"), ("studio", "string"), ("old_path", "string"), ("new_path", "string"),
+        ("action", "string"), ("target_exists", "bool"), ("duplicate_target", "bool"),
+        ("cross_device", "bool"), ("source_missing", "bool"), ("size", "int64"),
+        ("bytes_to_move", "int64"), ("source_device", "int64"), ("target_device", "int64"),
+    )
+
+    def __init__(self, path):
+        self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in self.SCHEMA])
+        self.writer = pq.ParquetWriter(str(path), self.schema, compression="zstd")
+
+    def write(self, rows):
+        if rows:
+            columns = list(zip(*rows))
+            self.writer.write_table(pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_writer(path):
+    if path.suffix == ".parquet":
+        if pa is None:
+            raise RuntimeError("Writing a .parquet dry run report needs pyarrow (pip install pyarrow)")
+        return _ParquetWriter(path)
+    return _CsvWriter(path)
+
+
+class FilesystemProbe:
+    """Answers existence and device questions with one listdir/stat per directory, not per file."""
+
+    def __init__(self):
+        self._listings = {}
+        self._devices = {}
+
+    def listing(self, directory):
+        directory = str(directory)
+        if directory not in self._listings:
+            try:
+                self._listings[directory] = frozenset(os.path.normcase(name) for name in os.listdir(directory))
+            except OSError:
+                self._listings[directory] = None
+        return self._listings[directory]
+
+    def exists(self, path):
+        names = self.listing(path.parent)
+        return names is not None and os.path.normcase(path.name) in names
+
+    def device(self, directory):
+        """st_dev of a directory, or of its nearest existing ancestor for folders a move would create."""
+        directory = Path(directory)
+        missing = []
+        while str(directory) not in self._devices:
+            try:
+                self._devices[str(directory)] = os.stat(directory).st_dev
+            except OSError:
+                if directory.parent == directory:
+                    self._devices[str(directory)] = None
+                    break
+                missing.append(directory)
+                directory = directory.parent
+        device = self._devices[str(directory)]
+        for path in missing:
+            self._devices[str(path)] = device
+        return device
+
+
+def _bucket():
+    return {"files": 0, "moves": 0, "renames": 0, "conflicts": 0, "skipped": 0, "bytes_to_move": 0}
+
+
+def _count(bucket, action, conflict, bytes_to_move):
+    bucket["files"] += 1
+    if action == "move":
+        bucket["moves"] += 1
+    elif action == "rename":
+        bucket["renames"] += 1
+    elif action != "unchanged":
+        bucket["skipped"] += 1
+    bucket["conflicts"] += conflict
+    bucket["bytes_to_move"] += bytes_to_move
+
+
+def plan_rows(engine, scenes, probe, targets):
+    """Rename plan rows for one page of scenes. targets tracks new paths across pages."""
+    move = engine.config['move_files']
+    rename = engine.config['rename_files']
+    for scene in scenes:
+        if not scene.get('title'):
+            continue
+        studio = (scene.get('studio') or {}).get('name') or ''
+        new_filename, _ = engine.build_filename(scene)
+
+        for file_info in scene.get('files') or []:
+            plan = engine.plan_file(scene, file_info, new_filename, move, rename)
+            original_path, new_path = plan["original_path"], plan["new_path"]
+            size = int(file_info.get('size') or 0)
+            source_missing = not probe.exists(original_path)
+            source_device = probe.device(original_path.parent)
+
+            if plan["status"] != "ok":
+                yield (scene['id'], studio, str(original_path), str(new_path or ''), plan["status"],
+                       False, False, False, source_missing, size, 0, source_device, None)
+                continue
+
+            target_key = os.path.normcase(str(new_path))
+            duplicate_target = target_key in targets
+            targets.add(target_key)
+            target_exists = probe.exists(new_path)
+            target_device = probe.device(plan["target_directory"])
+            cross_device = source_device is not None and target_device is not None and source_device != target_device
+            action = "move" if plan["move"] else "rename"
+
+            yield (scene['id'], studio, str(original_path), str(new_path), action,
+                   target_exists, duplicate_target, cross_device, source_missing,
+                   size, size if cross_device else 0, source_device, target_device)
+
+
+def generate_report(engine, output_path, per_page=None):
+    """Write the dry run report for every scene in the library and return the summary dict."""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    per_page = per_page or engine.config["dry_run_report_page_size"]
+    selection = scene_selection(engine.config, extra_fields=("files.size",))
+
+    probe = FilesystemProbe()
+    targets = set()
+    totals, studios, devices = _bucket(), {}, {}
+    scenes_seen = 0
+
+    writer = open_writer(output_path)
+    try:
+        for scenes, count in engine.fetcher.iter_scene_pages(selection, per_page):
+            rows = list(plan_rows(engine, scenes, probe, targets))
+            writer.write(rows)
+
+            for row in rows:
+                action = row[4]
+                conflict = any(row[5:9])
+                _count(totals, action, conflict, row[10])
+                _count(studios.setdefault(row[1] or "No Studio", _bucket()), action, conflict, row[10])
+                _count(devices.setdefault(str(row[11]), _bucket()), action, conflict, row[10])
+
+            scenes_seen += len(scenes)
+            if count:
+                log.progress(min(1.0, scenes_seen / count))
+    finally:
+        writer.close()
+
+    summary = {"report": str(output_path), "scenes": scenes_seen, "totals": totals, "studios": studios, "devices": devices}
+    summary_path = output_path.with_name(output_path.name.split(".")[0] + ".summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    log.info(
+        f"Dry run report: {scenes_seen} scenes, {totals['moves']} moves, {totals['renames']} renames, "
+        f"{totals['conflicts']} conflicts, {totals['bytes_to_move']} bytes across devices -> {output_path}"
+    )
+    return summary
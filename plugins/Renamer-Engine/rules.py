@@ -0,0 +1,97 @@
+# rules.py
+#
+# Pre-compiled per-config rule set for the renaming engine. Everything that used
+# to be re-evaluated per scene (list membership for the tag whitelist, scanning
+# tag_specific_paths, Path.match loops over exclude_paths, re.compile of every
+# regex transformation) is built once when the settings are loaded, so scene
+# evaluation only costs O(tags) dictionary lookups and one trie walk per file.
+
+import os
+import re
+from pathlib import PurePath
+
+
+class PathPrefixTrie:
+    """Matches paths against a set of directory prefixes, one path component at a time."""
+
+    _END = object()
+
+    def __init__(self, prefixes=()):
+        self.root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    @staticmethod
+    def components(path):
+        parts = PurePath(os.path.normcase(str(path))).parts
+        return [part for part in parts if part not in ('', '.')]
+
+    def add(self, prefix):
+        node = self.root
+        for part in self.components(prefix):
+            node = node.setdefault(part, {})
+        node[self._END] = True
+
+    def matches(self, path):
+        """True if path equals, or lies below, any of the stored prefixes."""
+        node = self.root
+        if not node:
+            return False
+        for part in self.components(path):
+            if self._END in node:
+                return True
+            node = node.get(part)
+            if node is None:
+                return False
+        return self._END in node
+
+    def __bool__(self):
+        return bool(self.root)
+
+
+class RuleSet:
+
+    def __init__(self, config, path_mapper=str):
+        self.tag_whitelist = frozenset(config.get("tag_whitelist") or ())
+        max_tag_keys = config.get("max_tag_keys")
+        self.max_tag_keys = int(max_tag_keys) if max_tag_keys is not None else None
+
+        # First entry in tag_specific_paths wins when a scene carries several of the tags
+        self.tag_paths = {}
+        for priority, (tag, path) in enumerate((config.get("tag_specific_paths") or {}).items()):
+            self.tag_paths.setdefault(tag, (priority, path_mapper(path)))
+
+        self.exclude_paths = PathPrefixTrie(path_mapper(path) for path in config.get("exclude_paths") or ())
+
+        self.transformations = {}
+        for transformation in (config.get("regex_transformations") or {}).values():
+            compiled = (re.compile(transformation["pattern"]), transformation["replacement"])
+            for field in transformation["fields"]:
+                self.transformations.setdefault(field, []).append(compiled)
+
+    def filter_tags(self, tags):
+        """Whitelisted tag names in scene order, capped at max_tag_keys."""
+        whitelist = self.tag_whitelist
+        names = [tag['name'] for tag in tags if tag['name'] in whitelist]
+        if self.max_tag_keys is not None:
+            names = names[:self.max_tag_keys]
+        return names
+
+    def tag_path(self, tags):
+        """Destination override for the highest priority tag the scene carries, if any."""
+        if not self.tag_paths:
+            return None
+        best = None
+        for tag in tags:
+            entry = self.tag_paths.get(tag['name'])
+            if entry and (best is None or entry[0] < best[0]):
+                best = entry
+        return best[1] if best else None
+
+    def is_excluded(self, path):
+        return bool(self.exclude_paths) and self.exclude_paths.matches(path)
+
+    def transform(self, value, key):
+        for pattern, replacement in self.transformations.get(key, ()):
+            value = pattern.sub(replacement, value)
+        return value
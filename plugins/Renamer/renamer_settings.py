@@ -37,6 +37,8 @@ config = {
     "rename_files": True,
     # Define whether the script should run in dry run mode
     "dry_run": True,
+    # Define where the Dry Run Report task writes the rename plan (.csv, .csv.gz or .parquet)
+    "dry_run_report": "dry_run_report.csv.gz",
     # Define the maximum number of tag keys to include in the filename (None for no limit)
     "max_tag_keys": 10,
     # Define a whitelist of allowed tags (None to disallow all tags)
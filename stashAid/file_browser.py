@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import base64
+import bisect
+import threading
+from collections import OrderedDict
+
+SORT_KEYS = {
+    'name': lambda entry: (entry['name'].lower(), entry['name']),
+    'size': lambda entry: (entry['size'], entry['name'].lower()),
+    'mtime': lambda entry: (entry['mtime'], entry['name'].lower()),
+    'type': lambda entry: (not entry['is_dir'], os.path.splitext(entry['name'])[1].lower(), entry['name'].lower()),
+}
+
+
+class DirectoryListing:
+    """One scandir pass over a directory, with sorted views built on demand."""
+
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.fetched = time.time()
+        self.entries = []
+        self.views = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                    # DirEntry caches its stat; on Windows it comes free with the listing
+                    stat = entry.stat()
+                    size, mtime = stat.st_size, stat.st_mtime
+                except OSError:
+                    # Broken symlink or a file that vanished mid-listing
+                    is_dir, size, mtime = False, 0, 0
+                self.entries.append({'name': entry.name, 'is_dir': is_dir, 'size': size, 'mtime': mtime})
+
+    def view(self, sort):
+        """Entries sorted ascending by sort, plus the matching list of keys for bisecting cursors."""
+        if sort not in self.views:
+            key = SORT_KEYS[sort]
+            entries = sorted(self.entries, key=key)
+            self.views[sort] = (entries, [key(entry) for entry in entries])
+        return self.views[sort]
+
+
+class FileBrowser:
+    """Paginated directory listings with a short-lived per-directory cache.
+
+    A cached listing is reused while the directory's mtime is unchanged and it
+    is younger than ttl seconds; the ttl bounds how stale file sizes can get,
+    since writing to a file does not touch its directory's mtime.
+    """
+
+    def __init__(self, ttl=10, max_directories=64):
+        self.ttl = ttl
+        self.max_directories = max_directories
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def listing(self, path):
+        mtime = os.stat(path).st_mtime
+        with self.lock:
+            cached = self.cache.get(path)
+            if cached and cached.mtime == mtime and time.time() - cached.fetched < self.ttl:
+                self.cache.move_to_end(path)
+                return cached
+
+        listing = DirectoryListing(path, mtime)
+        with self.lock:
+            self.cache[path] = listing
+            self.cache.move_to_end(path)
+            while len(self.cache) > self.max_directories:
+                self.cache.popitem(last=False)
+        return listing
+
+    def page(self, path, sort='name', order='asc', cursor=None, limit=500):
+        """Return {'entries', 'next_cursor', 'total'} for one page of a directory."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f'Invalid sort: {sort}')
+        entries, keys = self.listing(path).view(sort)
+        after = decode_cursor(cursor, sort)
+
+        try:
+            if order == 'desc':
+                end = bisect.bisect_left(keys, after) if after is not None else len(entries)
+                start = max(0, end - limit)
+                page = entries[start:end][::-1]
+                more = start > 0
+            else:
+                start = bisect.bisect_right(keys, after) if after is not None else 0
+                page = entries[start:start + limit]
+                more = start + limit < len(entries)
+        except TypeError:
+            # A hand-made cursor whose values do not compare with this sort's keys
+            raise ValueError('Invalid cursor')
+
+        next_cursor = encode_cursor(sort, SORT_KEYS[sort](page[-1])) if more and page else None
+        return {'entries': page, 'next_cursor': next_cursor, 'total': len(entries)}
+
+
+def encode_cursor(sort, key):
+    return base64.urlsafe_b64encode(json.dumps({'sort': sort, 'key': key}).encode()).decode()
+
+
+def decode_cursor(cursor, sort):
+    """The sort key of the last entry on the previous page; entries after it come next.
+
+    The cursor records the sort it was made for, since keys of another sort do not compare.
+    """
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        cursor_sort, key = data['sort'], tuple(data['key'])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor is for sort={cursor_sort}, not sort={sort}")
+    return key
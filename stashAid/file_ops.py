@@ -0,0 +1,365 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Operation and batch states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+OPERATIONS = ('mkdir', 'rename', 'move', 'delete')
+
+BATCH_ID_PATTERN = re.compile(r'^[0-9a-f]{12}$')
+
+COPY_CHUNK = 4 * 1024 * 1024
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class FileOperation:
+    """One entry of a batch.
+
+    mkdir:  path
+    rename: src -> dst, the full new path (like /rename_file)
+    move:   src -> dst, a directory the file is moved into (like /move_file)
+    delete: path, a file or an empty directory
+    """
+
+    def __init__(self, index, spec):
+        self.index = index
+        self.op = spec.get('op')
+        if self.op not in OPERATIONS:
+            raise ValueError(f"Operation {index}: unknown op '{self.op}'")
+        self.src = spec.get('path') if self.op in ('mkdir', 'delete') else spec.get('src')
+        self.dst = spec.get('dst')
+        if not self.src or (self.op in ('rename', 'move') and not self.dst):
+            raise ValueError(f"Operation {index}: '{self.op}' is missing a path")
+        if self.op == 'move':
+            self.dst = os.path.join(self.dst, os.path.basename(os.path.normpath(self.src)))
+        self.overwrite = bool(spec.get('overwrite', False))
+        self.status = QUEUED
+        self.error = None
+        self.cross_device = False
+        self.bytes_total = None
+        self.bytes_done = 0
+
+    def to_dict(self):
+        result = {'index': self.index, 'op': self.op, 'src': self.src, 'status': self.status}
+        if self.dst:
+            result['dst'] = self.dst
+        if self.error:
+            result['error'] = self.error
+        if self.cross_device:
+            result.update(cross_device=True, bytes_done=self.bytes_done, bytes_total=self.bytes_total)
+        return result
+
+
+class Batch:
+
+    def __init__(self, operations):
+        self.id = uuid.uuid4().hex[:12]
+        self.operations = operations
+        self.status = QUEUED
+        self.created = time.time()
+        self.ended = None
+        self.cancel_requested = False
+        self.saved = 0
+
+    def to_dict(self, operations=True):
+        counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+        bytes_done = bytes_total = 0
+        for operation in self.operations:
+            counts[operation.status] += 1
+            if operation.cross_device:
+                bytes_done += operation.bytes_done
+                bytes_total += operation.bytes_total or 0
+        result = {
+            'id': self.id,
+            'status': self.status,
+            'created': self.created,
+            'ended': self.ended,
+            'counts': counts,
+            'bytes_done': bytes_done,
+            'bytes_total': bytes_total,
+        }
+        if operations:
+            result['operations'] = [operation.to_dict() for operation in self.operations]
+        return result
+
+
+class FileOperations:
+    """Runs batches of rename/move/mkdir/delete operations in the background.
+
+    Directories are created first. The remaining operations are split into
+    chains of operations that touch the same paths (or paths inside one
+    another), each run in request order, while independent chains run in
+    parallel on a worker pool. Chains with a move to another drive are copied
+    chunk by chunk on a separate, smaller pool so a few large copies cannot
+    hold up quick renames, and report their progress in bytes. Like job records, a JSON record per batch lets any
+    server worker answer status requests.
+    """
+
+    def __init__(self, record_dir, workers=8, copy_workers=2, keep_batches=100):
+        self.record_dir = record_dir
+        os.makedirs(record_dir, exist_ok=True)
+        self.keep_batches = keep_batches
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stashaid-fileop')
+        self.copy_executor = ThreadPoolExecutor(max_workers=copy_workers, thread_name_prefix='stashaid-filecopy')
+        self.batches = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, specs):
+        """Validate the operations and start the batch; raises ValueError for a malformed request."""
+        if not isinstance(specs, list) or not specs:
+            raise ValueError('Expected a non-empty list of operations')
+        if not all(isinstance(spec, dict) for spec in specs):
+            raise ValueError('Every operation must be an object')
+        batch = Batch([FileOperation(index, spec) for index, spec in enumerate(specs)])
+        with self.lock:
+            self.batches[batch.id] = batch
+            self._forget_old_batches()
+        self._save_record(batch)
+        threading.Thread(target=self._run, args=(batch,), name=f'stashaid-batch-{batch.id}', daemon=True).start()
+        logger.info(f'Queued file operation batch {batch.id} with {len(batch.operations)} operation(s)')
+        return batch
+
+    def describe(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        return batch.to_dict() if batch else self.record(batch_id)
+
+    def list(self):
+        with self.lock:
+            return [batch.to_dict(operations=False) for batch in reversed(self.batches.values())]
+
+    def record(self, batch_id):
+        if not BATCH_ID_PATTERN.match(batch_id or ''):
+            return None
+        try:
+            with open(os.path.join(self.record_dir, f'{batch_id}.json'), 'r') as record_file:
+                return json.load(record_file)
+        except (OSError, ValueError):
+            return None
+
+    def cancel(self, batch_id):
+        """Stop a batch started by this process: queued operations are skipped and copies are abandoned."""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        batch.cancel_requested = True
+        return batch
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.copy_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, batch):
+        batch.status = RUNNING
+        for operation in batch.operations:
+            if operation.op == 'mkdir':
+                self._execute(batch, operation)
+
+        futures = []
+        for chain in _dependency_chains([operation for operation in batch.operations if operation.op != 'mkdir']):
+            # A guess made before earlier operations in the chain ran; _execute checks again
+            copies = any(operation.op in ('rename', 'move') and not _same_device(operation.src, operation.dst)
+                         for operation in chain)
+            executor = self.copy_executor if copies else self.executor
+            futures.append(executor.submit(self._execute_chain, batch, chain))
+        wait(futures)
+
+        if batch.cancel_requested:
+            batch.status = CANCELLED
+        elif any(operation.status == FAILED for operation in batch.operations):
+            batch.status = FAILED
+        else:
+            batch.status = DONE
+        batch.ended = time.time()
+        self._save_record(batch)
+        counts = batch.to_dict(operations=False)['counts']
+        logger.info(f'File operation batch {batch.id} {batch.status}: {counts[DONE]} done, {counts[FAILED]} failed')
+
+    def _execute_chain(self, batch, chain):
+        for operation in chain:
+            if operation.op in ('rename', 'move'):
+                operation.cross_device = not _same_device(operation.src, operation.dst)
+            self._execute(batch, operation)
+
+    def _execute(self, batch, operation):
+        if batch.cancel_requested:
+            operation.status = CANCELLED
+            return
+        operation.status = RUNNING
+        try:
+            if operation.op == 'mkdir':
+                os.makedirs(operation.src, exist_ok=True)
+            elif operation.op == 'delete':
+                if os.path.isdir(operation.src) and not os.path.islink(operation.src):
+                    os.rmdir(operation.src)
+                else:
+                    os.remove(operation.src)
+            else:
+                if not operation.overwrite and os.path.lexists(operation.dst):
+                    raise FileExistsError(f'Destination already exists: {operation.dst}')
+                os.makedirs(os.path.dirname(operation.dst) or '.', exist_ok=True)
+                if operation.cross_device:
+                    self._copy_move(batch, operation)
+                else:
+                    os.replace(operation.src, operation.dst)
+            operation.status = DONE
+            logger.info(f'File operation {operation.op}: {operation.src}' + (f' -> {operation.dst}' if operation.dst else ''))
+        except OperationCancelled:
+            operation.status = CANCELLED
+        except Exception as e:
+            operation.status = FAILED
+            operation.error = str(e)
+            logger.error(f'File operation {operation.op} failed for {operation.src}: {str(e)}')
+        finally:
+            self._save_record(batch, throttle=True)
+
+    def _copy_move(self, batch, operation):
+        """Move across devices: copy into a temporary file next to the destination, then remove the source."""
+        if os.path.isdir(operation.src):
+            operation.bytes_total = _tree_size(operation.src)
+            copy_function = lambda src, dst: self._copy_file(batch, operation, src, dst)
+            shutil.copytree(operation.src, operation.dst, copy_function=copy_function, dirs_exist_ok=operation.overwrite)
+            shutil.rmtree(operation.src)
+        else:
+            operation.bytes_total = os.path.getsize(operation.src)
+            self._copy_file(batch, operation, operation.src, operation.dst)
+            os.remove(operation.src)
+
+    def _copy_file(self, batch, operation, src, dst):
+        temp_dst = os.path.join(os.path.dirname(dst), f'.{os.path.basename(dst)}.part')
+        try:
+            with open(src, 'rb') as source, open(temp_dst, 'wb') as target:
+                while True:
+                    if batch.cancel_requested:
+                        raise OperationCancelled()
+                    chunk = source.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    operation.bytes_done += len(chunk)
+                    self._save_record(batch, throttle=True)
+            shutil.copystat(src, temp_dst)
+            os.replace(temp_dst, dst)
+        except BaseException:
+            try:
+                os.remove(temp_dst)
+            except OSError:
+                pass
+            raise
+        return dst
+
+    def _save_record(self, batch, throttle=False):
+        # Progress is written at most once a second; the final state always is
+        now = time.time()
+        if throttle and now - batch.saved < 1:
+            return
+        batch.saved = now
+        record = dict(batch.to_dict(), worker=os.getpid())
+        record_path = os.path.join(self.record_dir, f'{batch.id}.json')
+        temp_path = f'{record_path}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'w') as record_file:
+                json.dump(record, record_file)
+            os.replace(temp_path, record_path)
+        except OSError as e:
+            logger.error(f'Could not write record for file operation batch {batch.id}: {str(e)}')
+
+    def _forget_old_batches(self):
+        finished = [batch_id for batch_id, batch in self.batches.items() if batch.status in FINAL_STATES]
+        for batch_id in finished[:max(0, len(self.batches) - self.keep_batches)]:
+            del self.batches[batch_id]
+
+
+def _dependency_chains(operations):
+    """Split operations into lists, in request order, such that operations in
+    different lists never touch the same path or a path inside another's."""
+    parent = list(range(len(operations)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[find(i)] = find(j)
+
+    touched = {}  # path -> an operation on exactly that path
+    beneath = {}  # directory -> operations on paths inside it, not yet joined to a later one
+    for i, operation in enumerate(operations):
+        paths = [os.path.normcase(os.path.abspath(operation.src))]
+        if operation.dst:
+            paths.append(os.path.normcase(os.path.abspath(operation.dst)))
+        for path in paths:
+            ancestors = _ancestors(path)
+            for other in [path] + ancestors:
+                if other in touched:
+                    union(i, touched[other])
+            for j in beneath.pop(path, ()):
+                union(i, j)
+            touched[path] = i
+            for ancestor in ancestors:
+                others = beneath.setdefault(ancestor, [])
+                if others and find(others[-1]) == find(i):
+                    continue
+                others.append(i)
+
+    chains = OrderedDict()
+    for i, operation in enumerate(operations):
+        chains.setdefault(find(i), []).append(operation)
+    return list(chains.values())
+
+
+def _ancestors(path):
+    ancestors = []
+    parent = os.path.dirname(path)
+    while parent != path:
+        ancestors.append(parent)
+        path, parent = parent, os.path.dirname(parent)
+    return ancestors
+
+
+def _same_device(src, dst):
+    """Whether src can be renamed to dst, judged by the device of dst's closest existing parent."""
+    parent = os.path.dirname(os.path.abspath(dst))
+    while not os.path.exists(parent):
+        next_parent = os.path.dirname(parent)
+        if next_parent == parent:
+            break
+        parent = next_parent
+    try:
+        return os.stat(src).st_dev == os.stat(parent).st_dev
+    except OSError:
+        # Let the operation itself report the missing path
+        return True
+
+
+def _tree_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
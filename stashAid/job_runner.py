@@ -0,0 +1,639 @@
+import os
+import re
+import sys
+import json
+import signal
+import time
+import uuid
+import queue
+import logging
+import threading
+import subprocess
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+IS_WINDOWS = sys.platform == 'win32'
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINAL_STATES = (FINISHED, FAILED, CANCELLED)
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{12}$')
+
+
+class Job:
+    """A single script run: its process, recent output and live subscribers."""
+
+    def __init__(self, script_id, command, log_path, buffer_lines, cwd=None, runtime=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.script_id = script_id
+        self.command = command
+        self.runtime = runtime or ('node' if os.path.basename(command[0]).lower().startswith('node') else 'python')
+        self.cwd = cwd
+        self.log_path = log_path
+        self.status = QUEUED
+        self.returncode = None
+        self.created = time.time()
+        self.started = None
+        self.ended = None
+        self.process = None
+        self.pgid = None  # Process group (POSIX) the script and its children run in
+        self.create_time = None  # Start time of the script process, tells it apart from a later process with its pid
+        self.kill_timer = None
+        self.future = None
+        self.cancel_requested = False
+        self.rss_total = 0  # Sum and count of memory samples of the script and its children
+        self.rss_samples = 0
+        self.rss_peak = 0
+        self.cpu_seconds = 0.0  # Totals for the script and its children, from the latest sample
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.last_sample = None
+        self.lines = deque(maxlen=buffer_lines)  # Ring buffer of the most recent output lines
+        self.line_count = 0
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'script_id': self.script_id,
+            'runtime': self.runtime,
+            'status': self.status,
+            'returncode': self.returncode,
+            'pid': self.process.pid if self.process else None,
+            'created': self.created,
+            'started': self.started,
+            'ended': self.ended,
+            'duration': (self.ended or time.time()) - self.started if self.started else None,
+            'lines': self.line_count,
+            'avg_rss': self.rss_total // self.rss_samples if self.rss_samples else None,
+            'peak_rss': self.rss_peak or None,
+            'cpu_seconds': round(self.cpu_seconds, 2),
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+        }
+
+    def publish(self, line):
+        with self.lock:
+            self.lines.append(line)
+            self.line_count += 1
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(line)
+
+    def close(self):
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            subscriber.put(None)
+
+
+class JobRunner:
+    """Runs scripts on a bounded pool of worker threads, one subprocess per job.
+
+    Output is written to a per-job log file, kept in a ring buffer for late
+    subscribers and pushed to every connected SSE client as it arrives. A small
+    JSON record next to the log lets other server worker processes report on,
+    follow and cancel jobs they did not start. Records and logs of finished jobs
+    are deleted once they fall outside the newest keep_jobs or ended more than
+    keep_days ago.
+    """
+
+    def __init__(self, log_dir, max_workers=4, buffer_lines=1000, keep_jobs=200, keep_days=30, kill_grace=10,
+                 sample_interval=2, prune_interval=3600):
+        self.log_dir = log_dir
+        self.kill_grace = kill_grace
+        self.sample_interval = sample_interval
+        self.listeners = []  # Called with each job once it has ended
+        self.sample_listeners = []  # Called with [(job, sample), ...] after each sampling pass
+        self.sampler = None
+        os.makedirs(log_dir, exist_ok=True)
+        self.buffer_lines = buffer_lines
+        self.keep_jobs = keep_jobs
+        self.keep_days = keep_days
+        self.prune_interval = prune_interval
+        self.last_prune = 0.0
+        self.records = {}  # job id -> (record mtime, record) of jobs other workers ran, reread only when they change
+        self.records_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stashaid-job')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.prune()
+
+    def submit(self, script_id, command, cwd=None, runtime=None):
+        job = Job(script_id, command, None, self.buffer_lines, cwd, runtime)
+        job.log_path = os.path.join(self.log_dir, f'{job.id}.log')
+        with self.lock:
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self._save_record(job)
+        if time.time() - self.last_prune >= self.prune_interval:
+            self.prune()
+        job.future = self.executor.submit(self._run, job)
+        logger.info(f"Queued job {job.id} for script '{script_id}'")
+        return job
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def add_sample_listener(self, callback):
+        self.sample_listeners.append(callback)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            jobs = [job.to_dict() for job in reversed(self.jobs.values())]
+        # Jobs started by other worker processes
+        local = {job['id'] for job in jobs}
+        records = [record for job_id, record in self._scan_records().items() if job_id not in local]
+        return sorted(jobs + records, key=lambda job: job['created'], reverse=True)[:self.keep_jobs]
+
+    def _scan_records(self):
+        """Every job record in log_dir; finished records are cached and only read again if their file changes."""
+        records = {}
+        with self.records_lock:
+            with os.scandir(self.log_dir) as entries:
+                for entry in entries:
+                    job_id, ext = os.path.splitext(entry.name)
+                    if ext != '.json':
+                        continue
+                    try:
+                        mtime = entry.stat().st_mtime_ns
+                    except OSError:
+                        continue  # Pruned meanwhile
+                    cached = self.records.get(job_id)
+                    if cached and cached[0] == mtime and cached[1]['status'] in FINAL_STATES:
+                        records[job_id] = cached
+                        continue
+                    record = self.record(job_id)
+                    if record:
+                        records[job_id] = (mtime, record)
+            self.records = records
+        return {job_id: record for job_id, (mtime, record) in records.items()}
+
+    def prune(self):
+        """Delete the records and logs of finished jobs beyond the newest keep_jobs or older than keep_days."""
+        self.last_prune = time.time()
+        cutoff = self.last_prune - self.keep_days * 86400 if self.keep_days else None
+        records = sorted(self._scan_records().values(), key=lambda record: record['created'], reverse=True)
+        pruned = []
+        for index, record in enumerate(records):
+            if record['status'] not in FINAL_STATES:
+                continue
+            if index < self.keep_jobs and (cutoff is None or (record.get('ended') or record['created']) >= cutoff):
+                continue
+            for ext in ('.json', '.log'):
+                try:
+                    os.remove(os.path.join(self.log_dir, record['id'] + ext))
+                except FileNotFoundError:
+                    pass  # Another worker pruned it first
+                except OSError as e:
+                    logger.warning(f"Could not delete {ext} file of job {record['id']}: {str(e)}")
+            pruned.append(record['id'])
+        with self.lock:
+            for job_id in pruned:
+                self.jobs.pop(job_id, None)
+        if pruned:
+            logger.info(f'Deleted records and logs of {len(pruned)} old jobs')
+        return pruned
+
+    def describe(self, job_id):
+        """State of a job from this process, or from its record if another worker runs it."""
+        job = self.get(job_id)
+        return job.to_dict() if job else self.record(job_id)
+
+    def record(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        record_path = os.path.join(self.log_dir, f'{job_id}.json')
+        try:
+            with open(record_path, 'r') as record_file:
+                record = json.load(record_file)
+        except (OSError, ValueError):
+            return None
+        if record['status'] not in FINAL_STATES and not process_alive(record.get('worker'), record.get('worker_started')):
+            # The worker that ran the job died without finishing it; the record would otherwise say running forever
+            record.update(status=FAILED, ended=record.get('ended') or time.time())
+            _write_json(record_path, record)
+            logger.warning(f"Job {job_id} marked failed, its worker process {record.get('worker')} is gone")
+        return record
+
+    def log_path(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        return os.path.join(self.log_dir, f'{job_id}.log')
+
+    def running(self, script_id=None):
+        with self.lock:
+            return [job for job in self.jobs.values()
+                    if job.status in (QUEUED, RUNNING) and (script_id is None or job.script_id == script_id)]
+
+    def running_anywhere(self, script_id=None):
+        """Queued or running jobs of every worker process, as job dicts."""
+        jobs = [job.to_dict() for job in self.running(script_id)]
+        local = {job['id'] for job in jobs}
+        for job_id, record in self._scan_records().items():
+            if job_id not in local and record['status'] not in FINAL_STATES and (script_id is None or record['script_id'] == script_id):
+                jobs.append(record)
+        return jobs
+
+    def cancel(self, job_id, grace=None):
+        job = self.get(job_id)
+        if job is None:
+            return self._cancel_remote(job_id, grace)
+        job.cancel_requested = True
+        if job.future.cancel():
+            # Never started, nothing to terminate
+            self._finish(job, CANCELLED)
+        else:
+            self.terminate(job, grace)
+        return job
+
+    def cancel_runtime(self, runtime, grace=None):
+        """Cancel every queued or running job of one runtime ('python' or 'node'), whichever worker started it."""
+        return [job for job in self.running_anywhere() if job.get('runtime') == runtime and self.cancel(job['id'], grace)]
+
+    def terminate(self, job, grace=None):
+        """Ask the job's whole process group to stop, then SIGKILL it if it is still alive after grace seconds."""
+        process = job.process
+        if process is None or process.poll() is not None:
+            return
+        grace = self.kill_grace if grace is None else grace
+        logger.info(f"Terminating job {job.id} (pid {process.pid}), killing after {grace}s")
+        _signal_group(job, terminate=True)
+        if job.kill_timer is None:
+            job.kill_timer = threading.Timer(grace, self._kill, args=(job,))
+            job.kill_timer.daemon = True
+            job.kill_timer.start()
+
+    def _cancel_remote(self, job_id, grace=None):
+        """Stop a job another worker process started, through the process group in its record."""
+        record = self.record(job_id)
+        if record is None or record['status'] in FINAL_STATES or not record.get('pgid') or IS_WINDOWS:
+            return record
+        pgid = record['pgid']
+        # The group is only signalled while its leader is still the job's script, never a process that reused the pid
+        if not process_alive(pgid, record.get('create_time')):
+            return record
+        try:
+            os.killpg(pgid, signal.SIGTERM)
+        except OSError:
+            return record
+
+        def kill():
+            if not process_alive(pgid, record.get('create_time')):
+                return
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except OSError:
+                pass
+        timer = threading.Timer(self.kill_grace if grace is None else grace, kill)
+        timer.daemon = True
+        timer.start()
+        return record
+
+    def _kill(self, job):
+        if job.process.poll() is None:
+            logger.warning(f"Job {job.id} ignored SIGTERM, killing process group")
+            _signal_group(job, terminate=False)
+
+    def reap(self):
+        """Collect exit codes of finished children so none of them linger as zombies."""
+        with self.lock:
+            processes = [job.process for job in self.jobs.values() if job.process]
+        for process in processes:
+            process.poll()
+
+    def stream(self, job_id, keepalive=15):
+        """Generator of SSE messages: the buffered output first, then live lines until the job ends."""
+        job = self.get(job_id)
+        if job is None:
+            yield from self._follow_record(job_id, keepalive)
+            return
+
+        subscriber = queue.Queue()
+        with job.lock:
+            backlog = list(job.lines)
+            done = job.status in FINAL_STATES
+            if not done:
+                job.subscribers.append(subscriber)
+
+        try:
+            yield f'event: job\ndata: {job.id}\n\n'
+            for line in backlog:
+                yield f'data: {line}\n\n'
+            while not done:
+                try:
+                    line = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if line is None:
+                    break
+                yield f'data: {line}\n\n'
+            yield f'event: end\ndata: {job.status}\n\n'
+        finally:
+            with job.lock:
+                if subscriber in job.subscribers:
+                    job.subscribers.remove(subscriber)
+
+    def _follow_record(self, job_id, keepalive=15, poll=0.5):
+        """Stream a job owned by another worker by tailing its log file until its record says it ended."""
+        log_path = self.log_path(job_id)
+        if self.record(job_id) is None:
+            return
+        yield f'event: job\ndata: {job_id}\n\n'
+        while not os.path.exists(log_path):
+            record = self.record(job_id)
+            if record is None or record['status'] in FINAL_STATES:
+                yield f'event: end\ndata: {record["status"] if record else FAILED}\n\n'
+                return
+            time.sleep(poll)
+
+        idle = 0.0
+        with open(log_path, 'rb') as log_file:
+            while True:
+                line = log_file.readline()
+                if line.endswith(b'\n'):
+                    idle = 0.0
+                    yield 'data: {}\n\n'.format(line.rstrip(b'\r\n').decode('utf-8', errors='replace'))
+                    continue
+                if line:
+                    # Partial line, wait for the rest
+                    log_file.seek(-len(line), os.SEEK_CUR)
+                record = self.record(job_id)
+                if record is None or record['status'] in FINAL_STATES:
+                    for line in log_file.read().splitlines():
+                        yield 'data: {}\n\n'.format(line.decode('utf-8', errors='replace'))
+                    yield f'event: end\ndata: {record["status"] if record else FAILED}\n\n'
+                    return
+                time.sleep(poll)
+                idle += poll
+                if idle >= keepalive:
+                    idle = 0.0
+                    yield ': keepalive\n\n'
+
+    def shutdown(self, grace=5):
+        jobs = self.running()
+        for job in jobs:
+            self.cancel(job.id, grace)
+        deadline = time.time() + grace
+        for job in jobs:
+            if job.process:
+                try:
+                    job.process.wait(timeout=max(0.0, deadline - time.time()))
+                except subprocess.TimeoutExpired:
+                    _signal_group(job, terminate=False)
+                    job.process.wait()
+        self.executor.shutdown(wait=False)
+
+    def _run(self, job):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED)
+            return
+
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        job.started = time.time()
+        job.status = RUNNING
+        try:
+            with open(job.log_path, 'w', encoding='utf-8') as log_file:
+                job.process = subprocess.Popen(
+                    job.command,
+                    cwd=job.cwd,
+                    env=env,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    stdin=subprocess.DEVNULL,
+                    text=True,
+                    encoding='utf-8',
+                    errors='replace',
+                    bufsize=1,
+                    **_process_group_options()
+                )
+                if not IS_WINDOWS:
+                    job.pgid = job.process.pid  # start_new_session makes the child its own group leader
+                try:
+                    job.create_time = psutil.Process(job.process.pid).create_time()
+                except psutil.Error:
+                    pass
+                self._save_record(job)
+                self._ensure_sampler()
+                if job.cancel_requested:
+                    # Cancelled while the process was starting
+                    self.terminate(job)
+                for line in job.process.stdout:
+                    line = line.rstrip('\r\n')
+                    log_file.write(line + '\n')
+                    log_file.flush()
+                    logger.info(f'[{job.script_id}:{job.id}] {line}')
+                    job.publish(line)
+                job.process.stdout.close()
+                job.returncode = job.process.wait()
+        except Exception as e:
+            logger.error(f'Job {job.id} for script {job.script_id} failed: {str(e)}')
+            job.publish(f'Error: {str(e)}')
+            self._finish(job, FAILED)
+            return
+
+        if job.cancel_requested:
+            # Take down anything the script left behind in its process group
+            _signal_group(job, terminate=False)
+            self._finish(job, CANCELLED)
+        else:
+            self._finish(job, FINISHED if job.returncode == 0 else FAILED)
+
+    def _finish(self, job, status):
+        if job.kill_timer is not None:
+            job.kill_timer.cancel()
+        job.status = status
+        job.ended = time.time()
+        logger.info(f"Job {job.id} for script '{job.script_id}' {status} (exit code {job.returncode})")
+        self._save_record(job)
+        job.close()
+        for callback in self.listeners:
+            try:
+                callback(job)
+            except Exception as e:
+                logger.error(f'Job listener failed for job {job.id}: {str(e)}')
+
+    def _ensure_sampler(self):
+        with self.lock:
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample_loop, name='stashaid-job-sampler', daemon=True)
+                self.sampler.start()
+
+    def _sample_loop(self):
+        """One thread samples every running job, and exits once none are left."""
+        handles = {}
+        while True:
+            with self.lock:
+                jobs = [job for job in self.jobs.values() if job.status == RUNNING and job.process]
+                if not jobs:
+                    self.sampler = None
+                    return
+            samples = []
+            for job in jobs:
+                try:
+                    process = handles.get(job.id)
+                    if process is None:
+                        process = handles[job.id] = psutil.Process(job.process.pid)
+                    sample = _sample_tree(process)
+                except psutil.Error:
+                    continue
+                now = time.time()
+                previous = job.last_sample
+                cpu_delta = sample['cpu_seconds'] - previous['cpu_seconds'] if previous else sample['cpu_seconds']
+                elapsed = now - previous['time'] if previous else now - job.started
+                sample.update(time=now, wall=now - job.started,
+                              cpu_percent=round(100 * max(0.0, cpu_delta) / elapsed, 1) if elapsed > 0 else 0.0)
+                job.last_sample = sample
+                job.cpu_seconds = max(job.cpu_seconds, sample['cpu_seconds'])
+                job.read_bytes = max(job.read_bytes, sample['read_bytes'])
+                job.write_bytes = max(job.write_bytes, sample['write_bytes'])
+                job.rss_total += sample['rss']
+                job.rss_samples += 1
+                job.rss_peak = max(job.rss_peak, sample['rss'])
+                samples.append((job, sample))
+            for callback in self.sample_listeners:
+                try:
+                    callback(samples)
+                except Exception as e:
+                    logger.error(f'Job sample listener failed: {str(e)}')
+            for job_id in [job_id for job_id in handles if job_id not in {job.id for job in jobs}]:
+                del handles[job_id]
+            time.sleep(self.sample_interval)
+
+    def _save_record(self, job):
+        worker, worker_started = worker_identity()
+        record = dict(job.to_dict(), pgid=job.pgid, create_time=job.create_time,
+                      worker=worker, worker_started=worker_started)
+        try:
+            _write_json(os.path.join(self.log_dir, f'{job.id}.json'), record)
+        except OSError as e:
+            logger.error(f'Could not write record for job {job.id}: {str(e)}')
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINAL_STATES]
+        for job_id in finished[:max(0, len(self.jobs) - self.keep_jobs)]:
+            del self.jobs[job_id]
+
+
+_worker_identities = {}
+
+
+def worker_identity():
+    """pid and start time of this worker process; looked up per pid since workers are forked."""
+    pid = os.getpid()
+    if pid not in _worker_identities:
+        try:
+            _worker_identities[pid] = psutil.Process(pid).create_time()
+        except psutil.Error:
+            _worker_identities[pid] = None
+    return pid, _worker_identities[pid]
+
+
+def process_alive(pid, create_time):
+    """Whether pid is still the process that started at create_time."""
+    if not pid:
+        return False
+    try:
+        process = psutil.Process(pid)
+        if create_time is not None and abs(process.create_time() - create_time) > 0.01:
+            return False
+        return process.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+    except psutil.Error:
+        return True  # Exists, but belongs to another user; assume it is ours
+
+
+def _write_json(path, data):
+    temp_path = f'{path}.{os.getpid()}.tmp'  # Another worker may write the same record at once
+    with open(temp_path, 'w') as record_file:
+        json.dump(data, record_file)
+    os.replace(temp_path, path)
+
+
+def _sample_tree(process):
+    """CPU time, memory and I/O of a script plus the processes it started.
+
+    CPU time includes children the script already waited for; memory and I/O
+    only count processes that are still alive.
+    """
+    with process.oneshot():
+        times = process.cpu_times()
+        cpu_seconds = times.user + times.system + getattr(times, 'children_user', 0) + getattr(times, 'children_system', 0)
+        rss = process.memory_info().rss
+        read_bytes, write_bytes = _io_bytes(process)
+    for child in process.children(recursive=True):
+        try:
+            with child.oneshot():
+                times = child.cpu_times()
+                cpu_seconds += times.user + times.system
+                rss += child.memory_info().rss
+                child_read, child_write = _io_bytes(child)
+        except psutil.Error:
+            continue
+        read_bytes += child_read
+        write_bytes += child_write
+    return {'cpu_seconds': cpu_seconds, 'rss': rss, 'read_bytes': read_bytes, 'write_bytes': write_bytes}
+
+
+def _io_bytes(process):
+    # Not available on macOS, and may be denied for processes that changed user
+    try:
+        counters = process.io_counters()
+    except (AttributeError, psutil.AccessDenied):
+        return 0, 0
+    return counters.read_bytes, counters.write_bytes
+
+
+def _process_group_options():
+    """Start each script in its own process group so it can be stopped without touching anything else."""
+    if IS_WINDOWS:
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def _signal_group(job, terminate=True):
+    process = job.process
+    try:
+        if IS_WINDOWS:
+            if terminate:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                # Windows has no process group kill; take down the children first, then the script
+                try:
+                    children = psutil.Process(process.pid).children(recursive=True)
+                except psutil.NoSuchProcess:
+                    children = []
+                for child in children:
+                    try:
+                        child.kill()
+                    except psutil.NoSuchProcess:
+                        pass
+                process.kill()
+        else:
+            os.killpg(job.pgid, signal.SIGTERM if terminate else signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, OSError) as e:
+        logger.debug(f"Could not signal job {job.id}: {e}")
+
+
+def script_command(script_type, script_path):
+    """Command line for a discovered script; python scripts use the interpreter running stashAid."""
+    if script_type == 'node':
+        return ['node', script_path]
+    return [sys.executable, script_path]
@@ -0,0 +1,249 @@
+import os
+import re
+import time
+import threading
+
+READ_BLOCK = 64 * 1024  # Unindexed data is read this much at a time
+# Lines look like 'INFO - 2024-05-01 12:00:00 - message', see the formatter in stashAid.py
+LINE_PATTERN = re.compile(rb'^(DEBUG|INFO|WARNING|ERROR|CRITICAL) - (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+LEVEL_BITS = {level: 1 << i for i, level in enumerate(LEVELS)}
+UNTAGGED = 1 << len(LEVELS)  # Tracebacks and other lines without a level prefix
+
+
+def parse_line(line):
+    """Return (level, timestamp) for a raw log line, or (None, None) for continuation lines."""
+    match = LINE_PATTERN.match(line)
+    if match:
+        return match.group(1).decode(), match.group(2).decode()
+    return None, None
+
+
+class Chunk:
+    """Sparse checkpoint: a byte range of whole lines plus what is inside it."""
+
+    __slots__ = ('start', 'end', 'first_ts', 'last_ts', 'levels')
+
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.first_ts = None
+        self.last_ts = None
+        self.levels = 0
+
+    def add(self, line_end, level, timestamp):
+        self.end = line_end
+        self.levels |= LEVEL_BITS[level] if level else UNTAGGED
+        if timestamp:
+            self.first_ts = self.first_ts or timestamp
+            self.last_ts = timestamp
+
+    def may_contain(self, level_mask, since, until):
+        if level_mask and not self.levels & level_mask:
+            return False
+        if since and self.last_ts and self.last_ts < since:
+            return False
+        if until and self.first_ts and self.first_ts > until:
+            return False
+        return True
+
+
+class LogFileIndex:
+    """Checkpoints for one log file, identified by inode so it survives being rotated to .1, .2, ..."""
+
+    def __init__(self, path, inode, chunk_size):
+        self.path = path
+        self.inode = inode
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.indexed_to = 0
+
+    def update(self, size):
+        if size < self.indexed_to:
+            # Truncated in place, start over
+            self.chunks = []
+            self.indexed_to = 0
+        if size == self.indexed_to:
+            return
+
+        chunk = self.chunks[-1] if self.chunks and self.chunks[-1].end - self.chunks[-1].start < self.chunk_size else None
+        with open(self.path, 'rb') as f:
+            f.seek(self.indexed_to)
+            remaining = size - self.indexed_to
+            pending = b''  # Start of a line the previous block cut off
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                data = pending + block
+                # Only index complete lines; a half-written last line is picked up next time
+                complete = data.rfind(b'\n') + 1
+                pending = data[complete:]
+                for line in data[:complete].splitlines(keepends=True):
+                    if chunk is None or chunk.end - chunk.start >= self.chunk_size:
+                        chunk = Chunk(self.indexed_to)
+                        self.chunks.append(chunk)
+                    self.indexed_to += len(line)
+                    level, timestamp = parse_line(line)
+                    chunk.add(self.indexed_to, level, timestamp)
+
+
+class LogIndex:
+    """Byte-offset index over a RotatingFileHandler log and its backups.
+
+    Searches walk the checkpoints newest first and only read chunks whose level
+    mask and timestamp range can match, seeking straight to them. Results come
+    back newest first with a cursor for the next (older) page.
+    """
+
+    def __init__(self, path, backup_count=3, chunk_size=64 * 1024):
+        self.path = path
+        self.backup_count = backup_count
+        self.chunk_size = chunk_size
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def paths(self):
+        return [self.path] + [f'{self.path}.{i}' for i in range(1, self.backup_count + 1)]
+
+    def update(self):
+        """Bring the checkpoints up to date; returns the file indexes newest first."""
+        with self.lock:
+            current = []
+            for path in self.paths():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                index = self.files.get(stat.st_ino)
+                if index is None:
+                    index = self.files[stat.st_ino] = LogFileIndex(path, stat.st_ino, self.chunk_size)
+                index.path = path
+                index.update(stat.st_size)
+                current.append(index)
+            live = {index.inode for index in current}
+            for inode in list(self.files):
+                if inode not in live:
+                    del self.files[inode]
+            return current
+
+    def search(self, level=None, query=None, since=None, until=None, limit=200, cursor=None):
+        """Return (lines newest first, cursor for the next page or None).
+
+        level matches that level exactly, query is a case-insensitive substring,
+        since/until are 'YYYY-mm-dd HH:MM:SS' strings (prefixes like '2024-05-01' work).
+        """
+        level_mask = LEVEL_BITS.get((level or '').upper(), 0)
+        needle = query.lower().encode() if query else None
+        until = until + '\xff' if until else None  # Let a date prefix include the whole day
+
+        cursor_inode, cursor_offset = parse_cursor(cursor)
+        files = self.update()
+        if cursor_inode is not None:
+            inodes = [index.inode for index in files]
+            if cursor_inode not in inodes:
+                return [], None
+            files = files[inodes.index(cursor_inode):]
+
+        results = []
+        for index in files:
+            boundary = cursor_offset if index.inode == cursor_inode else None
+            with open(index.path, 'rb') as f:
+                for chunk in reversed(index.chunks):
+                    if boundary is not None and chunk.start >= boundary:
+                        continue
+                    if not chunk.may_contain(level_mask, since, until):
+                        continue
+                    f.seek(chunk.start)
+                    end = min(chunk.end, boundary) if boundary is not None else chunk.end
+                    data = f.read(end - chunk.start)
+
+                    offsets = []
+                    position = chunk.start
+                    for line in data.splitlines(keepends=True):
+                        offsets.append((position, line))
+                        position += len(line)
+
+                    for offset, line in reversed(offsets):
+                        if not self._matches(line, level_mask, needle, since, until):
+                            continue
+                        results.append(line.rstrip(b'\r\n').decode('utf-8', errors='replace'))
+                        if len(results) >= limit:
+                            return results, f'{index.inode}:{offset}'
+        return results, None
+
+    @staticmethod
+    def _matches(line, level_mask, needle, since, until):
+        if level_mask or since or until:
+            level, timestamp = parse_line(line)
+            if level_mask and LEVEL_BITS.get(level, 0) != level_mask:
+                return False
+            if since and (not timestamp or timestamp < since):
+                return False
+            if until and (not timestamp or timestamp > until):
+                return False
+        return needle is None or needle in line.lower()
+
+    def follow(self, level=None, query=None, poll=1.0, keepalive=15):
+        """Generator of SSE messages for lines appended to the live log, following rotation.
+
+        level and query filter the lines the same way search() does.
+        """
+        level_mask = LEVEL_BITS.get((level or '').upper(), 0)
+        needle = query.lower().encode() if query else None
+        f = None
+        inode = None
+        from_start = False  # The first open starts at the end; after a rollover, read the new file from the top
+        idle = 0.0
+        try:
+            while True:
+                if f is None:
+                    try:
+                        f = open(self.path, 'rb')
+                    except OSError:
+                        time.sleep(poll)
+                        continue
+                    inode = os.fstat(f.fileno()).st_ino
+                    if not from_start:
+                        f.seek(0, os.SEEK_END)
+
+                line = f.readline()
+                if line.endswith(b'\n'):
+                    if self._matches(line, level_mask, needle, None, None):
+                        yield 'data: {}\n\n'.format(line.rstrip(b'\r\n').decode('utf-8', errors='replace'))
+                    continue
+                if line:
+                    # Partial line, wait for the rest
+                    f.seek(-len(line), os.SEEK_CUR)
+
+                try:
+                    stat = os.stat(self.path)
+                    rotated = stat.st_ino != inode or stat.st_size < f.tell()
+                except OSError:
+                    rotated = True
+                if rotated:
+                    f.close()
+                    f = None
+                    from_start = True
+                    continue
+
+                time.sleep(poll)
+                idle += poll
+                if idle >= keepalive:
+                    idle = 0.0
+                    yield ': keepalive\n\n'
+        finally:
+            if f is not None:
+                f.close()
+
+
+def parse_cursor(cursor):
+    if not cursor:
+        return None, None
+    try:
+        inode, offset = cursor.split(':')
+        return int(inode), int(offset)
+    except ValueError:
+        return None, None
@@ -0,0 +1,155 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+
+class _DirtyHandler(FileSystemEventHandler):
+
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        self.index.dirty = True
+
+
+class MediaIndex:
+    """Persistent SQLite index of the clips under the videos directory.
+
+    Only directories whose mtime changed since the last scan are listed again,
+    so a refresh of an unchanged library costs one stat per directory. When the
+    optional watchdog package is installed, filesystem events mark the index
+    dirty and the scan is skipped entirely until something changes.
+    """
+
+    def __init__(self, video_dir, db_path, extensions=('.webm',), max_age=30):
+        self.video_dir = os.path.abspath(video_dir)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.max_age = max_age
+        self.last_refresh = 0
+        self.dirty = True
+        self.observer = None
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE TABLE IF NOT EXISTS clips (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                movie TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS clips_movie ON clips (movie, filename);
+            CREATE INDEX IF NOT EXISTS clips_dir ON clips (dir);
+        ''')
+
+    def watch(self):
+        """Start a watchdog observer if the package is available; returns True when watching."""
+        if Observer is None or self.observer is not None or not os.path.isdir(self.video_dir):
+            return self.observer is not None
+        self.observer = Observer()
+        self.observer.schedule(_DirtyHandler(self), self.video_dir, recursive=True)
+        self.observer.daemon = True
+        self.observer.start()
+        return True
+
+    def close(self):
+        if self.observer is not None:
+            self.observer.stop()
+        self.db.close()
+
+    def refresh_if_stale(self):
+        # Without a watcher we cannot know about changes, so fall back to a periodic delta scan
+        stale = self.dirty if self.observer is not None else time.time() - self.last_refresh > self.max_age
+        if stale:
+            self.refresh()
+
+    def refresh(self):
+        """Delta scan: re-list only directories whose mtime changed, drop directories that disappeared."""
+        started = time.time()
+        with self.lock:
+            self.dirty = False
+            known = {path: (parent, mtime) for path, parent, mtime in self.db.execute('SELECT path, parent, mtime FROM dirs')}
+            seen = set()
+            rescanned = 0
+            with self.db:
+                pending = [(self.video_dir, None)]
+                while pending:
+                    directory, parent = pending.pop()
+                    try:
+                        mtime = os.stat(directory).st_mtime
+                    except OSError:
+                        continue
+                    seen.add(directory)
+
+                    if directory in known and known[directory][1] == mtime:
+                        subdirs = [row[0] for row in self.db.execute('SELECT path FROM dirs WHERE parent = ?', (directory,))]
+                    else:
+                        subdirs = self._rescan_directory(directory, parent, mtime)
+                        rescanned += 1
+                    pending.extend((subdir, directory) for subdir in subdirs)
+
+                removed = [path for path in known if path not in seen]
+                for path in removed:
+                    self.db.execute('DELETE FROM dirs WHERE path = ?', (path,))
+                    self.db.execute('DELETE FROM clips WHERE dir = ?', (path,))
+            self.last_refresh = time.time()
+        if rescanned or removed:
+            logger.info(f"Media index: {rescanned} director(ies) rescanned, {len(removed)} removed in {time.time() - started:.2f}s")
+
+    def _rescan_directory(self, directory, parent, mtime):
+        subdirs = []
+        clips = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(self.extensions):
+                        stat = entry.stat()
+                        clips.append((entry.path, directory, os.path.basename(directory), entry.name, stat.st_size, stat.st_mtime))
+        except OSError as e:
+            logger.error(f"Media index could not list {directory}: {str(e)}")
+            return []
+
+        self.db.execute('INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)', (directory, parent, mtime))
+        self.db.execute('DELETE FROM clips WHERE dir = ?', (directory,))
+        self.db.executemany('INSERT OR REPLACE INTO clips (path, dir, movie, filename, size, mtime) VALUES (?, ?, ?, ?, ?, ?)', clips)
+        # Subdirectories that vanished are caught by the 'removed' pass of refresh()
+        return subdirs
+
+    def movie_count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(DISTINCT movie) FROM clips').fetchone()[0]
+
+    def movies(self, page=1, per_page=50):
+        """One page of movies (sorted by name) with their clips, in the {movie: [{'filename': ...}]} shape the page uses."""
+        offset = (max(1, page) - 1) * per_page
+        with self.lock:
+            names = [row[0] for row in self.db.execute(
+                'SELECT DISTINCT movie FROM clips ORDER BY movie LIMIT ? OFFSET ?', (per_page, offset))]
+            video_clips = {name: [] for name in names}
+            if names:
+                placeholders = ','.join('?' * len(names))
+                for movie, filename, size in self.db.execute(
+                        f'SELECT movie, filename, size FROM clips WHERE movie IN ({placeholders}) ORDER BY movie, filename', names):
+                    video_clips[movie].append({'filename': filename, 'size': size})
+        return video_clips
@@ -0,0 +1,201 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_TYPES = {'.py': 'python', '.js': 'node'}
+
+# Directories that never contain runnable scripts and can be huge
+PRUNED_DIRECTORIES = {'node_modules', '__pycache__', '.git', '.venv', 'venv'}
+
+
+class ScriptRegistry:
+    """Scripts under the python-scripts and node-scripts folders, persisted in SQLite.
+
+    The first start walks the folders once; afterwards only directories whose
+    mtime changed are listed again, so new or removed scripts show up without a
+    restart. Every change bumps a generation counter in the database, so server
+    workers sharing it reload their scripts when another worker found the change.
+    Run statistics (last duration, average memory) are kept per script.
+    """
+
+    def __init__(self, directories, db_path, refresh_interval=10):
+        self.directories = [os.path.normpath(directory) for directory in directories]
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.watcher = None
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS script_dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS script_dirs_parent ON script_dirs (parent);
+            CREATE TABLE IF NOT EXISTS scripts (
+                path TEXT PRIMARY KEY,
+                id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS scripts_dir ON scripts (dir);
+            CREATE TABLE IF NOT EXISTS script_stats (
+                id TEXT PRIMARY KEY,
+                runs INTEGER NOT NULL DEFAULT 0,
+                last_run REAL,
+                last_status TEXT,
+                last_duration REAL,
+                total_duration REAL NOT NULL DEFAULT 0,
+                avg_rss INTEGER,
+                peak_rss INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+        self.paths = {}
+        self.generation = None  # Generation self.paths was loaded at
+        self.refresh()
+
+    def refresh(self):
+        """Re-list directories whose mtime changed; returns True if the set of scripts changed."""
+        with self.lock:
+            known = {row['path']: row['mtime'] for row in self.db.execute('SELECT path, mtime FROM script_dirs')}
+            seen = set()
+            changed = False
+            with self.db:
+                pending = [(directory, None) for directory in self.directories]
+                while pending:
+                    directory, parent = pending.pop()
+                    try:
+                        mtime = os.stat(directory).st_mtime
+                    except OSError:
+                        continue
+                    seen.add(directory)
+                    if known.get(directory) == mtime:
+                        subdirs = [row[0] for row in self.db.execute('SELECT path FROM script_dirs WHERE parent = ?', (directory,))]
+                    else:
+                        subdirs = self._rescan_directory(directory, parent, mtime)
+                        changed = True
+                    pending.extend((subdir, directory) for subdir in subdirs)
+
+                for path in set(known) - seen:
+                    self.db.execute('DELETE FROM script_dirs WHERE path = ?', (path,))
+                    self.db.execute('DELETE FROM scripts WHERE dir = ?', (path,))
+                    changed = True
+
+                if changed:
+                    self.db.execute('''
+                        INSERT INTO meta (key, value) VALUES ('generation', '1')
+                        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+                    ''')
+                generation = self._generation()
+
+            if generation != self.generation:
+                # Changed here, or by another worker since this one last loaded
+                self.paths = self._load_paths()
+                self.generation = generation
+                changed = True
+        return changed
+
+    def _generation(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row['value']) if row else 0
+
+    def _rescan_directory(self, directory, parent, mtime):
+        subdirs = []
+        scripts = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in PRUNED_DIRECTORIES:
+                            subdirs.append(entry.path)
+                        continue
+                    script_type = SCRIPT_TYPES.get(os.path.splitext(entry.name)[1])
+                    if script_type:
+                        script_id = entry.name.split('.')[0]  # Extract script ID from filename
+                        scripts.append((entry.path, script_id, script_type, directory, entry.stat().st_mtime))
+        except OSError as e:
+            logger.error(f'Script registry could not list {directory}: {str(e)}')
+            return []
+        self.db.execute('INSERT OR REPLACE INTO script_dirs (path, parent, mtime) VALUES (?, ?, ?)', (directory, parent, mtime))
+        self.db.execute('DELETE FROM scripts WHERE dir = ?', (directory,))
+        self.db.executemany('INSERT OR REPLACE INTO scripts (path, id, type, dir, mtime) VALUES (?, ?, ?, ?, ?)', scripts)
+        return subdirs
+
+    def _load_paths(self):
+        # Same shape as the old script_paths dict: {script_id: {'type': ..., 'path': ...}}
+        return {row['id']: {'type': row['type'], 'path': row['path']}
+                for row in self.db.execute('SELECT id, type, path FROM scripts ORDER BY path')}
+
+    def get(self, script_id):
+        return self.paths.get(script_id)
+
+    def metadata(self):
+        """Every script with its runtime and run statistics."""
+        with self.lock:
+            stats = {row['id']: dict(row) for row in self.db.execute('SELECT * FROM script_stats')}
+            paths = dict(self.paths)
+        scripts = []
+        for script_id, info in sorted(paths.items()):
+            stat = stats.get(script_id, {})
+            runs = stat.get('runs', 0)
+            scripts.append({
+                'id': script_id,
+                'runtime': info['type'],
+                'path': info['path'],
+                'runs': runs,
+                'last_run': stat.get('last_run'),
+                'last_status': stat.get('last_status'),
+                'last_duration': stat.get('last_duration'),
+                'avg_duration': stat['total_duration'] / runs if runs else None,
+                'avg_rss': stat.get('avg_rss'),
+                'peak_rss': stat.get('peak_rss'),
+            })
+        return scripts
+
+    def record_run(self, job):
+        """Job runner listener: fold a finished job into its script's statistics."""
+        if not job.started:
+            return
+        duration = job.ended - job.started
+        avg_rss = job.rss_total // job.rss_samples if job.rss_samples else None
+        with self.lock, self.db:
+            self.db.execute('INSERT OR IGNORE INTO script_stats (id) VALUES (?)', (job.script_id,))
+            self.db.execute('''
+                UPDATE script_stats SET
+                    avg_rss = CASE WHEN ? IS NULL THEN avg_rss
+                                   WHEN avg_rss IS NULL THEN ?
+                                   ELSE (avg_rss * runs + ?) / (runs + 1) END,
+                    peak_rss = NULLIF(MAX(COALESCE(peak_rss, 0), COALESCE(?, 0)), 0),
+                    runs = runs + 1,
+                    last_run = ?,
+                    last_status = ?,
+                    last_duration = ?,
+                    total_duration = total_duration + ?
+                WHERE id = ?
+            ''', (avg_rss, avg_rss, avg_rss, job.rss_peak, job.started, job.status, duration, duration, job.script_id))
+
+    def watch(self):
+        """Refresh in the background so new scripts appear without restarting stashAid."""
+        if self.watcher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.refresh_interval)
+                try:
+                    if self.refresh():
+                        logger.info(f'Script registry updated: {len(self.paths)} script(s)')
+                except Exception as e:
+                    logger.error(f'Script registry refresh failed: {str(e)}')
+
+        self.watcher = threading.Thread(target=loop, name='stashaid-script-registry', daemon=True)
+        self.watcher.start()
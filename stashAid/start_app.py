@@ -1,20 +1,83 @@
-from stashAid import app
+import os
+import sys
+import argparse
+import importlib.util
 import logging
 from logging.handlers import RotatingFileHandler
 
-def setup_logging():
+def setup_logging(app):
     """Set up the app's logging."""
     handler = RotatingFileHandler('stashAid.log', maxBytes=10000, backupCount=1)
     handler.setLevel(logging.INFO)
     app.logger.addHandler(handler)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Start the stashAid web server.')
+    parser.add_argument('--production', action='store_true', default=os.environ.get('STASHAID_ENV') == 'production',
+                        help='Serve with gunicorn (or waitress on Windows) instead of the Flask development server')
+    parser.add_argument('--host', default=os.environ.get('STASHAID_HOST', '127.0.0.1'),
+                        help="Interface to listen on, use 0.0.0.0 to make stashAid reachable on your network")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('STASHAID_PORT', 5123)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('STASHAID_WORKERS', 2)),
+                        help='Worker processes (gunicorn only)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('STASHAID_THREADS', 8)),
+                        help='Threads per worker; live log and job streams each hold one while open')
+    return parser.parse_args()
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class StashAidApplication(BaseApplication):
+
+        def load_config(self):
+            options = {
+                'bind': f'{args.host}:{args.port}',
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread',
+                # Server-sent event streams stay open for a long time; gthread workers heartbeat independently
+                'timeout': 120,
+                'graceful_timeout': 30,
+                'pidfile': os.path.join('data', 'stashAid.pid'),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Imported in each worker, so every worker gets its own job runner and database connections.
+            # stashAid.py makes sure only one of them runs the task scheduler.
+            from stashAid import app
+            setup_logging(app)
+            return app
+
+    StashAidApplication().run()
+
+def run_waitress(args):
+    from waitress import serve
+    from stashAid import app
+    setup_logging(app)
+    app.logger.info(f'Serving stashAid with waitress on {args.host}:{args.port} ({args.threads} threads)')
+    serve(app, host=args.host, port=args.port, threads=args.threads, channel_timeout=120)
+
 def run():
-    setup_logging()
+    args = parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('data', exist_ok=True)
+
+    if args.production:
+        if sys.platform != 'win32' and importlib.util.find_spec('gunicorn'):
+            run_gunicorn(args)
+        else:
+            # gunicorn does not run on Windows; waitress is a single process with a thread pool
+            run_waitress(args)
+        return
+
+    from stashAid import app
+    setup_logging(app)
     # Optional: Configure the log level and start the Flask app with more detailed output
     app.logger.setLevel(logging.INFO)
     app.logger.info('Starting stashAid Flask application...')
-    # Consider adding host='0.0.0.0' if you want your app to be accessible on your network
-    app.run(port=5123, debug=True)  # Be cautious with debug=True in production environments
+    app.run(host=args.host, port=args.port, debug=True, threaded=True)  # Be cautious with debug=True in production environments
 
 if __name__ == '__main__':
     run()
@@ -1,20 +1,29 @@
-from flask import Flask, render_template, send_from_directory, Response, request, jsonify, redirect, url_for
+from flask import Flask, render_template, send_from_directory, Response, request, jsonify, redirect, url_for, stream_with_context
 from flask_cors import CORS
 import subprocess
 import os
 import sys
 import time
 import psutil
+import atexit
 from pathlib import Path
 import logging
 from logging.handlers import RotatingFileHandler
-from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime
 import json
-from apscheduler.jobstores.base import JobLookupError
 import mimetypes
-from flask import send_from_directory, abort
+from flask import send_from_directory, send_file, abort
+from werkzeug.security import safe_join
 from setproctitle import setproctitle
+from job_runner import JobRunner, script_command
+from transcoder import Transcoder
+from media_index import MediaIndex
+from log_index import LogIndex
+import task_scheduler
+from file_browser import FileBrowser
+from script_registry import ScriptRegistry
+from file_ops import FileOperations
+from telemetry import TelemetryStore
 
 # Set the process title
 setproctitle("stashAid.py")
@@ -34,37 +43,54 @@ formatter = logging.Formatter('%(levelname)s - %(asctime)s - %(message)s', datef
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-# Initialize APScheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
-
-# Store the count of script executions to terminate repeated requests
-script_execution_count = {}
-
 # Get the Flask server process ID
 flask_server_pid = os.getpid()
 
-# List to store tasks
-tasks = []
-
 # Define the base directory for videos
 VIDEO_BASE_DIR = os.path.join(app.static_folder, 'videos')
 
-# Function to execute a script
+# Directory for stashAid's own state (job logs, indexes, databases)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Scripts run in the background on a bounded pool; output is kept per job
+job_runner = JobRunner(
+    os.path.join(DATA_DIR, 'jobs'),
+    max_workers=int(os.environ.get('STASHAID_MAX_JOBS', 4)),
+    keep_days=int(os.environ.get('STASHAID_KEEP_JOB_DAYS', 30))
+)
+atexit.register(job_runner.shutdown)
+
+# Scripts under python-scripts and node-scripts, refreshed in the background as folders change
+os.makedirs(DATA_DIR, exist_ok=True)
+script_registry = ScriptRegistry(
+    [os.path.join(os.path.dirname(os.path.abspath(__file__)), directory) for directory in ('python-scripts', 'node-scripts')],
+    os.path.join(DATA_DIR, 'scripts.db')
+)
+script_registry.watch()
+job_runner.add_listener(script_registry.record_run)
+
+# CPU, memory and I/O of every job, sampled while it runs
+telemetry = TelemetryStore(os.path.join(DATA_DIR, 'telemetry.db'), retention_days=int(os.environ.get('STASHAID_TELEMETRY_DAYS', 30)))
+job_runner.add_sample_listener(telemetry.record_samples)
+job_runner.add_listener(telemetry.record_job)
+
+# Scheduled tasks, their run history and the APScheduler job store live in one SQLite file
+task_store = task_scheduler.TaskStore(os.path.join(DATA_DIR, 'tasks.db'))
+scheduler = task_scheduler.create_scheduler(
+    os.path.join(DATA_DIR, 'tasks.db'),
+    misfire_grace_time=int(os.environ.get('STASHAID_MISFIRE_GRACE', task_scheduler.DEFAULT_MISFIRE_GRACE))
+)
+
+# Function to start a script as a background job
 def execute_script(script_id):
-    script_info = script_paths.get(script_id)
+    script_info = script_registry.get(script_id)
     if script_info:
-        script_type = script_info['type']
-        script_path = script_info['path']
-        process = subprocess.Popen([script_type, script_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        return process
+        runtime, script_path = script_info['type'], script_info['path']
+    elif script_id in execute_script_paths:
+        runtime, script_path = 'python', execute_script_paths[script_id]
     else:
         raise ValueError('Invalid script ID')
-
-# Function to stream output from a process
-def stream_output(process):
-    for line in iter(process.stdout.readline, ''):
-        yield 'data: {}\n\n'.format(line.strip())
+    return job_runner.submit(script_id, script_command(runtime, script_path), runtime=runtime)
 
 # Route to serve index.html template
 @app.route('/')
@@ -85,73 +111,103 @@ execute_script_paths = {
     # Add more script IDs and paths as needed
 }
 
-# Dictionary to keep track of script execution count
-script_execution_count = {}
-
-# Dictionary to store running processes
-running_processes = {}
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Function to execute a script
-def execute_script(script_path):
-    return subprocess.Popen(["python", script_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-# Route to execute a script
+# Route to execute a script: starts a job and streams its output as server-sent events
 @app.route('/execute_script/<script_id>')
 def execute_script_route(script_id):
-    if script_id in execute_script_paths:
-        script_path = execute_script_paths[script_id]  # Get the script path for the given script ID
-        if script_id in script_execution_count:
-            # Check if the script has already been executed once
-            if script_execution_count[script_id] > 0:
-                return jsonify({'error': 'Script already executed once'}), 400
+    try:
+        job = execute_script(script_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        script_execution_count[script_id] = script_execution_count.get(script_id, 0) + 1
+    response = Response(stream_with_context(job_runner.stream(job.id)), content_type='text/event-stream')
+    response.headers['X-Job-Id'] = job.id
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
+# Route to list jobs or start one without waiting for its output
+@app.route('/jobs', methods=['GET', 'POST'])
+def jobs():
+    if request.method == 'POST':
+        script_id = (request.get_json(silent=True) or {}).get('script_id') or request.form.get('script_id')
         try:
-            process = execute_script(script_path)  # Pass the script path to the execute_script function
-            running_processes[script_id] = process
-            
-            # Read output from the script and log it
-            for line in iter(process.stdout.readline, b''):
-                logger.info(line.strip())
-            
-            return Response(stream_output(process), content_type='text/event-stream')
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
-    else:
-        return jsonify({'error': 'Invalid script ID'}), 400
-
-
-# Route to terminate a script
+            job = execute_script(script_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(job.to_dict()), 202
+    return jsonify(job_runner.list())
+
+# Route to get the state of a job
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_runner.describe(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+# Route to follow a job's output; any number of clients can attach
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    if job_runner.describe(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return Response(stream_with_context(job_runner.stream(job_id)), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+# Route to download a job's full output
+@app.route('/jobs/<job_id>/log')
+def job_log(job_id):
+    log_path = job_runner.log_path(job_id)
+    if log_path is None or not os.path.exists(log_path):
+        return jsonify({'error': 'Job not found'}), 404
+    return send_from_directory(os.path.dirname(log_path), os.path.basename(log_path), mimetype='text/plain')
+
+# Route to cancel a queued or running job
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if job_runner.cancel(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_runner.describe(job_id)), 202
+
+
+# Function to read the days query parameter as a start timestamp
+def get_since_arg(default_days=7):
+    days = request.args.get('days', default_days, type=float)
+    return time.time() - days * 86400 if days > 0 else None
+
+# Route to compare scripts by resource usage, plus load by hour of day
+@app.route('/api/telemetry')
+def api_telemetry():
+    since = get_since_arg()
+    return jsonify({'scripts': telemetry.scripts(since), 'hourly': telemetry.hourly_load(since)})
+
+# Route to list finished jobs with their resource usage
+@app.route('/api/telemetry/jobs')
+def api_telemetry_jobs():
+    limit = min(1000, max(1, request.args.get('limit', 100, type=int)))
+    return jsonify(telemetry.jobs(request.args.get('script_id'), get_since_arg(), limit))
+
+# Route to get one job's resource samples over time
+@app.route('/api/telemetry/jobs/<job_id>')
+def api_telemetry_job(job_id):
+    job = job_runner.describe(job_id)
+    samples = telemetry.samples(job_id)
+    if job is None and not samples:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job, 'samples': samples})
+
+# Route to terminate a script: stops only the jobs stashAid started for that runtime
 @app.route('/terminate_script/<script_type>', methods=['POST'])
 def terminate_script(script_type):
+    if script_type not in ('python', 'node'):
+        return jsonify({'error': 'Invalid script type'}), 400
     try:
-        if script_type == 'python':
-            # Iterate through all running processes except the Flask server process
-            for proc in psutil.process_iter():
-                try:
-                    # Check if the process name contains 'python' and it's not the Flask server process
-                    if 'python' in proc.name().lower() and proc.pid != flask_server_pid:
-                        proc.terminate()  # Terminate the Python process
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    pass
-            return jsonify({'message': 'Python scripts terminated successfully'}), 200
-        elif script_type == 'node':
-            # Iterate through all running processes
-            for proc in psutil.process_iter():
-                try:
-                    # Check if the process name contains 'node'
-                    if 'node' in proc.name().lower():
-                        proc.terminate()  # Terminate the Node process
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    pass
-            return jsonify({'message': 'Node scripts terminated successfully'}), 200
-        else:
-            return jsonify({'error': 'Invalid script type'}), 400
+        cancelled = job_runner.cancel_runtime(script_type)
+        job_runner.reap()
+        return jsonify({
+            'message': f'{script_type.capitalize()} scripts terminated successfully',
+            'jobs': [job['id'] for job in cancelled]
+        }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -194,34 +250,41 @@ def add_task():
         scheduled_time = request.form['scheduled_time']
         script_id = request.form['script_id']
         
-        # Add the new task to the tasks list
-        new_task = {'id': len(tasks) + 1, 'name': task_name, 'description': task_description, 'scheduled_time': scheduled_time, 'script_id': script_id}
-        tasks.append(new_task)
-        
-        # Save the updated tasks to the JSON file
-        save_tasks_to_json(tasks)
-        
+        # Store the new task and schedule it
+        new_task = task_store.add(task_name, task_description, scheduled_time, script_id)
+        try:
+            task_scheduler.schedule_task(scheduler, new_task)
+        except Exception as e:
+            logger.error(f"Failed to schedule task {new_task['id']}: {str(e)}")
+
         return redirect(url_for('view_tasks'))
 
 
-# Route to get files from a directory
+# Root the file browser API lists directories under
+FILES_BASE_DIR = os.environ.get('STASHAID_FILES_ROOT', 'C:\\')
+
+# Directory listings for the file browser, cached briefly per directory
+file_browser = FileBrowser()
+
+# Route to get files from a directory, one page at a time
+# Query parameters: sort=name|size|mtime|type, order=asc|desc, limit, cursor (from next_cursor)
 @app.route('/api/files/<path:directory>')
 def get_files(directory):
-    full_path = os.path.join('C:\\', directory)  # Adjust base directory as needed
-    if os.path.isdir(full_path):
-        files = os.listdir(full_path)
-        file_data = []
-        for file in files:
-            file_path = os.path.join(full_path, file)
-            file_info = {
-                'name': file,
-                'is_dir': os.path.isdir(file_path),
-                'size': os.path.getsize(file_path),
-            }
-            file_data.append(file_info)
-        return jsonify(file_data)
-    else:
-        return jsonify({'error': 'Directory not found'}), 404    
+    full_path = os.path.join(FILES_BASE_DIR, directory)
+    if not os.path.isdir(full_path):
+        return jsonify({'error': 'Directory not found'}), 404
+    try:
+        return jsonify(file_browser.page(
+            full_path,
+            sort=request.args.get('sort', 'name'),
+            order=request.args.get('order', 'asc'),
+            cursor=request.args.get('cursor'),
+            limit=min(5000, max(1, request.args.get('limit', 500, type=int)))
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/restart_stashaid', methods=['POST'])
 def restart_stashaid():
@@ -348,19 +411,39 @@ def delete_file():
 def stash_data():
     return render_template('stash_data.html')
 
-# Route to view logs
+# Byte-offset index over app.log and its rotated backups
+log_index = LogIndex('app.log', backup_count=handler.backupCount)
+
+# Route to view logs: the most recent page, oldest line first
 @app.route('/logs')
 def view_logs():
     level = request.args.get('level', '').upper()
-    query = request.args.get('query', '').lower()
-    
-    logs = []
-    with open('app.log', 'r') as log_file:
-        for line in log_file:
-            if (not level or level in line) and (not query or query in line.lower()):
-                logs.append(line)
-    
-    return render_template('logs.html', logs=logs)
+    query = request.args.get('query', '')
+    limit = min(5000, max(1, request.args.get('limit', 1000, type=int)))
+
+    lines, cursor = log_index.search(level=level, query=query, limit=limit, cursor=request.args.get('cursor'))
+    return render_template('logs.html', logs=list(reversed(lines)), cursor=cursor,
+                           filters={'level': level, 'query': query})
+
+# Route to page through the logs as JSON, newest first
+@app.route('/api/logs')
+def api_logs():
+    lines, cursor = log_index.search(
+        level=request.args.get('level'),
+        query=request.args.get('query'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        limit=min(5000, max(1, request.args.get('limit', 200, type=int))),
+        cursor=request.args.get('cursor')
+    )
+    return jsonify({'lines': lines, 'cursor': cursor})
+
+# Route to follow app.log live as server-sent events
+@app.route('/logs/stream')
+def stream_logs():
+    follow = log_index.follow(level=request.args.get('level'), query=request.args.get('query'))
+    return Response(stream_with_context(follow), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 
 def shutdown_server():
@@ -374,102 +457,64 @@ def shutdown():
     shutdown_server()
     return 'Server shutting down...'
 
+# Liveness probe: the process is up and serving requests
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok', 'pid': os.getpid()}), 200
+
+# Readiness probe: the databases answer and the scheduler is running somewhere
+@app.route('/readyz')
+def readyz():
+    checks = {}
+    try:
+        task_store.list()
+        checks['tasks_db'] = 'ok'
+    except Exception as e:
+        checks['tasks_db'] = str(e)
+    checks['scheduler'] = 'running' if scheduler_lock.held else 'standby'
+    checks['jobs_running'] = len(job_runner.running())
+    ready = checks['tasks_db'] == 'ok'
+    return jsonify({'status': 'ready' if ready else 'not ready', 'pid': os.getpid(), 'checks': checks}), 200 if ready else 503
+
 @app.errorhandler(404)
 def page_not_found(error):
     return jsonify({'error': 'Page not found'}), 404
 
-# Mapping of script IDs to script paths
-script_paths = {}
-
-# Function to recursively search for scripts in the specified directories
-def find_scripts(directory):
-    for root, dirs, files in os.walk(directory):
-        # Check if the current directory is one of the allowed script directories
-        if (root.startswith('./node-scripts') or root.startswith('./python-scripts')) and 'node_modules' not in root:
-            for file in files:
-                if file.endswith('.py') or file.endswith('.js'):
-                    script_id = file.split('.')[0]  # Extract script ID from filename
-                    script_type = 'python' if file.endswith('.py') else 'node'
-                    script_path = os.path.join(root, file)
-                    script_paths[script_id] = {'type': script_type, 'path': script_path}
-
-# Specify the directories containing the scripts
-script_directories = ['./python-scripts', './node-scripts']
-
-# Populate script_paths dictionary by searching for scripts in the specified directories
-for directory in script_directories:
-    find_scripts(directory)
-
 # Route to serve tasks.html template
 @app.route('/view_tasks')
 def view_tasks():
-    # Filter script_paths to include only scripts associated with current tasks
-    task_script_ids = {task['script_id'] for task in tasks}
-    filtered_script_paths = {script_id: script_info for script_id, script_info in script_paths.items() if script_id in task_script_ids}
-    
-    return render_template('tasks.html', tasks=tasks, script_paths=script_paths)
+    return render_template('tasks.html', tasks=task_store.list(), script_paths=script_registry.paths)
+
+# Route to list the available scripts with their runtime and run statistics
+@app.route('/api/scripts')
+def api_scripts():
+    return jsonify(script_registry.metadata())
+
+# Route to get the run history of all tasks, or of one with ?task_id=
+@app.route('/api/tasks/history')
+def task_history():
+    task_id = request.args.get('task_id', type=int)
+    limit = min(1000, max(1, request.args.get('limit', 100, type=int)))
+    return jsonify(task_store.history(task_id, limit))
 
 
 
-# Populate script_paths dictionary by searching for scripts in the specified directories
-script_paths = {}
-for directory in script_directories:
-    find_scripts(directory)
-    
 # Route to delete a task
 @app.route('/delete_task/<int:task_id>', methods=['DELETE'])
 def delete_task(task_id):
-    global tasks
-    try:
-        scheduler.remove_job(str(task_id))
-    except JobLookupError:
-        pass  # Job not found in scheduler
-    tasks = [task for task in tasks if task['id'] != task_id]
-    save_tasks_to_json(tasks)
+    task_scheduler.unschedule_task(scheduler, task_id)
+    task_store.delete(task_id)
     return jsonify({'message': 'Task deleted successfully'}), 200
 
-# JSON file path for storing scheduled tasks
-TASKS_JSON_FILE = 'tasks.json'
+# Tasks from the old tasks.json are imported into the database once
+task_store.migrate_json('tasks.json')
 
-# Define a function to save tasks to JSON
-def save_tasks_to_json(tasks):
-    with open(TASKS_JSON_FILE, 'w') as json_file:
-        json.dump(tasks, json_file, indent=4)
-
-# Define a function to load tasks from JSON
-def load_tasks_from_json():
-    try:
-        with open(TASKS_JSON_FILE, 'r') as json_file:
-            # Load tasks from JSON file if it's not empty
-            return json.load(json_file)
-    except FileNotFoundError:
-        # Return an empty list if the file doesn't exist yet
-        return []
-    except json.JSONDecodeError:
-        # Handle the case when the file contains invalid JSON data
-        logger.error('Error decoding JSON data from tasks.json')
-        return []
-
-# Call the load function on Flask app startup
-tasks = load_tasks_from_json()
-
-# Schedule loaded tasks with APScheduler
-for task in tasks:
-    try:
-        scheduled_datetime = datetime.fromisoformat(task['scheduled_time'])
-        scheduled_hour = scheduled_datetime.hour
-        scheduled_minute = scheduled_datetime.minute
-        scheduler.add_job(
-            execute_script,
-            'cron',
-            args=[task['script_id']],
-            id=str(task['id']),
-            name=task['name'],
-            hour=scheduled_hour,
-            minute=scheduled_minute
-        )
-    except Exception as e:
-        logger.error(f"Failed to schedule task {task['id']}: {str(e)}")
+# Start the scheduler on the persistent job store and add any task that has no job yet
+task_scheduler.configure(task_store, job_runner, execute_script)
+# Only one process runs the scheduler, even with several server workers
+scheduler_lock = task_scheduler.SchedulerLock(os.path.join(DATA_DIR, 'scheduler.lock'))
+task_scheduler.start_when_leader(scheduler, task_store, scheduler_lock)
+atexit.register(lambda: scheduler.running and scheduler.shutdown(wait=False))
 
 import os
 from flask import jsonify, request
@@ -519,96 +564,125 @@ def create_directory():
         logger.error(f"Error creating directory: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-# Function to scan the videos directory and organize clips by movie
-def scan_videos_directory(directory):
-    video_clips = {}
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.webm'):
-                movie_name = os.path.basename(root)
-                if movie_name not in video_clips:
-                    video_clips[movie_name] = []
-                video_clips[movie_name].append({'filename': file})
-    
-    # Sort video clips within each movie by filename
-    for movie_name, clips in video_clips.items():
-        video_clips[movie_name] = sorted(clips, key=lambda x: x['filename'])
-    
-    return video_clips
+# Batches of file operations run in the background; moves to another drive are copied with progress
+file_ops = FileOperations(os.path.join(DATA_DIR, 'file_ops'), workers=int(os.environ.get('STASHAID_FILE_OP_WORKERS', 8)))
+atexit.register(file_ops.shutdown)
+
+# Route to start a batch of mkdir/rename/move/delete operations, or list recent batches
+@app.route('/api/file_ops', methods=['GET', 'POST'])
+def api_file_ops():
+    if request.method == 'GET':
+        return jsonify({'batches': file_ops.list()})
+    data = request.get_json(silent=True) or {}
+    try:
+        batch = file_ops.submit(data.get('operations'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'id': batch.id, 'status': batch.status, 'url': url_for('api_file_ops_status', batch_id=batch.id)}), 202
+
+# Route to report a batch's progress, per operation
+@app.route('/api/file_ops/<batch_id>')
+def api_file_ops_status(batch_id):
+    batch = file_ops.describe(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(batch)
+
+# Route to cancel a batch; operations already finished are not undone
+@app.route('/api/file_ops/<batch_id>/cancel', methods=['POST'])
+def cancel_file_ops(batch_id):
+    if file_ops.cancel(batch_id) is None:
+        if file_ops.record(batch_id):
+            return jsonify({'error': 'Batch is running in another worker process'}), 409
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(file_ops.describe(batch_id)), 202
+
+# Persistent index of the clips under static/videos, refreshed by delta scans
+media_index = MediaIndex(VIDEO_BASE_DIR, os.path.join(DATA_DIR, 'media_index.db'))
+media_index.watch()
+
+# Function to read the page and page size from the query string
+def get_page_args(default_per_page=50, max_per_page=500):
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(max_per_page, max(1, request.args.get('per_page', default_per_page, type=int)))
+    return page, per_page
 
 # Route to serve the movies page
 @app.route('/movies')
 def movies():
-    # Path to the directory containing video clips
-    video_directory = os.path.join(app.static_folder, 'videos')
-    # Scan the videos directory
-    video_clips = scan_videos_directory(video_directory)
-    return render_template('movies.html', video_clips=video_clips)
-
-import flask
-import os
+    media_index.refresh_if_stale()
+    page, per_page = get_page_args()
+    video_clips = media_index.movies(page, per_page)
+    total = media_index.movie_count()
+    return render_template('movies.html', video_clips=video_clips, page=page, per_page=per_page, total=total)
+
+# Route to query the media index as JSON
+@app.route('/api/movies')
+def api_movies():
+    media_index.refresh_if_stale()
+    page, per_page = get_page_args()
+    return jsonify({
+        'page': page,
+        'per_page': per_page,
+        'total': media_index.movie_count(),
+        'movies': media_index.movies(page, per_page)
+    })
+
+# Cache lifetime for video clips; clients revalidate with ETag/Last-Modified afterwards
+VIDEO_MAX_AGE = int(os.environ.get('STASHAID_VIDEO_MAX_AGE', 3600))
+
+# Let a fronting nginx/Apache send the file itself (X-Sendfile) instead of the Python worker
+app.config['USE_X_SENDFILE'] = os.environ.get('STASHAID_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# Function to serve a clip from the videos directory with Range, ETag and Last-Modified support.
+# Passing a path (not an open file) lets the WSGI server use its file wrapper, i.e. sendfile().
+def send_video(relative_path):
+    video_path = safe_join(VIDEO_BASE_DIR, relative_path)
+    if video_path is None or not os.path.isfile(video_path):
+        logger.error(f"Video not found: {relative_path}")
+        abort(404)
+    mimetype = mimetypes.guess_type(video_path)[0] or 'video/webm'
+    response = send_file(video_path, mimetype=mimetype, conditional=True, etag=True, max_age=VIDEO_MAX_AGE)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
 
 # Route to serve video files
 @app.route('/static/videos/<movie>/<filename>')
 def serve_video(movie, filename):
-    try:
-        video_path = os.path.join(VIDEO_BASE_DIR, movie, filename)
-        
-        # Check if the video file exists
-        if not os.path.exists(video_path):
-            return 'Video not found', 404
-        
-        # Open the video file
-        video_file = open(video_path, 'rb')
-        video_size = os.path.getsize(video_path)
-        
-        # Serve the entire file without considering range requests
-        return flask.send_file(video_file, mimetype='video/webm')
-    except Exception as e:
-        # Log the error
-        logger.error(f"Error serving video {movie}/{filename}: {str(e)}")
-        # Close the file if it's open
-        if 'video_file' in locals():
-            video_file.close()
-        # Return a meaningful error response
-        return 'Error serving video', 500
+    return send_video(f'{movie}/{filename}')
 
 
 # Route to play video
 @app.route('/play_video/<path:filename>')
 def play_video(filename):
-    video_path = os.path.join(VIDEO_BASE_DIR, filename)
-    if os.path.exists(video_path):
-        try:
-            return send_from_directory(VIDEO_BASE_DIR, filename, mimetype='video/webm', as_attachment=False)
-        except Exception as e:
-            logger.error(f"Error playing video {filename}: {str(e)}")
-            abort(500)
-    else:
-        logger.error(f"Video not found: {filename}")
-        abort(404)
+    return send_video(filename)
 
 
-def convert_to_webm(input_file, output_file):
-    # Run FFmpeg command to convert video to WebM
-    subprocess.run(['ffmpeg', '-i', input_file, '-c:v', 'libvpx', '-b:v', '1M', '-c:a', 'libvorbis', output_file])
+# Background WebM conversion queue for the videos directory
+transcoder = Transcoder(
+    VIDEO_BASE_DIR,
+    os.path.join(DATA_DIR, 'transcode.db'),
+    workers=int(os.environ.get('STASHAID_TRANSCODE_WORKERS', 0)) or None,
+    keep_source=os.environ.get('STASHAID_KEEP_SOURCE', '').lower() in ('1', 'true', 'yes')
+)
+atexit.register(transcoder.shutdown)
 
-import os
-
-@app.route('/convert_to_webm')
+# Route to queue every MP4 under static/videos for conversion to WebM
+@app.route('/convert_to_webm', methods=['GET', 'POST'])
 def convert_to_webm():
-    video_dir = os.path.join(app.static_folder, 'videos')  # Directory containing MP4 files
-    for root, dirs, files in os.walk(video_dir):
-        for file in files:
-            if file.endswith('.mp4'):
-                mp4_path = os.path.join(root, file)
-                webm_path = os.path.splitext(mp4_path)[0] + '.webm'
-                try:
-                    subprocess.run(['ffmpeg', '-i', mp4_path, webm_path])
-                    os.remove(mp4_path)  # Remove the .mp4 file
-                except Exception as e:
-                    return jsonify({'error': str(e)}), 500
-    return jsonify({'message': 'Conversion to WebM completed successfully.'}), 200
+    try:
+        queued, skipped = transcoder.enqueue_directory()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'message': f'{queued} file(s) queued for conversion to WebM, {skipped} already converted.',
+        'status_url': url_for('transcode_status')
+    }), 202
+
+# Route to check conversion progress
+@app.route('/api/transcode')
+def transcode_status():
+    return jsonify(transcoder.status())
 
 # Start Flask app
 if __name__ == '__main__':
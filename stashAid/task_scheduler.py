@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import CancelledError
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.base import JobLookupError
+
+logger = logging.getLogger(__name__)
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+# Job defaults: a task never runs twice at once, missed runs collapse into one,
+# and a run that is late by more than the grace period is skipped
+DEFAULT_MISFIRE_GRACE = 300
+
+
+class TaskStore:
+    """Scheduled tasks and their run history, kept in SQLite next to the APScheduler job store."""
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                description TEXT,
+                scheduled_time TEXT NOT NULL,
+                script_id TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS task_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id INTEGER,
+                script_id TEXT NOT NULL,
+                job_id TEXT,
+                status TEXT NOT NULL,
+                returncode INTEGER,
+                started REAL NOT NULL,
+                ended REAL,
+                duration REAL
+            );
+            CREATE INDEX IF NOT EXISTS task_runs_task ON task_runs (task_id, started);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+
+    def list(self):
+        with self.lock:
+            return [dict(row) for row in self.db.execute(
+                'SELECT id, name, description, scheduled_time, script_id FROM tasks ORDER BY id')]
+
+    def get(self, task_id):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT id, name, description, scheduled_time, script_id FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return dict(row) if row else None
+
+    def add(self, name, description, scheduled_time, script_id, task_id=None):
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                'INSERT INTO tasks (id, name, description, scheduled_time, script_id, created) VALUES (?, ?, ?, ?, ?, ?)',
+                (task_id, name, description, scheduled_time, script_id, time.time())
+            )
+            task_id = cursor.lastrowid
+        return self.get(task_id)
+
+    def delete(self, task_id):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+
+    def migrate_json(self, json_path):
+        """One-time import of the old tasks.json, keeping the task ids."""
+        with self.lock:
+            done = self.db.execute("SELECT value FROM meta WHERE key = 'migrated_tasks_json'").fetchone()
+        if done:
+            return 0
+        try:
+            with open(json_path, 'r') as json_file:
+                old_tasks = json.load(json_file)
+        except FileNotFoundError:
+            old_tasks = []
+        except json.JSONDecodeError:
+            logger.error(f'Error decoding JSON data from {json_path}, not migrating it')
+            old_tasks = []
+
+        migrated = 0
+        for task in old_tasks:
+            try:
+                self.add(task['name'], task.get('description', ''), task['scheduled_time'], task['script_id'], task.get('id'))
+                migrated += 1
+            except (KeyError, sqlite3.IntegrityError) as e:
+                logger.error(f'Could not migrate task {task}: {str(e)}')
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_tasks_json', ?)", (str(time.time()),))
+        if migrated:
+            logger.info(f'Migrated {migrated} task(s) from {json_path}')
+        return migrated
+
+    def start_run(self, task_id, script_id, status='running', job_id=None):
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                'INSERT INTO task_runs (task_id, script_id, job_id, status, started) VALUES (?, ?, ?, ?, ?)',
+                (task_id, script_id, job_id, status, time.time())
+            )
+            return cursor.lastrowid
+
+    def finish_run(self, run_id, status, returncode=None, job_id=None):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                'UPDATE task_runs SET status = ?, returncode = ?, job_id = COALESCE(?, job_id), ended = ?, duration = ? - started WHERE id = ?',
+                (status, returncode, job_id, now, now, run_id)
+            )
+
+    def history(self, task_id=None, limit=100):
+        query = 'SELECT * FROM task_runs'
+        params = []
+        if task_id is not None:
+            query += ' WHERE task_id = ?'
+            params.append(task_id)
+        query += ' ORDER BY started DESC LIMIT ?'
+        params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query, params)]
+
+
+# The scheduler stores jobs by reference ('task_scheduler:run_task'), so the
+# function it calls lives here and finds the app's store and runner through this dict
+_context = {}
+_start_lock = threading.Lock()
+
+
+def configure(store, job_runner, start_job):
+    """start_job(script_id) must return a job from job_runner."""
+    _context.update(store=store, job_runner=job_runner, start_job=start_job)
+
+
+def run_task(task_id):
+    """Run one scheduled task and wait for it, so max_instances and history see the real duration."""
+    store = _context['store']
+    job_runner = _context['job_runner']
+    task = store.get(task_id)
+    if task is None:
+        logger.error(f'Scheduled task {task_id} no longer exists')
+        return
+
+    script_id = task['script_id']
+    with _start_lock:
+        if job_runner.running_anywhere(script_id):
+            # Another task or a manual run of the same script is still going, in this or another worker
+            run_id = store.start_run(task_id, script_id, status='skipped')
+            store.finish_run(run_id, 'skipped')
+            logger.warning(f"Skipping task '{task['name']}': script '{script_id}' is already running")
+            return
+
+        run_id = store.start_run(task_id, script_id)
+        try:
+            job = _context['start_job'](script_id)
+        except Exception as e:
+            store.finish_run(run_id, 'failed')
+            logger.error(f"Failed to start task '{task['name']}': {str(e)}")
+            return
+
+    try:
+        job.future.result()
+    except CancelledError:
+        pass
+    store.finish_run(run_id, job.status, job.returncode, job.id)
+    logger.info(f"Task '{task['name']}' {job.status}")
+
+
+def create_scheduler(db_path, misfire_grace_time=DEFAULT_MISFIRE_GRACE, max_workers=10):
+    return BackgroundScheduler(
+        jobstores={'default': SQLAlchemyJobStore(url=f'sqlite:///{os.path.abspath(db_path)}')},
+        executors={'default': {'type': 'threadpool', 'max_workers': max_workers}},
+        job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': misfire_grace_time}
+    )
+
+
+def schedule_task(scheduler, task):
+    scheduled_datetime = datetime.fromisoformat(task['scheduled_time'])
+    scheduler.add_job(
+        'task_scheduler:run_task',
+        'cron',
+        args=[task['id']],
+        id=str(task['id']),
+        name=task['name'],
+        hour=scheduled_datetime.hour,
+        minute=scheduled_datetime.minute,
+        replace_existing=True
+    )
+
+
+def unschedule_task(scheduler, task_id):
+    try:
+        scheduler.remove_job(str(task_id))
+    except JobLookupError:
+        pass  # Job not found in scheduler
+
+
+def sync_jobs(scheduler, store):
+    """Make the persisted job store match the tasks table.
+
+    Jobs that already exist are left alone so their stored next run time, and
+    with it misfire handling for runs missed while stashAid was down, survives.
+    """
+    tasks = store.list()
+    existing = {job.id for job in scheduler.get_jobs()}
+    for task in tasks:
+        if str(task['id']) in existing:
+            continue
+        try:
+            schedule_task(scheduler, task)
+        except Exception as e:
+            logger.error(f"Failed to schedule task {task['id']}: {str(e)}")
+    task_ids = {str(task['id']) for task in tasks}
+    for job_id in existing - task_ids:
+        scheduler.remove_job(job_id)
+
+
+class SchedulerLock:
+    """Exclusive lock file: with several server workers, only the holder runs the scheduler."""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    @property
+    def held(self):
+        return self.handle is not None
+
+    def acquire(self):
+        if self.handle is not None:
+            return True
+        handle = open(self.path, 'a+')
+        try:
+            if sys.platform == 'win32':
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self.handle = handle
+        return True
+
+
+def start_when_leader(scheduler, store, lock, retry=30, sync_interval=30):
+    """Run the scheduler's jobs in this process if it gets the lock, otherwise keep trying in the background
+    so another worker takes over when the current one exits.
+
+    Every process starts the scheduler, paused unless it leads: APScheduler only
+    writes jobs added or removed through a running scheduler to the shared job
+    store, so tasks changed through any worker reach the leader.
+    """
+    scheduler.start(paused=True)
+
+    def keep_in_sync():
+        # Other workers change the job store behind the leader's back; pick up
+        # their jobs and wake the scheduler so it sees new earliest run times
+        while scheduler.running:
+            time.sleep(sync_interval)
+            try:
+                sync_jobs(scheduler, store)
+                scheduler.wakeup()
+            except Exception as e:
+                logger.error(f'Failed to sync scheduled jobs: {str(e)}')
+
+    def lead():
+        sync_jobs(scheduler, store)
+        scheduler.resume()
+        threading.Thread(target=keep_in_sync, name='stashaid-scheduler-sync', daemon=True).start()
+        logger.info(f'Scheduler running in process {os.getpid()}')
+
+    if lock.acquire():
+        lead()
+        return True
+
+    def wait_for_lock():
+        while not lock.acquire():
+            time.sleep(retry)
+        lead()
+
+    threading.Thread(target=wait_for_lock, name='stashaid-scheduler-lock', daemon=True).start()
+    return False
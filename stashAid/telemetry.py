@@ -0,0 +1,138 @@
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TelemetryStore:
+    """Resource usage of script jobs, kept in SQLite.
+
+    job_samples is the time series written by the job runner's sampler (CPU,
+    memory and I/O of the script and its children every few seconds); job_usage
+    holds one summary row per finished job. Rows older than retention_days are
+    dropped as new jobs finish.
+    """
+
+    def __init__(self, db_path, retention_days=30):
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS job_samples (
+                job_id TEXT NOT NULL,
+                script_id TEXT NOT NULL,
+                time REAL NOT NULL,
+                wall REAL NOT NULL,
+                cpu_percent REAL NOT NULL,
+                cpu_seconds REAL NOT NULL,
+                rss INTEGER NOT NULL,
+                read_bytes INTEGER NOT NULL,
+                write_bytes INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_samples_job ON job_samples (job_id, time);
+            CREATE INDEX IF NOT EXISTS job_samples_time ON job_samples (time);
+            CREATE TABLE IF NOT EXISTS job_usage (
+                job_id TEXT PRIMARY KEY,
+                script_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started REAL NOT NULL,
+                ended REAL NOT NULL,
+                wall REAL NOT NULL,
+                cpu_seconds REAL NOT NULL,
+                avg_rss INTEGER,
+                peak_rss INTEGER,
+                read_bytes INTEGER NOT NULL,
+                write_bytes INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_usage_script ON job_usage (script_id, started);
+        ''')
+
+    def record_samples(self, samples):
+        """Job runner sample listener: one row per running job and sampling pass."""
+        rows = [(job.id, job.script_id, sample['time'], sample['wall'], sample['cpu_percent'], sample['cpu_seconds'],
+                 sample['rss'], sample['read_bytes'], sample['write_bytes']) for job, sample in samples]
+        if not rows:
+            return
+        with self.lock, self.db:
+            self.db.executemany('INSERT INTO job_samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def record_job(self, job):
+        """Job runner listener: summary of a finished job, then prune old rows."""
+        if not job.started:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO job_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                job.id, job.script_id, job.status, job.started, job.ended, job.ended - job.started, job.cpu_seconds,
+                job.rss_total // job.rss_samples if job.rss_samples else None, job.rss_peak or None,
+                job.read_bytes, job.write_bytes
+            ))
+            self.db.execute('DELETE FROM job_samples WHERE time < ?', (cutoff,))
+            self.db.execute('DELETE FROM job_usage WHERE started < ?', (cutoff,))
+
+    def scripts(self, since=None):
+        """Per-script totals and averages, most CPU time first."""
+        query = '''
+            SELECT script_id,
+                   COUNT(*) AS runs,
+                   SUM(wall) AS total_wall,
+                   AVG(wall) AS avg_wall,
+                   SUM(cpu_seconds) AS total_cpu_seconds,
+                   AVG(cpu_seconds) AS avg_cpu_seconds,
+                   AVG(avg_rss) AS avg_rss,
+                   MAX(peak_rss) AS peak_rss,
+                   SUM(read_bytes) AS read_bytes,
+                   SUM(write_bytes) AS write_bytes,
+                   MAX(started) AS last_run
+            FROM job_usage
+        '''
+        params = []
+        if since is not None:
+            query += ' WHERE started >= ?'
+            params.append(since)
+        query += ' GROUP BY script_id ORDER BY total_cpu_seconds DESC'
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query, params)]
+
+    def jobs(self, script_id=None, since=None, limit=100):
+        query = 'SELECT * FROM job_usage'
+        conditions, params = [], []
+        if script_id:
+            conditions.append('script_id = ?')
+            params.append(script_id)
+        if since is not None:
+            conditions.append('started >= ?')
+            params.append(since)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY started DESC LIMIT ?'
+        params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query, params)]
+
+    def samples(self, job_id):
+        with self.lock:
+            return [dict(row) for row in self.db.execute(
+                'SELECT time, wall, cpu_percent, cpu_seconds, rss, read_bytes, write_bytes FROM job_samples '
+                'WHERE job_id = ? ORDER BY time', (job_id,))]
+
+    def hourly_load(self, since=None):
+        """Average CPU percent and summed memory of all scripts by hour of day (local time),
+        to find quiet hours for scheduling."""
+        query = '''
+            SELECT CAST(strftime('%H', time, 'unixepoch', 'localtime') AS INTEGER) AS hour,
+                   COUNT(*) AS samples,
+                   AVG(cpu_percent) AS avg_cpu_percent,
+                   AVG(rss) AS avg_rss
+            FROM job_samples
+        '''
+        params = []
+        if since is not None:
+            query += ' WHERE time >= ?'
+            params.append(since)
+        query += ' GROUP BY hour ORDER BY hour'
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query, params)]
@@ -0,0 +1,61 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script_registry import ScriptRegistry  # noqa: E402
+
+
+def touch(path, mtime):
+    with open(path, 'w') as script_file:
+        script_file.write('')
+    os.utime(path, (mtime, mtime))
+
+
+class TestScriptRegistrySharedDatabase:
+    """Two registries on one database, as two server workers use it."""
+
+    def setup_registries(self, tmp_path):
+        scripts = tmp_path / 'python-scripts'
+        scripts.mkdir()
+        touch(scripts / 'first.py', 1000)
+        os.utime(scripts, (1000, 1000))
+        db_path = str(tmp_path / 'scripts.db')
+        return scripts, ScriptRegistry([str(scripts)], db_path), ScriptRegistry([str(scripts)], db_path)
+
+    def test_both_start_with_the_same_scripts(self, tmp_path):
+        scripts, first, second = self.setup_registries(tmp_path)
+
+        assert set(first.paths) == {'first'}
+        assert set(second.paths) == {'first'}
+
+    def test_added_script_reaches_the_other_registry(self, tmp_path):
+        scripts, first, second = self.setup_registries(tmp_path)
+        touch(scripts / 'second.py', 2000)
+        os.utime(scripts, (2000, 2000))
+
+        assert first.refresh() is True
+        assert set(first.paths) == {'first', 'second'}
+
+        # The directory mtime in the database already matches, only the generation tells it to reload
+        assert second.refresh() is True
+        assert set(second.paths) == {'first', 'second'}
+        assert second.get('second')['type'] == 'python'
+
+    def test_removed_script_leaves_the_other_registry(self, tmp_path):
+        scripts, first, second = self.setup_registries(tmp_path)
+        os.remove(scripts / 'first.py')
+        os.utime(scripts, (2000, 2000))
+
+        first.refresh()
+        second.refresh()
+
+        assert first.paths == {}
+        assert second.paths == {}
+
+    def test_refresh_without_changes_keeps_paths(self, tmp_path):
+        scripts, first, second = self.setup_registries(tmp_path)
+
+        assert first.refresh() is False
+        assert second.refresh() is False
+        assert set(second.paths) == {'first'}
@@ -0,0 +1,258 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from job_runner import process_alive, worker_identity
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg settings used for every clip
+WEBM_ARGS = ['-c:v', 'libvpx', '-b:v', '1M', '-c:a', 'libvorbis']
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_workers():
+    """ffmpeg is multi-threaded itself, so use about half the cores for parallel files."""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class TranscodeItem:
+    """A file this process is converting; progress is copied to the shared database as it goes."""
+
+    def __init__(self, key, source, output):
+        self.key = key
+        self.source = source
+        self.output = output
+        self.progress = 0.0
+        self.duration = None
+        self.saved = 0.0  # When progress was last written
+
+
+class Transcoder:
+    """Background WebM conversion queue for the videos directory.
+
+    Files are converted on a pool of workers, written to a temporary file and
+    moved into place only once ffmpeg succeeds. The queue lives in SQLite so
+    every server worker sees the same items: a worker claims a file before
+    converting it, and each converted source keeps its size and mtime so
+    repeated runs skip finished work.
+    """
+
+    def __init__(self, video_dir, db_path, workers=None, keep_source=False, extensions=('.mp4',), ffmpeg='ffmpeg', ffprobe='ffprobe'):
+        self.video_dir = video_dir
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.workers = workers or default_workers()
+        self.keep_source = keep_source
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.processes = {}  # key -> (ffmpeg process, temporary output) of conversions in progress
+        self.stopping = False
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stashaid-transcode')
+        self.lock = threading.Lock()
+        # Autocommit, so claims can take the database lock up front with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS items (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                output TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                error TEXT,
+                queued REAL,
+                started REAL,
+                ended REAL,
+                worker INTEGER,
+                worker_started REAL,
+                size INTEGER,
+                mtime REAL,
+                converted REAL
+            );
+            CREATE INDEX IF NOT EXISTS items_queued ON items (queued);
+        ''')
+
+    # Function to queue every source file under the videos directory that still needs converting
+    def enqueue_directory(self):
+        queued = skipped = 0
+        for root, dirs, files in os.walk(self.video_dir):
+            for file in files:
+                if not file.lower().endswith(self.extensions):
+                    continue
+                source = os.path.join(root, file)
+                if self.submit(source):
+                    queued += 1
+                else:
+                    skipped += 1
+        logger.info(f"Transcode queue: {queued} file(s) queued, {skipped} skipped")
+        return queued, skipped
+
+    def submit(self, source):
+        """Claim source for this worker and queue it, unless it is converted or another live worker has it."""
+        key = self._key(source)
+        output = os.path.splitext(source)[0] + '.webm'
+        worker, worker_started = worker_identity()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('SELECT * FROM items WHERE key = ?', (key,)).fetchone()
+                if row and row['status'] in (QUEUED, RUNNING) and process_alive(row['worker'], row['worker_started']):
+                    claimed = False
+                elif self._is_converted(source, output, row):
+                    claimed = False
+                else:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO items (key, source, output, status, queued, worker, worker_started) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, source, output, QUEUED, time.time(), worker, worker_started))
+                    claimed = True
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        if claimed:
+            self.executor.submit(self._convert, TranscodeItem(key, source, output))
+        return claimed
+
+    def status(self, limit=500):
+        """Counts and the most recently queued items, from every worker."""
+        with self.lock:
+            rows = [dict(row) for row in self.db.execute(
+                'SELECT * FROM items WHERE queued IS NOT NULL ORDER BY queued DESC LIMIT ?', (limit,))]
+        counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+        items = []
+        for row in rows:
+            if row['status'] in (QUEUED, RUNNING) and not process_alive(row['worker'], row['worker_started']):
+                row = self._abandon(row)
+            counts[row['status']] += 1
+            items.append({
+                'source': row['source'],
+                'output': row['output'],
+                'status': row['status'],
+                'progress': round(row['progress'], 3),
+                'error': row['error'],
+                'started': row['started'],
+                'ended': row['ended'],
+            })
+        return {'workers': self.workers, 'counts': counts, 'items': items}
+
+    def shutdown(self, grace=5):
+        """Stop queued and running conversions: ffmpeg gets SIGTERM, then SIGKILL after grace seconds."""
+        with self.lock:
+            self.stopping = True
+            running = list(self.processes.values())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for process, temp_output in running:
+            process.terminate()
+        deadline = time.time() + grace
+        for process, temp_output in running:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            # The converting thread may not get to clean up before the process exits
+            try:
+                os.remove(temp_output)
+            except FileNotFoundError:
+                pass
+        worker, worker_started = worker_identity()
+        with self.lock:
+            self.db.execute(
+                'UPDATE items SET status = ?, error = ?, ended = ? WHERE worker = ? AND worker_started IS ? AND status IN (?, ?)',
+                (FAILED, 'stashAid shut down before the conversion finished', time.time(), worker, worker_started, QUEUED, RUNNING))
+
+    def _abandon(self, row):
+        """Mark an item failed whose worker exited before converting it."""
+        error = f"Worker process {row['worker']} exited before the conversion finished"
+        ended = time.time()
+        with self.lock:
+            self.db.execute(
+                'UPDATE items SET status = ?, error = ?, ended = ? WHERE key = ? AND worker = ? AND status IN (?, ?)',
+                (FAILED, error, ended, row['key'], row['worker'], QUEUED, RUNNING))
+        return dict(row, status=FAILED, error=error, ended=ended)
+
+    def _is_converted(self, source, output, row):
+        if not os.path.exists(output):
+            return False
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return True
+        if row and row['converted']:
+            return row['size'] == stat.st_size and row['mtime'] == stat.st_mtime
+        # Converted before stashAid kept track
+        return os.path.getmtime(output) >= stat.st_mtime
+
+    def _update(self, item, **fields):
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self.lock:
+            self.db.execute(f'UPDATE items SET {assignments} WHERE key = ?', (*fields.values(), item.key))
+
+    def _convert(self, item):
+        self._update(item, status=RUNNING, started=time.time())
+        temp_output = os.path.join(os.path.dirname(item.output), f'.{os.path.basename(item.output)}.part')
+        try:
+            stat = os.stat(item.source)
+            item.duration = self._probe_duration(item.source)
+            command = [self.ffmpeg, '-hide_banner', '-nostats', '-loglevel', 'error', '-y', '-i', item.source,
+                       *WEBM_ARGS, '-f', 'webm', '-progress', 'pipe:1', temp_output]
+            with self.lock:
+                if self.stopping:
+                    raise RuntimeError('stashAid shut down before the conversion started')
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True)
+                self.processes[item.key] = (process, temp_output)
+            # Drain stderr alongside stdout, a full stderr pipe would stall ffmpeg
+            errors = deque(maxlen=20)
+            stderr_reader = threading.Thread(target=errors.extend, args=(process.stderr,), daemon=True)
+            stderr_reader.start()
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'out_time_us' and item.duration and value.isdigit():
+                    item.progress = min(1.0, int(value) / 1000000 / item.duration)
+                    if time.time() - item.saved >= 1:
+                        # At most one write a second, ffmpeg reports far more often
+                        item.saved = time.time()
+                        self._update(item, progress=item.progress)
+            returncode = process.wait()
+            stderr_reader.join()
+            if returncode != 0:
+                raise RuntimeError(''.join(errors).strip() or f'ffmpeg exited with {returncode}')
+
+            os.replace(temp_output, item.output)
+            self._update(item, status=DONE, progress=1.0, size=stat.st_size, mtime=stat.st_mtime,
+                         converted=time.time(), ended=time.time())
+            if not self.keep_source:
+                os.remove(item.source)
+            logger.info(f"Converted {item.source} to {item.output}")
+        except Exception as e:
+            self._update(item, status=FAILED, error=str(e), ended=time.time())
+            logger.error(f"Failed to convert {item.source}: {str(e)}")
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+        finally:
+            with self.lock:
+                self.processes.pop(item.key, None)
+
+    def _probe_duration(self, source):
+        try:
+            result = subprocess.run(
+                [self.ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', source],
+                capture_output=True, text=True, timeout=60
+            )
+            return float(result.stdout.strip())
+        except (OSError, ValueError, subprocess.SubprocessError):
+            return None
+
+    def _key(self, source):
+        return os.path.relpath(source, self.video_dir)